@@ -0,0 +1,87 @@
+import argparse
+import datetime
+import gc
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../files")))
+
+from matplotlib.lines import Line2D
+
+from EventStore import EventStore
+from synthetic_data import build_features
+
+class LineMapPoint(Line2D):
+    '''
+    The MapPoint as it was before, a matplotlib artist with the properties of the earthquake formatted when it is made
+    '''
+    def __init__(self, x, y, magnitude, place, time, felt, cdi, mmi, alert, tsunami, sig, title, status, dmin, gap, magtype, type_):
+        size_magnitude = magnitude if magnitude is not None else 0
+        markersize = math.pow(2, size_magnitude)/math.pow(2, size_magnitude//2)
+        if size_magnitude<=3: color="green"
+        elif 3<size_magnitude<=6: color="yellow"
+        else: color="red"
+        super().__init__(xdata=[x,], ydata=[y,],marker="o",markersize=markersize,color=color,alpha=.3,picker=markersize)
+
+        self.title = title
+        self.place = place
+        self.time = datetime.datetime.fromtimestamp(time/1000.0).isoformat()
+        self.magnitude = magnitude
+        self.felt = felt
+        self.cdi = cdi
+        self.mmi = mmi
+        self.alert = alert
+        self.tsunami = bool(tsunami)
+        self.sig = sig
+        self.status = status
+        self.dmin = dmin
+        self.gap = gap
+        self.magtype = magtype
+        self.type_ = type_
+
+def point_arguments(quake):
+    properties = quake["properties"]
+    x, y = quake["geometry"]["coordinates"][:2]
+    return (x, y, properties["mag"], properties["place"], properties["time"], properties["felt"], properties["cdi"],
+        properties["mmi"], properties["alert"], properties["tsunami"], properties["sig"], properties["title"],
+        properties["status"], properties["dmin"], properties["gap"], properties["magType"], properties["type"])
+
+def measure(build):
+    '''
+    function for measuring the time taken by build, and then the bytes it leaves allocated (in a second run,
+    as tracing the allocations slows it down)
+    '''
+    gc.collect()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter()-start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seconds, size
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare the size and construction time of the records of earthquakes")
+    parser.add_argument("-n", "--events", type=int, default=20000)
+    options = parser.parse_args(args)
+
+    features = build_features(options.events)
+    arguments = [point_arguments(quake) for quake in features]
+    builds = (
+        ("Line2D MapPoint (before)", lambda: [LineMapPoint(*point) for point in arguments]),
+        ("EventStore columns", lambda: EventStore(features)),
+    )
+    print("{} events".format(options.events))
+    for name, build in builds:
+        seconds, size = measure(build)
+        print("{:<26} {:8.0f} bytes per event {:8.1f} ms to build".format(name, size/options.events, seconds*1000))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
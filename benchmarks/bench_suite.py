@@ -0,0 +1,262 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+FILES_DIRECTORY = os.path.abspath(os.path.join(BENCHMARK_DIRECTORY, "../files"))
+RESULTS_DIRECTORY = os.path.join(BENCHMARK_DIRECTORY, "results")
+sys.path.insert(0, FILES_DIRECTORY)
+
+import matplotlib
+matplotlib.use("Agg") #the suite runs without a display, the map page's figure is drawn on an Agg canvas
+import numpy as np
+from matplotlib.backend_bases import MouseEvent
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import MapBackground
+import Tracing
+import WikiExtract
+from ClusterLayer import ClusterLayer
+from EventStore import EventStore
+from MapPage import MapPage
+from PointLayer import PointLayer, create_legend_handles
+
+import synthetic_data
+
+SIZES = (1000, 20000, 200000, 1000000)
+PICKS = 1000 #clicks resolved by every run of the pick benchmark, half of them on earthquakes
+ARTICLES = 100 #articles read by every run of the wiki extract benchmark
+
+class HeadlessMapPage:
+    '''
+    The figure of the MapPage on an Agg canvas instead of a tkinter window. Its plotting and picking methods
+    are the ones of the MapPage, so the benchmarks time the code the map page runs
+    '''
+    plot_points = MapPage.plot_points
+    redraw_changed_points = MapPage.redraw_changed_points
+    draw_point_layer = MapPage.draw_point_layer
+    update_background_detail = MapPage.update_background_detail
+    get_layer_artists = MapPage.get_layer_artists
+    current_view = MapPage.current_view
+    find_event_point = MapPage.find_event_point
+    on_view_changed = MapPage.on_view_changed
+
+    def __init__(self):
+        self.map_figure = Figure(figsize=MapBackground.MAP_FIGSIZE)
+        self.map_axes = self.map_figure.add_subplot(111)
+        self.map_axes_legend = self.map_axes.legend(handles=create_legend_handles(), loc="upper right")
+        self.map_axes.set_title(MapBackground.MAP_TITLE)
+        self.map_figure.tight_layout()
+
+        self.figure_basemap = MapBackground.load_basemap(MapBackground.MAP_OPTIONS)
+        self.background_image = MapBackground.draw_background(self.figure_basemap, self.map_axes)
+        self.vector_layers = None
+        self.map_background = None
+        self.background_view = None
+
+        self.point_layer = PointLayer(self.map_axes, self.figure_basemap)
+        self.cluster_layer = ClusterLayer(self.map_axes, self.point_layer)
+        self.hovered_target = None
+        self.hover_annotation = self.map_axes.annotate("", xy=(0, 0), xytext=(10, 10), textcoords="offset points",
+            bbox={"boxstyle": "round", "fc": "white", "alpha": .8}, zorder=6, visible=False)
+        self.points_background = None
+        self.map_axes.callbacks.connect("xlim_changed", self.on_view_changed)
+        self.map_axes.callbacks.connect("ylim_changed", self.on_view_changed)
+
+        self.figure_canvas = FigureCanvasAgg(self.map_figure)
+        self.figure_canvas.draw()
+        self.figure_toolbar = types.SimpleNamespace(mode="") #the toolbar is never panning or zooming
+
+def json_load_benchmark(events):
+    '''
+    The parse of the downloaded GeoJSON. refresh_plot used to load it from current_data.json, it is now
+    parsed once by SettingsPage.fetch_data and handed over in memory
+    '''
+    content = synthetic_data.build_content(events)
+    return (lambda: None), (lambda state: json.loads(content))
+
+def plot_points_benchmark(events):
+    '''
+    The first plot of a dataset by MapPage.plot_points, from the GeoJSON to the drawn figure
+    '''
+    data = synthetic_data.build_collection(events)
+    return HeadlessMapPage, (lambda page: page.plot_points(data))
+
+def event_store_benchmark(events):
+    '''
+    The construction of the EventStore columns the records of the earthquakes are read from, which replaced
+    a MapPoint for every earthquake of a dataset
+    '''
+    features = synthetic_data.build_features(events)
+    return (lambda: None), (lambda state: EventStore(features))
+
+def pick_benchmark(events):
+    '''
+    The resolution of PICKS clicks on the map by MapPage.find_event_point, half of them on earthquakes
+    and half of them anywhere on the map
+    '''
+    page = HeadlessMapPage()
+    page.plot_points(synthetic_data.build_collection(events))
+    generator = np.random.RandomState(0)
+    rows = generator.randint(len(page.point_layer), size=PICKS//2)
+    positions = np.column_stack((page.point_layer.xs[rows], page.point_layer.ys[rows]))
+    (x_min, x_max), (y_min, y_max) = page.map_axes.get_xlim(), page.map_axes.get_ylim()
+    positions = np.concatenate((positions, np.column_stack((generator.uniform(x_min, x_max, PICKS-len(rows)),
+        generator.uniform(y_min, y_max, PICKS-len(rows))))))
+    clicks = [MouseEvent("button_press_event", page.figure_canvas, x, y, button=1)
+        for x, y in page.map_axes.transData.transform(positions)]
+    return (lambda: None), (lambda state: [page.find_event_point(click) for click in clicks])
+
+def wiki_extract_benchmark(events):
+    '''
+    The text of ARTICLES wikipedia articles read the way PointInfoPage.get_wiki_text reads them
+    '''
+    html = synthetic_data.build_article()
+    return (lambda: None), (lambda state: [WikiExtract.parse_article(html).text() for article in range(ARTICLES)])
+
+#every benchmark with whether it is run for every size of dataset, and the operations timed by one run
+BENCHMARKS = {
+    "json_load": (json_load_benchmark, True, 1),
+    "plot_points": (plot_points_benchmark, True, 1),
+    "event_store": (event_store_benchmark, True, 1),
+    "pick": (pick_benchmark, True, PICKS),
+    "wiki_extract": (wiki_extract_benchmark, False, ARTICLES),
+}
+
+def reset_peak_rss():
+    '''
+    function for resetting the peak resident memory of the process (only possible on linux), returns whether it was reset
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+def read_rss():
+    '''
+    function for reading the current and peak resident memory of the process in bytes, None where it can not be read
+    '''
+    try:
+        with open("/proc/self/status") as status:
+            fields = dict(line.split(":", 1) for line in status)
+        return int(fields["VmRSS"].split()[0])*1024, int(fields["VmHWM"].split()[0])*1024
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError: #windows
+        return None, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None, peak if sys.platform == "darwin" else peak*1024 #kilobytes everywhere but macOS
+
+def measure(name, events, repeat):
+    '''
+    function for running one benchmark in this process. The wall time of every run and the peak resident memory
+    are taken first, with the stages timed by the tracer, then the allocations of one more run are traced
+    (as tracing the allocations slows it down)
+    '''
+    setup, sized, operations = BENCHMARKS[name]
+    prepare, run = setup(events)
+    gc.collect()
+    rss_before = read_rss()[0]
+    peak_reset = reset_peak_rss()
+    Tracing.shared_tracer.clear()
+    Tracing.enable()
+    times = []
+    for number in range(repeat):
+        state = prepare()
+        gc.collect()
+        start = time.perf_counter()
+        result = run(state)
+        times.append(time.perf_counter()-start)
+        del state, result
+    Tracing.disable()
+    peak_rss = read_rss()[1]
+    stages = {stage: stats["mean"] for stage, stats in Tracing.summary().items()}
+
+    state = prepare()
+    gc.collect()
+    tracemalloc.start()
+    result = run(state)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"benchmark": name, "events": events if sized else None, "operations": operations, "repeat": repeat,
+        "wall_min": min(times), "wall_median": statistics.median(times), "wall_max": max(times), "stages": stages,
+        "rss_before": rss_before, "peak_rss": peak_rss, "peak_rss_reset": peak_reset, "alloc_peak": peak,
+        "alloc_retained": retained}
+
+def run_child(name, events, repeat):
+    '''
+    function for running one benchmark in a new process, so the peak memory of every benchmark is its own
+    and nothing is left cached by the benchmarks before it
+    '''
+    command = [sys.executable, os.path.abspath(__file__), "--child", name, "--events", str(events or 0), "--repeat", str(repeat)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"benchmark": name, "events": events, "error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIRECTORY, capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def format_result(result):
+    events = "-" if result["events"] is None else result["events"]
+    if "error" in result:
+        return "{:<14} {:>9} failed: {}".format(result["benchmark"], events, " ".join(result["error"]))
+    return "{:<14} {:>9} {:>11.2f} ms {:>11.2f} ms {:>9} MB peak {:>9.1f} MB allocated".format(result["benchmark"], events,
+        result["wall_min"]*1000, result["wall_median"]*1000,
+        "-" if result["peak_rss"] is None else "{:.1f}".format(result["peak_rss"]/1024/1024), result["alloc_peak"]/1024/1024)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Time the stages of plotting and looking up earthquakes on synthetic USGS datasets, "
+        "and write the results to a JSON file that can be compared with compare_results.py")
+    parser.add_argument("-b", "--benchmarks", nargs="+", choices=tuple(BENCHMARKS), default=tuple(BENCHMARKS))
+    parser.add_argument("-s", "--sizes", nargs="+", type=int, default=SIZES, help="numbers of events of the datasets")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timed runs of every benchmark")
+    parser.add_argument("-o", "--output", help="results file, by default results/<commit>.json")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--events", type=int, default=0, help=argparse.SUPPRESS)
+    options = parser.parse_args(args)
+
+    os.chdir(FILES_DIRECTORY) #the basemap and background image are cached in the map_cache folder the program uses
+    if options.child:
+        print(json.dumps(measure(options.child, options.events, options.repeat)))
+        return 0
+
+    commit = git_commit()
+    output = options.output or os.path.join(RESULTS_DIRECTORY, "{}.json".format(commit[:12] if commit else
+        datetime.datetime.now().strftime("%Y%m%d-%H%M%S")))
+    print("{:<14} {:>9} {:>14} {:>14}".format("Benchmark", "Events", "Best", "Median"))
+    results = []
+    for name in options.benchmarks:
+        for events in (sorted(options.sizes) if BENCHMARKS[name][1] else (None,)):
+            result = run_child(name, events, options.repeat)
+            print(format_result(result), flush=True)
+            results.append(result)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as out_file:
+        json.dump({"commit": commit, "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "platform": platform.platform(), "numpy": np.__version__,
+            "matplotlib": matplotlib.__version__, "results": results}, out_file, indent=1)
+    print("Results written to {}".format(output))
+    return 1 if any("error" in result for result in results) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,62 @@
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../files")))
+
+from bs4 import BeautifulSoup as BS4
+
+import WikiExtract
+from synthetic_data import build_article
+
+def soup_text(html):
+    '''
+    function for getting the text of an article the way PointInfoPage.get_wiki_text did before, with two BeautifulSoup
+    trees of the same html (one to look for redirects, one for the text) and the text joined with +=
+    '''
+    soup = BS4(html, features="lxml")
+    data = soup.find("p").getText()
+    if "Redirect to:" in data:
+        raise ValueError("the benchmark article is not a redirect")
+    soup = BS4(html, features="lxml")
+    all_text = ""
+    for string in soup.find_all("p"):
+        if "\n" not in string:
+            all_text += string.get_text()
+    return "".join(re.split(r"\[\d+\]", all_text))
+
+def extract_text(html):
+    '''
+    function for getting the text of an article the way PointInfoPage.get_wiki_text does now, in one pass over the html
+    '''
+    article = WikiExtract.parse_article(html)
+    if "Redirect to:" in article.first_paragraph():
+        raise ValueError("the benchmark article is not a redirect")
+    return article.text()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare the time taken to read the text of a wikipedia article")
+    parser.add_argument("-n", "--number", type=int, default=200, help="calls timed in every repeat")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-p", "--paragraphs", type=int, default=8, help="paragraphs in the benchmark article")
+    options = parser.parse_args(args)
+
+    html = build_article(options.paragraphs)
+    if soup_text(html) != extract_text(html):
+        print("The two ways of reading the article give different text")
+        return 1
+
+    print("Article of {} KB".format(len(html)//1024))
+    results = {}
+    for name, function in (("BeautifulSoup (lxml, two parses)", soup_text), ("WikiExtract (one pass)", extract_text)):
+        best = min(timeit.repeat(lambda: function(html), number=options.number, repeat=options.repeat))/options.number
+        results[name] = best
+        print("{:<34} {:8.3f} ms per article".format(name, best*1000))
+    slow, fast = results.values()
+    print("{:.1f}x faster".format(slow/fast))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,67 @@
+import argparse
+import json
+import sys
+
+#the measurements compared, with the name they are printed under
+METRICS = (("wall_median", "median time"), ("peak_rss", "peak RSS"), ("alloc_peak", "allocated"))
+
+def load_results(path):
+    '''
+    function for loading a results file written by bench_suite.py, returns its header and its results
+    keyed by (benchmark, events)
+    '''
+    with open(path) as results_file:
+        data = json.load(results_file)
+    return data, {(result["benchmark"], result["events"]): result for result in data["results"]}
+
+def compare(before, after, threshold):
+    '''
+    function for comparing the results of two runs, returns the rows to print and the regressions, the measurements
+    that grew by more than threshold (a fraction, 0.1 is 10%)
+    '''
+    rows, regressions = [], []
+    for key in sorted(set(before) & set(after), key=lambda key: (key[0], key[1] or 0)):
+        old, new = before[key], after[key]
+        if "error" in old or "error" in new:
+            rows.append((key, None))
+            continue
+        changes = {}
+        for metric, label in METRICS:
+            if not old.get(metric) or new.get(metric) is None: #the peak RSS can not be read everywhere
+                changes[metric] = None
+                continue
+            changes[metric] = new[metric]/old[metric]-1
+            if changes[metric] > threshold:
+                regressions.append((key, label, changes[metric]))
+        rows.append((key, changes))
+    return rows, regressions
+
+def format_change(change):
+    return "{:>12}".format("-" if change is None else "{:+.1%}".format(change))
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Compare two results files of bench_suite.py, exits with 1 if any "
+        "benchmark got slower or used more memory by more than the threshold")
+    parser.add_argument("before", help="results file of the baseline commit")
+    parser.add_argument("after", help="results file of the commit being checked")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1, help="largest growth allowed, 0.1 is 10%%")
+    options = parser.parse_args(args)
+
+    (old_data, before), (new_data, after) = load_results(options.before), load_results(options.after)
+    print("{} -> {}".format(old_data["commit"], new_data["commit"]))
+    print("{:<14} {:>9}".format("Benchmark", "Events")+"".join("{:>13}".format(label) for metric, label in METRICS))
+    rows, regressions = compare(before, after, options.threshold)
+    for (name, events), changes in rows:
+        line = "{:<14} {:>9}".format(name, "-" if events is None else events)
+        print(line+(" failed" if changes is None else " "+" ".join(format_change(changes[metric]) for metric, label in METRICS)))
+    for name, events in sorted(set(before) ^ set(after), key=lambda key: (key[0], key[1] or 0)):
+        print("{:<14} {:>9} only in {}".format(name, "-" if events is None else events,
+            options.before if (name, events) in before else options.after))
+
+    for (name, events), label, change in regressions:
+        print("Regression: {} ({} events) {} {:+.1%}".format(name, "-" if events is None else events, label, change),
+            file=sys.stderr)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
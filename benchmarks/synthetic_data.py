@@ -0,0 +1,87 @@
+import json
+
+import numpy as np
+
+END_TIME = 1565623083430 #the newest earthquake of every dataset, in milliseconds since the epoch
+SPAN = 30*24*60*60*1000 #the datasets cover the 30 days before END_TIME, like the month feeds
+NETWORKS = ("ak", "ci", "hv", "nc", "nn", "pr", "us", "uu", "uw")
+#centres of activity (longitude, latitude, spread in degrees) that most earthquakes are scattered around, the rest are
+#spread over the whole map so that the map has both dense clusters and lone earthquakes
+HOTSPOTS = ((-150.0, 61.5, 2.0), (-117.6, 35.7, 0.5), (-155.3, 19.4, 0.3), (-122.8, 38.8, 0.3), (-66.9, 18.0, 0.4),
+    (-178.0, -18.0, 3.0), (142.4, 38.3, 2.5), (121.0, 23.5, 1.5), (-71.5, -30.5, 3.0), (27.5, 38.5, 2.0))
+HOTSPOT_SHARE = 0.8
+DIRECTIONS = ("N", "NNE", "NE", "ENE", "E", "ESE", "SE", "SSE", "S", "SSW", "SW", "WSW", "W", "WNW", "NW", "NNW")
+
+def build_features(count, seed=0):
+    '''
+    function for building count GeoJSON features shaped like the ones of the USGS feeds, newest first. The magnitudes
+    follow the Gutenberg-Richter law (ten times fewer earthquakes for every step up in magnitude) and the same seed
+    always gives the same features
+    '''
+    generator = np.random.RandomState(seed) #default_rng needs numpy 1.17, newer than the version in the README
+    hotspots = np.array(HOTSPOTS)
+    spots = generator.randint(len(HOTSPOTS), size=count)
+    scattered = generator.random_sample(count) < HOTSPOT_SHARE
+    lons = np.where(scattered, hotspots[spots, 0]+generator.normal(size=count)*hotspots[spots, 2], generator.uniform(-180, 180, count))
+    lats = np.where(scattered, hotspots[spots, 1]+generator.normal(size=count)*hotspots[spots, 2], generator.uniform(-85, 85, count))
+    lons, lats = (lons+180) % 360-180, np.clip(lats, -89.9, 89.9)
+    depths = np.round(generator.exponential(15, count), 2)
+    magnitudes = np.round(np.minimum(0.5+generator.exponential(1/np.log(10), count), 9.5), 2)
+    times = END_TIME-np.sort(generator.randint(SPAN, size=count, dtype=np.int64))
+    updated = times+generator.randint(60000, 3600000, size=count)
+    felt = np.where(generator.random_sample(count) < 0.05, generator.randint(1, 500, size=count), -1)
+    networks = generator.randint(len(NETWORKS), size=count)
+    distances = generator.randint(1, 200, size=count)
+    directions = generator.randint(len(DIRECTIONS), size=count)
+    towns = generator.randint(max(count//20, 1), size=count) #many earthquakes share a place
+
+    features = []
+    for row in range(count):
+        network = NETWORKS[networks[row]]
+        code = "{:08d}".format(row)
+        event_id = network+code
+        magnitude = float(magnitudes[row])
+        place = "{}km {} of Town {}, Region {}".format(distances[row], DIRECTIONS[directions[row]], towns[row], towns[row] % 60)
+        reviewed = magnitude >= 2.5
+        features.append({"type": "Feature", "properties": {"mag": magnitude, "place": place, "time": int(times[row]),
+            "updated": int(updated[row]), "tz": None, "url": "https://earthquake.usgs.gov/earthquakes/eventpage/"+event_id,
+            "detail": "https://earthquake.usgs.gov/earthquakes/feed/v1.0/detail/{}.geojson".format(event_id),
+            "felt": int(felt[row]) if felt[row] >= 0 else None, "cdi": round(magnitude*0.8, 1) if felt[row] >= 0 else None,
+            "mmi": round(magnitude*0.9, 3) if magnitude >= 4 else None, "alert": "green" if magnitude >= 5.5 else None,
+            "status": "reviewed" if reviewed else "automatic", "tsunami": int(magnitude >= 7), "sig": int(magnitude**2*14),
+            "net": network, "code": code, "ids": ",{},".format(event_id), "sources": ",{},".format(network),
+            "types": ",origin,phase-data,", "nst": int(distances[row]//4) or None, "dmin": round(float(distances[row])/111, 4),
+            "rms": 0.42, "gap": 82, "magType": "mb" if magnitude >= 4 else "ml", "type": "earthquake",
+            "title": "M {} - {}".format(magnitude, place)},
+            "geometry": {"type": "Point", "coordinates": [round(float(lons[row]), 4), round(float(lats[row]), 4), float(depths[row])]},
+            "id": event_id})
+    return features
+
+def build_collection(count, seed=0):
+    '''
+    function for building a FeatureCollection of count earthquakes with the metadata the USGS gives
+    '''
+    features = build_features(count, seed)
+    return {"type": "FeatureCollection", "metadata": {"generated": END_TIME, "url":
+        "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/all_month.geojson", "title": "USGS All Earthquakes, Past Month",
+        "status": 200, "api": "1.8.1", "count": count}, "features": features}
+
+def build_content(count, seed=0):
+    '''
+    function for building the raw bytes of a FeatureCollection of count earthquakes, as they are downloaded
+    '''
+    return json.dumps(build_collection(count, seed), separators=(",", ":")).encode("utf-8")
+
+def build_article(paragraphs=8, infobox_rows=40):
+    '''
+    function for building html the size and shape of a parsed wikipedia lead section, an infobox followed by
+    paragraphs full of links and appendix links
+    '''
+    rows = "".join('<tr><th scope="row">Row {0}</th><td><a href="/wiki/Item_{0}">Item {0}</a> &amp; more</td></tr>'.format(row)
+        for row in range(infobox_rows))
+    sentence = ('The <a href="/wiki/Town" title="Town">town</a> lies in the <a href="/wiki/Valley">valley</a> of the '
+        '<i>river</i>, near the <a href="/wiki/Coast">coast</a>.<sup class="reference"><a href="#cite_note-{0}">[{0}]</a></sup> ')
+    body = "".join("<p>{}</p>\n".format("".join(sentence.format(number*10+part) for part in range(6)))
+        for number in range(paragraphs))
+    return ('<div class="mw-parser-output"><table class="infobox vcard"><tbody>{}</tbody></table>\n'
+        '<p class="mw-empty-elt">\n</p>\n{}</div>'.format(rows, body))
@@ -0,0 +1,177 @@
+#renders earthquake maps without a display, using the same projection and styling as the map page, e.g.
+#python BatchRender.py current_data.json "https://earthquake.usgs.gov/...geojson" -o maps --format png svg
+#    --region japan=128,30,146,46 --region chile=-78,-45,-66,-17
+import argparse
+import concurrent.futures
+import copy
+import hashlib
+import json
+import os
+import re
+import time
+from urllib.parse import urlparse
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import MapBackground
+from PointLayer import PointLayer, create_legend_handles
+
+OUTPUT_FORMATS = ("png", "svg")
+
+#the basemap loaded once by every worker process, so it is not loaded again for every map it renders
+_worker_basemap = None
+
+def init_worker(map_options):
+    '''
+    function run once when a worker process of the pool starts
+    '''
+    global _worker_basemap
+    _worker_basemap = MapBackground.load_basemap(map_options)
+
+def is_url(source):
+    '''
+    function for checking whether a source is a query url rather than a file
+    '''
+    return urlparse(source).scheme in ("http", "https")
+
+def load_geojson(source):
+    '''
+    function for reading the GeoJSON of either a file or a query url
+    '''
+    if is_url(source):
+        import HttpClient #only needed when a url is rendered
+        response = HttpClient.get(source)
+        response.raise_for_status()
+        return response.json()
+    with open(source, "r") as json_file:
+        return json.load(json_file)
+
+def output_name(source, region_name=None):
+    '''
+    function for naming the output of a source, files keep their name and urls are named after the
+    last part of their path, with a short hash of the url so different queries do not overwrite each other
+    '''
+    if is_url(source):
+        path_name = os.path.splitext(os.path.basename(urlparse(source).path))[0] or "query"
+        name = "{}_{}".format(path_name, hashlib.sha1(source.encode("utf-8")).hexdigest()[:8])
+    else:
+        name = os.path.splitext(os.path.basename(source))[0]
+    name = re.sub(r"[^\w.-]", "_", name)
+    return "{}_{}".format(name, region_name) if region_name else name
+
+def parse_region(text):
+    '''
+    function for parsing a region argument in the form name=minlon,minlat,maxlon,maxlat
+    '''
+    name, _, bounds = text.partition("=")
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bounds.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("regions must look like name=minlon,minlat,maxlon,maxlat")
+    if not name or min_lon >= max_lon or min_lat >= max_lat:
+        raise argparse.ArgumentTypeError("region '{}' needs a name and min values below max values".format(text))
+    return name, (min_lon, min_lat, max_lon, max_lat)
+
+def render_map(basemap, data, output_paths, region=None, map_options=MapBackground.MAP_OPTIONS, dpi=None):
+    '''
+    function for drawing the earthquakes of a GeoJSON feature collection onto an off screen figure and
+    saving it to every path in output_paths, the format is taken from the file extension
+    '''
+    figure = Figure(figsize=MapBackground.MAP_FIGSIZE)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    axes.legend(handles=create_legend_handles(), loc="upper right")
+    axes.set_title(MapBackground.MAP_TITLE)
+    figure.tight_layout()
+
+    if region is None:
+        MapBackground.draw_background(basemap, axes, map_options)
+    else: #the cached background is too coarse once zoomed in, so the layers of a region are drawn as vectors
+        MapBackground.draw_static_layers(copy.copy(basemap), axes)
+        MapBackground.draw_grid(basemap, axes)
+    point_layer = PointLayer(axes, basemap)
+    point_layer.set_features(data["features"])
+    if region is not None:
+        min_lon, min_lat, max_lon, max_lat = region
+        x_min, y_min = basemap(min_lon, max(min_lat, map_options["llcrnrlat"]))
+        x_max, y_max = basemap(max_lon, min(max_lat, map_options["urcrnrlat"]))
+        axes.set_xlim(x_min, x_max)
+        axes.set_ylim(y_min, y_max)
+
+    for path in output_paths:
+        figure.savefig(path, dpi=dpi or MapBackground.BACKGROUND_DPI)
+    return len(point_layer)
+
+def render_job(source, output_paths, region=None, map_options=MapBackground.MAP_OPTIONS, dpi=None):
+    '''
+    function run by the worker processes for a single source and region, returns the number of earthquakes
+    plotted and how long it took
+    '''
+    start = time.perf_counter()
+    basemap = _worker_basemap if _worker_basemap is not None else MapBackground.load_basemap(map_options)
+    count = render_map(basemap, load_geojson(source), output_paths, region, map_options, dpi)
+    return count, time.perf_counter()-start
+
+def render_all(sources, output_directory, formats=("png",), regions=None, workers=None, dpi=None,
+        map_options=MapBackground.MAP_OPTIONS):
+    '''
+    function for rendering every source (once per region) across a pool of processes, returns a list of
+    (source, output paths, count or error, seconds) in the order the jobs were given
+    '''
+    os.makedirs(output_directory, exist_ok=True)
+    regions = regions or [(None, None)]
+    jobs = []
+    for source in sources:
+        for region_name, region in regions:
+            name = output_name(source, region_name)
+            jobs.append((source, [os.path.join(output_directory, "{}.{}".format(name, file_format))
+                for file_format in formats], region))
+
+    #the basemap pickle and background image are written to the disk cache before the pool starts,
+    #so the workers only load them rather than all building them at the same time
+    basemap = MapBackground.load_basemap(map_options)
+    MapBackground.load_background(basemap, map_options, MapBackground.MAP_FIGSIZE)
+
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+            initargs=(map_options,)) as executor:
+        futures = [executor.submit(render_job, source, paths, region, map_options, dpi)
+            for source, paths, region in jobs]
+        for (source, paths, region), future in zip(jobs, futures):
+            try:
+                count, seconds = future.result()
+            except Exception as error: #one bad source should not stop the other maps from rendering
+                results.append((source, paths, error, 0))
+            else:
+                results.append((source, paths, count, seconds))
+    return results
+
+def main(args=None):
+    '''
+    function for the command line, returns 1 if any map could not be rendered
+    '''
+    parser = argparse.ArgumentParser(description="Render earthquake GeoJSON files or query urls to map images")
+    parser.add_argument("sources", nargs="+", help="GeoJSON files or USGS query urls")
+    parser.add_argument("-o", "--output", default="maps", help="directory the images are written to")
+    parser.add_argument("-f", "--format", nargs="+", choices=OUTPUT_FORMATS, default=["png"], dest="formats")
+    parser.add_argument("-r", "--region", action="append", type=parse_region, dest="regions",
+        help="render only a region, as name=minlon,minlat,maxlon,maxlat (can be given more than once)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--dpi", type=int, default=None)
+    options = parser.parse_args(args)
+
+    start = time.perf_counter()
+    results = render_all(options.sources, options.output, options.formats, options.regions, options.workers, options.dpi)
+    failed = 0
+    for source, paths, count, seconds in results:
+        if isinstance(count, Exception):
+            failed += 1
+            print("Failed to render {}: {}".format(source, count))
+        else:
+            print("{} earthquakes from {} -> {} ({:.2f}s)".format(count, source, ", ".join(paths), seconds))
+    print("{} maps rendered in {:.2f}s".format(len(results)-failed, time.perf_counter()-start))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
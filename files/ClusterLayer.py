@@ -0,0 +1,175 @@
+import math
+
+import numpy as np
+
+import Tracing
+from PointLayer import POINT_COLORS
+from SpatialIndex import KDTree
+
+#opaque versions of the legend colours, so that clusters stand out from the individual earthquakes
+CLUSTER_COLORS = POINT_COLORS.copy()
+CLUSTER_COLORS[:, 3] = .7
+
+def calculate_cluster_radii(counts):
+    '''
+    function for calculating the marker radius (in points) of clusters, growing with the number of earthquakes in them
+    '''
+    return 3+1.5*np.log2(np.maximum(counts, 1))
+
+class ClusterTree:
+    '''
+    Precomputed grid clusters of the earthquakes at several zoom levels. Level 0 splits the map into BASE_CELLS
+    columns and every following level halves the cell size, so every cell is split into four cells at the next
+    level. For each level the number of earthquakes, their centre and their largest magnitude is stored per cell
+    '''
+    BASE_CELLS = 8
+    MAX_LEVEL = 10
+
+    def __init__(self, xs, ys, magnitudes, extent):
+        self.x_min, self.x_max, self.y_min, self.y_max = extent
+        self.levels = []
+        self.indexes = {} #spatial indexes of the cluster centres, only built for levels that are hovered over
+
+        xs, ys = np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+        magnitudes = np.nan_to_num(np.asarray(magnitudes, dtype=float))
+        for level in range(self.MAX_LEVEL+1):
+            cell_size = self.cell_size(level)
+            columns = ((xs-self.x_min)//cell_size).astype(np.int64)
+            rows = ((ys-self.y_min)//cell_size).astype(np.int64)
+            keys = rows*(self.BASE_CELLS*2**level+1)+columns
+            cells, members = np.unique(keys, return_inverse=True)
+
+            counts = np.bincount(members, minlength=len(cells))
+            max_magnitudes = np.full(len(cells), -np.inf)
+            np.maximum.at(max_magnitudes, members, magnitudes)
+            firsts = np.zeros(len(cells), dtype=np.int64)
+            firsts[members[::-1]] = np.arange(len(members))[::-1] #the first earthquake of every cluster
+
+            self.levels.append({"xs": np.bincount(members, xs, len(cells))/np.maximum(counts, 1),
+                "ys": np.bincount(members, ys, len(cells))/np.maximum(counts, 1),
+                "counts": counts, "max_magnitudes": max_magnitudes, "firsts": firsts})
+
+    def cell_size(self, level):
+        return (self.x_max-self.x_min)/(self.BASE_CELLS*2**level)
+
+    def level_for_view(self, view_width, target_cells):
+        '''
+        Method for choosing the level whose cells are small enough to have roughly target_cells across the view,
+        returns None once the view is zoomed in further than the last level (earthquakes are no longer clustered)
+        '''
+        if view_width <= 0:
+            return None
+        level = math.ceil(math.log2(target_cells*(self.x_max-self.x_min)/(self.BASE_CELLS*view_width)))
+        if level > self.MAX_LEVEL:
+            return None
+        return max(level, 0)
+
+    def nearest(self, level, x, y, max_distance):
+        '''
+        Method for finding the cluster centre of a level nearest to (x, y)
+        '''
+        if level not in self.indexes:
+            self.indexes[level] = KDTree(self.levels[level]["xs"], self.levels[level]["ys"])
+        return self.indexes[level].nearest(x, y, max_distance)
+
+class ClusterLayer:
+    '''
+    Draws the clusters of the level that suits the current view of the map in place of the individual earthquakes,
+    sized by the number of earthquakes in them and coloured by their largest magnitude, with their count as a label
+    '''
+    TARGET_CELLS = 12 #roughly how many clusters fit across the view
+    MAX_LABELS = 150
+
+    def __init__(self, axes, point_layer):
+        self.axes = axes
+        self.point_layer = point_layer
+        self.enabled = False
+        self.tree = None
+        self.level = None
+        self.labels = []
+        self.collection = self.axes.scatter([], [], s=[], marker="o", facecolors=CLUSTER_COLORS[:0],
+            edgecolors="black", linewidths=.5, zorder=3, visible=False)
+
+    def artists(self):
+        return [self.collection]+self.labels
+
+    def set_enabled(self, enabled):
+        '''
+        Method for switching between showing clusters and showing every earthquake
+        '''
+        self.enabled = enabled
+        if enabled and self.tree is None:
+            self.build_tree()
+        self.update_view(force=True)
+
+    def set_points(self):
+        '''
+        Method for rebuilding the clusters after the point layer was given new earthquakes, the clusters of
+        every level are calculated here so that zooming only has to pick a level
+        '''
+        self.tree = None
+        if self.enabled:
+            self.build_tree()
+        self.update_view(force=True)
+
+    @Tracing.traced("cluster_build")
+    def build_tree(self):
+        basemap = self.point_layer.basemap
+        self.tree = ClusterTree(self.point_layer.xs, self.point_layer.ys, self.point_layer.magnitudes,
+            (basemap.xmin, basemap.xmax, basemap.ymin, basemap.ymax))
+
+    def update_view(self, force=False):
+        '''
+        Method called whenever the view of the map changes, chooses the cluster level for the visible extent
+        '''
+        x_min, x_max = self.axes.get_xlim()
+        level = self.tree.level_for_view(x_max-x_min, self.TARGET_CELLS) if self.enabled else None
+
+        self.point_layer.collection.set_visible(level is None)
+        self.collection.set_visible(level is not None)
+        if level is not None and (force or level != self.level):
+            cluster = self.tree.levels[level]
+            radii = calculate_cluster_radii(cluster["counts"]) #single earthquakes are drawn as the smallest clusters
+            categories = np.where(cluster["max_magnitudes"]<=3, 0, np.where(cluster["max_magnitudes"]<=6, 1, 2))
+            self.collection.set_offsets(np.column_stack((cluster["xs"], cluster["ys"])))
+            self.collection.set_sizes(radii**2)
+            self.collection.set_facecolors(CLUSTER_COLORS[categories])
+        self.level = level
+        self.update_labels()
+
+    def update_labels(self):
+        '''
+        Method for labelling the largest clusters inside the view with the number of earthquakes in them
+        '''
+        shown = 0
+        if self.level is not None:
+            cluster = self.tree.levels[self.level]
+            (x_min, x_max), (y_min, y_max) = self.axes.get_xlim(), self.axes.get_ylim()
+            inside = np.flatnonzero((cluster["counts"] > 1) & (cluster["xs"] >= x_min) & (cluster["xs"] <= x_max)
+                & (cluster["ys"] >= y_min) & (cluster["ys"] <= y_max))
+            inside = inside[np.argsort(cluster["counts"][inside])[::-1][:self.MAX_LABELS]]
+
+            for shown, index in enumerate(inside, 1):
+                if shown > len(self.labels):
+                    self.labels.append(self.axes.text(0, 0, "", ha="center", va="center", fontsize=7,
+                        zorder=4, clip_on=True))
+                label = self.labels[shown-1]
+                label.set_position((cluster["xs"][index], cluster["ys"][index]))
+                label.set_text(str(cluster["counts"][index]))
+                label.set_visible(True)
+
+        for label in self.labels[shown:]:
+            label.set_visible(False)
+
+    def find_cluster(self, x, y, data_per_point):
+        '''
+        Method for finding the cluster under the map position (x, y), returns its level data and index
+        '''
+        if self.level is None or not len(self.tree.levels[self.level]["counts"]):
+            return None, None
+        cluster = self.tree.levels[self.level]
+        max_radius = calculate_cluster_radii(cluster["counts"].max())*data_per_point
+        index, distance = self.tree.nearest(self.level, x, y, max_radius)
+        if index is None or distance > calculate_cluster_radii(cluster["counts"][index])*data_per_point:
+            return None, None
+        return cluster, index
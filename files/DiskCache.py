@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+CACHE_DIRECTORY = "data_cache"
+
+class DiskCache:
+    '''
+    A persistent key/value cache of bytes stored in a SQLite file. Every entry expires after its own time to live,
+    and once the stored size goes over max_bytes the least recently used entries are removed. Values are
+    compressed as the GeoJSON responses shrink to a fraction of their size
+    '''
+    def __init__(self, filename, max_bytes=200*1024*1024):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.lock = threading.Lock() #the cache is shared with fetches running on other threads
+
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL,
+            size INTEGER NOT NULL, expires REAL NOT NULL, last_used REAL NOT NULL)''')
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def get(self, key, now=None):
+        '''
+        Method for getting the value stored under a key, returns None if there is no value or it has expired
+        '''
+        now = now or time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[1] <= now:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return zlib.decompress(row[0])
+
+    def set(self, key, value, ttl, now=None):
+        '''
+        Method for storing a value (bytes) under a key for ttl seconds, evicting old entries if the cache is full
+        '''
+        now = now or time.time()
+        value = zlib.compress(value, 1)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now+ttl, now))
+            self.evict(now)
+
+    def evict(self, now):
+        '''
+        Method for removing expired entries and then the least recently used entries until the cache fits in max_bytes
+        '''
+        self.connection.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = []
+        for key, size in self.connection.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            removed.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", removed)
+        self.evictions += len(removed)
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM entries")
+
+    def statistics(self):
+        '''
+        Method for getting the number of hits and misses since the cache was opened, along with its current size
+        '''
+        with self.lock:
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits+self.misses
+        return {"hits": self.hits, "misses": self.misses, "expired": self.expired, "evictions": self.evictions,
+            "hit_rate": self.hits/lookups if lookups else 0.0, "entries": entries, "bytes": size}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,150 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import UsgsQuery
+
+#coverage of queries that reach up to the time they were fetched is only trusted until this long before they
+#were fetched, as events keep being added to the catalog for a while after they happen
+LATE_EVENT_MARGIN = 60*60*1000
+
+class EventCatalog:
+    '''
+    A local SQLite catalog of every event fetched from the USGS event web service, keyed by event id and indexed by
+    time, magnitude, depth and location (an R-tree where SQLite has one). The windows of the queries that were
+    fetched completely are kept as coverage, so a query only has to fetch the times the catalog does not cover yet
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        if os.path.dirname(filename):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS events (id TEXT UNIQUE NOT NULL, time REAL,
+                updated REAL, longitude REAL, latitude REAL, depth REAL, magnitude REAL, feature TEXT NOT NULL)''')
+            for column in ("time", "magnitude", "depth"):
+                self.connection.execute("CREATE INDEX IF NOT EXISTS events_{0} ON events ({0})".format(column))
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS coverage (start_time REAL, end_time REAL,
+                query_window TEXT NOT NULL, fetched REAL NOT NULL)''')
+            self.rtree = self.create_spatial_index()
+
+    def create_spatial_index(self):
+        '''
+        Method for creating the R-tree of event locations, kept up to date by triggers. SQLite builds without
+        the R-tree module use a plain index on latitude and longitude instead
+        '''
+        try:
+            self.connection.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree USING rtree(id, min_lon, max_lon,
+                min_lat, max_lat)''')
+        except sqlite3.OperationalError:
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_location ON events (latitude, longitude)")
+            return False
+        self.connection.execute('''CREATE TRIGGER IF NOT EXISTS events_insert AFTER INSERT ON events BEGIN
+            INSERT INTO events_rtree VALUES (new.rowid, new.longitude, new.longitude, new.latitude, new.latitude); END''')
+        self.connection.execute('''CREATE TRIGGER IF NOT EXISTS events_update AFTER UPDATE OF longitude, latitude ON events BEGIN
+            UPDATE events_rtree SET min_lon = new.longitude, max_lon = new.longitude, min_lat = new.latitude,
+            max_lat = new.latitude WHERE id = new.rowid; END''')
+        return True
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def add_features(self, features):
+        '''
+        Method for inserting or updating GeoJSON features, an event that is already in the catalog is only
+        replaced if the feature was updated more recently
+        '''
+        rows = []
+        for quake in features:
+            point = quake["geometry"]["coordinates"]
+            properties = quake["properties"]
+            rows.append((quake["id"], properties.get("time"), properties.get("updated"), point[0], point[1],
+                point[2] if len(point) > 2 else None, properties.get("mag"), json.dumps(quake, separators=(",", ":"))))
+        with self.lock, self.connection:
+            self.connection.executemany('''INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET
+                time = excluded.time, updated = excluded.updated, longitude = excluded.longitude, latitude = excluded.latitude,
+                depth = excluded.depth, magnitude = excluded.magnitude, feature = excluded.feature
+                WHERE excluded.updated >= events.updated OR events.updated IS NULL''', rows)
+
+    def add_coverage(self, window, fetched=None):
+        '''
+        Method for recording that every event of a window has been fetched
+        '''
+        fetched = fetched or time.time()*1000
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO coverage VALUES (?, ?, ?, ?)", (window.start, window.end,
+                json.dumps({name: value for name, value in vars(window).items() if name not in ("start", "end")}), fetched))
+
+    def missing_windows(self, window):
+        '''
+        Method for finding the time ranges of a window that the catalog does not cover yet, returns them as windows
+        '''
+        with self.lock:
+            rows = self.connection.execute("""SELECT start_time, end_time, query_window, fetched FROM coverage
+                WHERE end_time >= ? AND start_time <= ?""",
+                (window.start, window.end)).fetchall()
+        covered = []
+        for start, end, window_data, fetched in rows:
+            coverage = UsgsQuery.QueryWindow(start, end, **json.loads(window_data))
+            end = min(end, fetched-LATE_EVENT_MARGIN)
+            if end > start and coverage.contains(window):
+                covered.append((start, end))
+
+        gaps, gap_start = [], window.start
+        for start, end in sorted(covered):
+            if start > gap_start:
+                gaps.append((gap_start, min(start, window.end)))
+            gap_start = max(gap_start, end)
+            if gap_start >= window.end:
+                break
+        if gap_start < window.end:
+            gaps.append((gap_start, window.end))
+        return [window.with_times(start, end) for start, end in gaps if end > start]
+
+    def query(self, window, url=None):
+        '''
+        Method for getting the events of a window from the catalog as a GeoJSON feature collection,
+        in the same order and with the same limit as the event web service would give them
+        '''
+        conditions = ["time >= ?", "time <= ?", "depth >= ?", "depth <= ?"]
+        values = [window.start, window.end, window.min_depth, window.max_depth]
+        if window.min_mag is not None:
+            conditions.append("magnitude >= ?")
+            values.append(window.min_mag)
+        if window.max_mag is not None:
+            conditions.append("magnitude <= ?")
+            values.append(window.max_mag)
+        if self.rtree:
+            table = "events JOIN events_rtree ON events.rowid = events_rtree.id"
+            conditions += ["min_lon >= ?", "max_lon <= ?", "min_lat >= ?", "max_lat <= ?"]
+        else:
+            table = "events"
+            conditions += ["longitude >= ?", "longitude <= ?", "latitude >= ?", "latitude <= ?"]
+        values += [window.min_lon, window.max_lon, window.min_lat, window.max_lat]
+
+        sql = "SELECT latitude, longitude, feature FROM {} WHERE {} ORDER BY time {}".format(table,
+            " AND ".join(conditions), "ASC" if window.orderby == "time-asc" else "DESC")
+        if window.circle is None and window.limit is not None:
+            sql += " LIMIT {:d}".format(window.limit)
+        with self.lock:
+            rows = self.connection.execute(sql, values).fetchall()
+
+        if window.circle is not None: #the rectangle around the circle was searched, the corners are removed here
+            import numpy as np
+            lats, lons = np.array([row[0] for row in rows]), np.array([row[1] for row in rows])
+            distances = UsgsQuery.great_circle_degrees(window.circle[0], window.circle[1], lats, lons)
+            rows = [row for row, distance in zip(rows, distances) if distance <= window.circle[2]][:window.limit]
+
+        #the stored features are joined into one document so that they are parsed with a single call
+        features = json.loads("[{}]".format(",".join(row[2] for row in rows)))
+        return {"type": "FeatureCollection", "metadata": {"url": url, "title": "Local Event Catalog", "status": 200,
+            "count": len(features)}, "features": features}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
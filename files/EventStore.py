@@ -0,0 +1,224 @@
+import datetime
+from operator import itemgetter
+
+import numpy as np
+
+#properties stored as float columns, missing values (null in the GeoJSON) are stored as nan
+NUMBER_COLUMNS = ("mag", "time", "updated", "felt", "cdi", "mmi", "tsunami", "sig", "dmin", "gap")
+#properties with only a few different values, stored as integer codes into a list of those values
+CATEGORY_COLUMNS = ("status", "alert", "magType", "type")
+#properties shown as whole numbers on the point info page
+INTEGER_COLUMNS = ("felt", "tsunami", "sig")
+#properties that can be whole or fractional numbers in the GeoJSON, which ones were whole is kept so they are shown as given
+MIXED_COLUMNS = ("mag", "cdi", "mmi", "dmin", "gap")
+PROPERTY_NAMES = NUMBER_COLUMNS+CATEGORY_COLUMNS+("place", "title")
+_get_properties = itemgetter(*PROPERTY_NAMES)
+
+class EventStore:
+    '''
+    Holds the earthquakes of a GeoJSON document as typed columns, the GeoJSON is walked once when the store is
+    created and every other part of the program reads the columns by row index instead of the nested dictionaries.
+    Places and titles repeat a lot between earthquakes so equal strings share one object, and the categorical
+    properties are stored as small integer codes
+    '''
+    def __init__(self, features=()):
+        features = list(features)
+        count = len(features)
+        self.ids = [quake["id"] for quake in features]
+        self.rows = {event_id: row for row, event_id in enumerate(self.ids)}
+
+        points = [quake["geometry"]["coordinates"] for quake in features]
+        try:
+            coordinates = np.array(points, dtype=float).reshape(count, 3)
+        except ValueError: #the depth is missing from some events
+            coordinates = np.full((count, 3), np.nan)
+            for row, point in enumerate(points):
+                coordinates[row, :len(point)] = point[:3]
+        self.lons, self.lats, self.depths = coordinates[:, 0].copy(), coordinates[:, 1].copy(), coordinates[:, 2].copy()
+
+        #all properties are read from every feature with one call, only features missing some of them are read one by one
+        columns = list(zip(*(property_values(quake["properties"]) for quake in features))) or [()]*len(PROPERTY_NAMES)
+        columns = dict(zip(PROPERTY_NAMES, columns))
+        self.numbers = {name: np.array(columns[name], dtype=float).reshape(count) #None becomes nan
+            for name in NUMBER_COLUMNS}
+        self.whole = {name: np.fromiter((value.__class__ is int for value in columns[name]), dtype=bool, count=count)
+            for name in MIXED_COLUMNS}
+
+        self.categories = {}
+        self.codes = {}
+        for name in CATEGORY_COLUMNS:
+            lookup = {None: 0} #code 0 is always a missing value
+            for value in set(columns[name]):
+                lookup.setdefault(value, len(lookup))
+            self.codes[name] = np.fromiter(map(lookup.__getitem__, columns[name]), dtype=np.int16, count=count)
+            self.categories[name] = list(lookup) #in the order of their codes
+
+        self.places = share_strings(columns["place"])
+        self.titles = share_strings(columns["title"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def magnitudes(self):
+        return self.numbers["mag"]
+
+    @property
+    def updated(self):
+        return self.numbers["updated"]
+
+    def number(self, name, row):
+        '''
+        Method for getting a single number of an earthquake as it was in the GeoJSON, None for missing values
+        '''
+        value = self.numbers[name][row]
+        if np.isnan(value):
+            return None
+        if name in INTEGER_COLUMNS or (name in self.whole and self.whole[name][row]):
+            return int(value)
+        return float(value)
+
+    def category(self, name, row):
+        '''
+        Method for getting a categorical property of an earthquake from its code
+        '''
+        return self.categories[name][self.codes[name][row]]
+
+    def record(self, row, x=None, y=None):
+        '''
+        Method for getting the properties of a single earthquake as an EventRecord
+        '''
+        return EventRecord(self, row, x, y)
+
+    def extend(self, features):
+        '''
+        Method for appending the earthquakes of more GeoJSON features to the columns, the rows of their ids are moved
+        to the new rows. Rows already in the store are never changed, so records handed out before stay valid
+        '''
+        other = EventStore(features)
+        offset = len(self.ids)
+        self.ids.extend(other.ids)
+        self.rows.update((event_id, row+offset) for event_id, row in other.rows.items())
+        self.lons = np.concatenate((self.lons, other.lons))
+        self.lats = np.concatenate((self.lats, other.lats))
+        self.depths = np.concatenate((self.depths, other.depths))
+        for name in NUMBER_COLUMNS:
+            self.numbers[name] = np.concatenate((self.numbers[name], other.numbers[name]))
+        for name in MIXED_COLUMNS:
+            self.whole[name] = np.concatenate((self.whole[name], other.whole[name]))
+        for name in CATEGORY_COLUMNS: #the codes of the new features are changed to the codes of this store
+            lookup = {value: code for code, value in enumerate(self.categories[name])}
+            for value in other.categories[name]:
+                lookup.setdefault(value, len(lookup))
+            recode = np.array([lookup[value] for value in other.categories[name]], dtype=np.int16)
+            self.codes[name] = np.concatenate((self.codes[name], recode[other.codes[name]]))
+            self.categories[name] = list(lookup)
+        self.places.extend(other.places)
+        self.titles.extend(other.titles)
+
+    def take(self, rows):
+        '''
+        Method for getting a new store of only the given rows, in that order
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        store = EventStore()
+        store.ids = [self.ids[row] for row in rows]
+        store.rows = {event_id: row for row, event_id in enumerate(store.ids)}
+        store.lons, store.lats, store.depths = self.lons[rows], self.lats[rows], self.depths[rows]
+        store.numbers = {name: column[rows] for name, column in self.numbers.items()}
+        store.whole = {name: column[rows] for name, column in self.whole.items()}
+        store.codes = {name: codes[rows] for name, codes in self.codes.items()}
+        store.categories = {name: list(values) for name, values in self.categories.items()}
+        store.places = [self.places[row] for row in rows]
+        store.titles = [self.titles[row] for row in rows]
+        return store
+
+def property_values(properties):
+    '''
+    function for reading the stored properties of a feature, in the order of PROPERTY_NAMES
+    '''
+    try:
+        return _get_properties(properties)
+    except KeyError:
+        return tuple(properties.get(name) for name in PROPERTY_NAMES)
+
+def share_strings(values):
+    '''
+    function for making equal strings share one object, many earthquakes have the same place
+    '''
+    unique = {value: value for value in values}
+    return list(map(unique.__getitem__, values))
+
+class EventRecord:
+    '''
+    A view of one row of an EventStore with the property names the PointInfoPage reads, so that it can be
+    passed to the PointInfoPage. Nothing is copied or formatted until it is read
+    '''
+    __slots__ = ("store", "row", "x", "y")
+
+    def __init__(self, store, row, x=None, y=None):
+        self.store = store
+        self.row = row
+        self.x = x
+        self.y = y
+
+    @property
+    def title(self):
+        return self.store.titles[self.row]
+
+    @property
+    def place(self):
+        return self.store.places[self.row]
+
+    @property
+    def time(self):
+        time = self.store.number("time", self.row)
+        return None if time is None else datetime.datetime.fromtimestamp(time/1000.0).isoformat()
+
+    @property
+    def magnitude(self):
+        return self.store.number("mag", self.row)
+
+    @property
+    def felt(self):
+        return self.store.number("felt", self.row)
+
+    @property
+    def cdi(self):
+        return self.store.number("cdi", self.row)
+
+    @property
+    def mmi(self):
+        return self.store.number("mmi", self.row)
+
+    @property
+    def alert(self):
+        return self.store.category("alert", self.row)
+
+    @property
+    def tsunami(self):
+        return bool(self.store.number("tsunami", self.row))
+
+    @property
+    def sig(self):
+        return self.store.number("sig", self.row)
+
+    @property
+    def status(self):
+        return self.store.category("status", self.row)
+
+    @property
+    def dmin(self):
+        return self.store.number("dmin", self.row)
+
+    @property
+    def gap(self):
+        return self.store.number("gap", self.row)
+
+    @property
+    def magtype(self):
+        return self.store.category("magType", self.row)
+
+    @property
+    def type_(self):
+        return self.store.category("type", self.row)
@@ -0,0 +1,158 @@
+import concurrent.futures
+import math
+import threading
+
+import HttpClient
+import UsgsQuery
+
+SERVER_LIMIT = 20000 #the most events the event web service returns for one query
+MAX_EVENTS = 500000 #the largest limit that can be entered on the settings page
+MAX_WORKERS = 4 #requests sent to the USGS at the same time
+MIN_CHUNK_TIME = 60*60*1000 #windows shorter than an hour are split by area instead of by time
+MAX_SPLITS = 8 #times a window is halved by area before it is fetched as it is
+
+class FetchPlanner:
+    '''
+    Splits event queries that match more events than the server returns at once into smaller windows, using the count
+    endpoint of the event web service. The windows are split by time first and by area once they get too short,
+    then they are fetched on a small pool of threads and merged into a single list of features. Planning and fetching
+    stop early once stopped is set
+    '''
+    def __init__(self, base_url, max_workers=MAX_WORKERS, server_limit=SERVER_LIMIT, progress=None, stopped=None):
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.server_limit = server_limit
+        self.progress = progress #called with (windows done, windows in total, events so far) as the windows finish
+        self.truncated = 0 #windows that still had more events than the server limit after splitting
+        self.stopped = stopped if stopped is not None else threading.Event()
+
+    def count_url(self, window):
+        return UsgsQuery.replace_parameters(window.url(self.base_url), path=self.base_url_path("count"), limit=None, orderby=None)
+
+    def fetch_url(self, window):
+        return UsgsQuery.replace_parameters(window.url(self.base_url), limit=self.server_limit)
+
+    def base_url_path(self, endpoint):
+        '''
+        Method for getting the path of another endpoint of the event web service (query or count)
+        '''
+        path = UsgsQuery.urlsplit(self.base_url).path.rstrip("/")
+        return path[:path.rindex("/")+1]+endpoint
+
+    def count(self, window):
+        '''
+        Method for asking the server how many events a window matches
+        '''
+        response = HttpClient.get(self.count_url(window))
+        response.raise_for_status()
+        return int(response.json()["count"])
+
+    def split(self, window, count, splits):
+        '''
+        Method for splitting a window into parts that should each match fewer events than the server limit,
+        assuming that the events are spread evenly over time. Windows that are already short are halved by longitude
+        '''
+        if window.end-window.start >= MIN_CHUNK_TIME:
+            parts = min(math.ceil(count*1.25/self.server_limit), math.ceil((window.end-window.start)/MIN_CHUNK_TIME))
+            step = (window.end-window.start)/parts
+            return [(window.with_times(window.start+step*part, window.start+step*(part+1)), splits) for part in range(parts)]
+
+        halves = []
+        middle = (window.min_lon+window.max_lon)/2
+        for min_lon, max_lon in ((window.min_lon, middle), (middle, window.max_lon)):
+            half = window.with_times(window.start, window.end)
+            half.circle = None #circles are searched as the rectangles around them and filtered afterwards
+            half.min_lon, half.max_lon = min_lon, max_lon
+            halves.append((half, splits+1))
+        return halves
+
+    def plan(self, windows):
+        '''
+        Method for finding windows that each match at most server_limit events and together cover the given windows,
+        returns them with the number of events they match. Returns the windows planned so far if it is stopped
+        '''
+        planned = []
+        pending = [(window, 0) for window in windows]
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            while pending and not self.stopped.is_set():
+                counts = executor.map(lambda item: self.count(item[0]), pending)
+                next_pending = []
+                for (window, splits), count in zip(pending, counts):
+                    if count <= self.server_limit:
+                        planned.append((window, count))
+                    elif splits >= MAX_SPLITS:
+                        planned.append((window, count))
+                        self.truncated += 1
+                    else:
+                        next_pending += self.split(window, count, splits)
+                pending = next_pending
+        return planned
+
+    def trim(self, planned, limit, orderby):
+        '''
+        Method for dropping the planned windows that come after the first limit events in the order of the query,
+        windows with the same time range (halves of an area) are kept or dropped together
+        '''
+        planned = sorted(planned, key=lambda item: item[0].start, reverse=orderby != "time-asc")
+        kept, total = [], 0
+        for window, count in planned:
+            if total >= limit and (window.start, window.end) != (kept[-1][0].start, kept[-1][0].end):
+                break
+            kept.append((window, count))
+            total += count
+        return kept
+
+    def fetch(self, window):
+        '''
+        Method for fetching the features of a single planned window
+        '''
+        response = HttpClient.get(self.fetch_url(window))
+        response.raise_for_status()
+        return response.json()["features"]
+
+    def fetch_all(self, windows, limit=None, on_window_fetched=None):
+        '''
+        Method for planning and fetching windows, returns the features merged by event id (keeping the most recent
+        update of every event), sorted like the server sorts them and cut to limit. on_window_fetched is called with
+        every fetched window, its features and whether it was fetched completely, in the thread that called fetch_all.
+        If it is stopped the windows still waiting are not fetched, and the features fetched so far are returned
+        '''
+        planned = self.plan(windows)
+        if self.stopped.is_set():
+            return []
+        first = windows[0] if windows else None
+        if limit is not None and first is not None and first.circle is None: #counts of circles include the corners
+            planned = self.trim(planned, limit, first.orderby)
+
+        merged = {}
+        for window, count in planned:
+            if not count and on_window_fetched is not None:
+                on_window_fetched(window, [], True)
+        planned = [(window, count) for window, count in planned if count]
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures = {executor.submit(self.fetch, window): (window, count) for window, count in planned}
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                if self.stopped.is_set():
+                    for waiting in futures: #only the windows being fetched are waited for
+                        waiting.cancel()
+                    break
+                features = future.result()
+                for quake in features:
+                    known = merged.get(quake["id"])
+                    if known is None or (quake["properties"].get("updated") or 0) >= (known["properties"].get("updated") or 0):
+                        merged[quake["id"]] = quake
+                if on_window_fetched is not None:
+                    window, count = futures[future]
+                    on_window_fetched(window, features, len(features) < self.server_limit)
+                if self.progress is not None:
+                    self.progress(done, len(planned), len(merged))
+
+        features = list(merged.values())
+        if first is not None and first.circle is not None: #removes the corners of circles split into rectangles
+            lats = [quake["geometry"]["coordinates"][1] for quake in features]
+            lons = [quake["geometry"]["coordinates"][0] for quake in features]
+            distances = UsgsQuery.great_circle_degrees(first.circle[0], first.circle[1], lats, lons)
+            features = [quake for quake, distance in zip(features, distances) if distance <= first.circle[2]]
+        features.sort(key=lambda quake: quake["properties"].get("time") or 0,
+            reverse=first is None or first.orderby != "time-asc")
+        return features[:limit]
@@ -0,0 +1,150 @@
+import concurrent.futures
+import threading
+import time
+
+POLL_INTERVAL = 50 #milliseconds between checks for finished fetches
+
+class FetchTimeout(Exception):
+    '''
+    Raised (passed to on_error) for a fetch that did not finish within its timeout
+    '''
+
+class FetchJob:
+    '''
+    A single fetch submitted to the FetchWorker, the function runs on the thread of its lane and the
+    callbacks are called in the tkinter thread
+    '''
+    def __init__(self, lane, function, args, on_done, on_error, on_progress, timeout, stoppable=False):
+        self.lane = lane
+        self.function = function
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.timeout = timeout
+        self.stoppable = stoppable
+        self.stopped = threading.Event() #set when the fetch is cancelled, so a stoppable function can return early
+        self.submitted = time.perf_counter()
+        self.cancelled = False
+        self.future = None
+        self.progress = None #the latest progress reported by the function, read by the tkinter thread
+        self.reported = None #the progress last handed to on_progress
+        self.lock = threading.Lock()
+
+    def run(self):
+        if self.cancelled: #superseded before it started
+            return None
+        kwargs = {}
+        if self.on_progress is not None:
+            kwargs["progress"] = self.report
+        if self.stoppable:
+            kwargs["stopped"] = self.stopped
+        return self.function(*self.args, **kwargs)
+
+    def report(self, *progress):
+        '''
+        Method called by the function (on the worker thread) to report its progress
+        '''
+        with self.lock:
+            self.progress = progress
+
+    def cancel(self):
+        self.cancelled = True
+        self.stopped.set() #a running stoppable fetch returns at its next check, the result of any running fetch is ignored
+        self.future.cancel() #stops fetches that have not started
+
+    def timed_out(self):
+        return self.timeout is not None and time.perf_counter()-self.submitted > self.timeout
+
+class FetchWorker:
+    '''
+    Runs fetches off the tkinter thread, so the window keeps responding while data is downloaded. Every kind of
+    fetch has its own lane (such as "data" for the earthquake data and "wiki" for wikipedia) with a single thread,
+    so the fetches of a lane run one at a time in the order they were submitted. A new fetch supersedes the fetches
+    of its lane that are waiting or running, and their results are thrown away. Long fetches are submitted as stoppable,
+    so a superseded or timed out fetch returns early instead of holding up the fetches after it. Results are handed back to the
+    tkinter thread by polling the fetches with after(), as tkinter is not thread safe
+    '''
+    def __init__(self, widget, poll_interval=POLL_INTERVAL):
+        self.widget = widget
+        self.poll_interval = poll_interval
+        self.executors = {}
+        self.jobs = []
+        self.after_id = None
+
+    def submit(self, lane, function, *args, on_done=None, on_error=None, on_progress=None, timeout=None, stoppable=False):
+        '''
+        Method for running function(*args) on the thread of a lane, on_done is called with its result and on_error
+        with the exception it raised (or FetchTimeout). If on_progress is given the function is also passed a
+        progress keyword, a function it can call from its thread whose arguments are then passed to on_progress.
+        If stoppable is set the function is also passed a stopped keyword, a threading.Event that is set when the
+        fetch is cancelled, superseded or times out
+        '''
+        self.cancel(lane)
+        if lane not in self.executors:
+            self.executors[lane] = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="fetch-{}".format(lane))
+        job = FetchJob(lane, function, args, on_done, on_error, on_progress, timeout, stoppable)
+        job.future = self.executors[lane].submit(job.run)
+        self.jobs.append(job)
+        if self.after_id is None:
+            self.after_id = self.widget.after(self.poll_interval, self.poll)
+        return job
+
+    def cancel(self, lane):
+        '''
+        Method for cancelling every fetch of a lane, their callbacks are not called
+        '''
+        for job in self.jobs:
+            if job.lane == lane:
+                job.cancel()
+
+    def is_busy(self, lane):
+        return any(job.lane == lane and not job.future.done() for job in self.jobs)
+
+    def poll(self):
+        '''
+        Method run in the tkinter thread that calls the callbacks of finished fetches, passes on progress and
+        times out fetches that have taken too long
+        '''
+        self.after_id = None
+        running = [] #cancelled fetches are kept until their thread is free, so is_busy stays correct
+        for job in self.jobs:
+            if job.cancelled:
+                if not job.future.done():
+                    running.append(job)
+            elif job.future.done():
+                self.finish(job)
+            elif job.timed_out():
+                job.cancel()
+                running.append(job)
+                if job.on_error is not None:
+                    job.on_error(FetchTimeout("The request took longer than {}s".format(job.timeout)))
+            else:
+                with job.lock:
+                    progress = job.progress
+                if progress is not None and progress != job.reported:
+                    job.reported = progress
+                    job.on_progress(*progress)
+                running.append(job)
+        self.jobs = running
+        if self.jobs:
+            self.after_id = self.widget.after(self.poll_interval, self.poll)
+
+    def finish(self, job):
+        error = job.future.exception()
+        if error is not None:
+            if job.on_error is not None:
+                job.on_error(error)
+        elif job.on_done is not None:
+            job.on_done(job.future.result())
+
+    def close(self):
+        '''
+        Method for stopping the lanes when the program closes, stoppable fetches still running return at their next check
+        '''
+        for lane in list(self.executors):
+            self.cancel(lane)
+            self.executors.pop(lane).shutdown(wait=False)
+        if self.after_id is not None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
@@ -1,9 +1,18 @@
+import time
+START_TIME = time.perf_counter() #taken before the other imports so that the startup time includes them
+
 import os
 import sys
+import importlib
+import threading
 import tkinter as tk
+import Tracing
 from SettingsPage import SettingsPage
-from MapPage import MapPage
-from PointInfoPage import PointInfoPage
+from FetchWorker import FetchWorker
+
+#the map page and point info page import matplotlib, basemap and PIL, so they are only imported
+#once they are first shown (or by the warm up thread after the settings page is ready)
+LAZY_PAGES = ("MapPage", "PointInfoPage")
 
 class GISMain(tk.Tk):
     '''
@@ -25,23 +34,63 @@ class GISMain(tk.Tk):
 
         self.frames = {}
         self.current_url = None
-        
-        #loop for storing all page classes in a dictionary where their name corresponds to the instance
-        #thereby allowing them to be shown to the user via the show_frame method
-        for frame in (SettingsPage, MapPage, PointInfoPage):
-            page_name = frame.__name__
+        self.current_data = None #the parsed GeoJSON of current_url
+        self.startup_time = None
+        self.current_page = None
+        self.fetch_worker = FetchWorker(self) #network requests are made on its threads, never on the tkinter thread
+
+        #pages are stored in a dictionary where their name corresponds to the instance, thereby allowing
+        #them to be shown to the user via the show_frame method. Only the settings page is built here,
+        #the other pages are built the first time they are shown
+        self.frames["SettingsPage"] = SettingsPage(parent=self.container, controller=self)
+        self.frames["SettingsPage"].grid(row=0, column=0, sticky="nsew")
+        self.show_frame("SettingsPage")
+        self.after_idle(self.on_startup_finished)
+
+    def get_frame(self, page_name):
+        '''
+        Method for getting the instance of a page, importing its module and building it if it has not been shown yet
+        '''
+        if page_name not in self.frames:
+            frame = getattr(importlib.import_module(page_name), page_name)
             new_frame = frame(parent=self.container, controller=self)
             self.frames[page_name] = new_frame
             new_frame.grid(row=0, column=0, sticky="nsew")
-        self.show_frame("SettingsPage")
+            new_frame.lower() #pages built before they are shown stay behind the current page
+        return self.frames[page_name]
 
     def show_frame(self, page_name):
         '''
         Method for lifting frames over one another
         '''
-        frame = self.frames[page_name]
+        frame = self.get_frame(page_name)
         frame.event_generate("<<RefreshPlot>>")
         frame.tkraise()
+        self.current_page = page_name
+
+    def on_startup_finished(self):
+        '''
+        Method called once the settings page has been drawn and can be used, reports how long the
+        startup took and starts loading the map in the background
+        '''
+        self.startup_time = time.perf_counter()-START_TIME
+        Tracing.note("startup", "Settings page ready in {:.3f}s".format(self.startup_time)) #shown by the timings panel
+        threading.Thread(target=self.warm_up, daemon=True).start()
+
+    def warm_up(self):
+        '''
+        Method run on a background thread that imports the other pages and loads the basemap and
+        its background image, so the map page is quick to build once it is first shown. No tkinter
+        objects are touched here as tkinter is not thread safe
+        '''
+        try:
+            for page_name in LAZY_PAGES:
+                importlib.import_module(page_name)
+            import MapBackground
+            basemap = MapBackground.load_basemap(MapBackground.MAP_OPTIONS)
+            MapBackground.load_background(basemap, MapBackground.MAP_OPTIONS, MapBackground.MAP_FIGSIZE)
+        except Exception as error: #the map page loads everything itself if this fails
+            Tracing.note("warm_up", "Could not warm up the map: {}".format(error))
     
     def modify_url(self, new_url):
         '''
@@ -49,35 +98,68 @@ class GISMain(tk.Tk):
         '''
         self.current_url = new_url
     
+    def modify_data(self, new_url, new_data):
+        '''
+        Method for handing newly fetched data to the map page in memory, together with the url it came from.
+        Data is fetched in the background, so the map page is refreshed at once if it is already being shown
+        '''
+        self.current_data = new_data
+        self.modify_url(new_url)
+        if self.current_page == "MapPage":
+            self.frames["MapPage"].event_generate("<<RefreshPlot>>")
+
+    def push_live_data(self, url, new_data, changed, removed):
+        '''
+        Method for handing data changed by a live sync of the current url to the map page, only the changed features
+        and removed event ids are passed to it. Pages that have not plotted the url yet plot new_data when they are shown
+        '''
+        if url != self.current_url:
+            return
+        self.current_data = new_data
+        page = self.frames.get("MapPage")
+        if page is not None and page.local_url == url:
+            page.plot_changes(changed, removed)
+
     def call_reconnect(self):
         '''
         Method that calls the map page's reconnect function to enable event handling again
         '''
-        page = self.frames["MapPage"]
-        page.reconnect_pick_event()
+        if "MapPage" in self.frames:
+            self.frames["MapPage"].reconnect_pick_event()
     
     def call_display_info(self, point_obj):
         '''
         Method that calls the point info page's configure labels function to configure labels
         to show the appropriate information about the selected point
         '''
-        page = self.frames["PointInfoPage"]
+        page = self.get_frame("PointInfoPage")
         page.configure_labels(point_obj)
-        page.configure_scrolledtext()
-        page.configure_event_photo()
+        page.request_place_info() #the wikipedia text and image are filled in once they have been fetched
+    
+    def call_prefetch_place_info(self, features):
+        '''
+        Method that starts the point info page's prefetcher, which looks up the places of the most significant
+        earthquakes in the background so they are shown at once when clicked
+        '''
+        page = self.get_frame("PointInfoPage")
+        page.place_prefetcher.start(self.fetch_worker, features)
     
     def on_close_window(self):
         '''
-        Method that makes sure the current_data.json file is deleted as after the
-        program is closed its no longer needed
+        Method that makes sure the current_data.json file is deleted as after the program is closed its no
+        longer needed, unless the user switched on saving the data to the disk so it can be used afterwards
+        (by BatchRender for example). Timings that are still being recorded are written to the trace file
         '''
         filename="current_data.json"
-        if os.path.isfile(filename):
+        if os.path.isfile(filename) and not self.frames["SettingsPage"].save_data_variable.get():
             os.remove(filename)
             
-        filename="current_image.png"
-        if os.path.isfile(filename):
-            os.remove(filename)
+        page = self.frames.get("PointInfoPage")
+        if page is not None:
+            page.place_prefetcher.stop() #the prefetch thread would otherwise keep the program open until it is done
+        self.fetch_worker.close()
+        if Tracing.enabled():
+            Tracing.write()
         self.destroy()
         sys.exit(0)
 
@@ -0,0 +1,118 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import Tracing
+
+#seconds to wait for the server to accept a connection and then for each part of its response,
+#so a request to a server that has stopped answering fails instead of holding up a fetch lane
+REQUEST_TIMEOUT = (10, 60)
+RETRIES = 3 #attempts after the first for connection errors and busy servers
+BACKOFF = 0.5 #seconds before the first retry, doubled for every retry after it
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_METHODS = frozenset(("GET", "HEAD"))
+POOL_SIZE = 10 #connections kept open per host, enough for every fetch lane and the parallel fetches of a query
+CHUNK_SIZE = 64*1024 #bytes read at a time by streaming downloads
+USER_AGENT = "Expanded-Earthquake-GIS (python-requests/{})".format(requests.__version__)
+
+class HttpClient:
+    '''
+    A requests session shared by every part of the program that talks to the USGS or wikipedia, so connections
+    are kept alive and reused instead of paying for a new TCP and TLS handshake on every request. Responses are
+    asked for compressed, failed connections and busy servers are retried with a backoff, and the number of
+    requests, their latency and the bytes transferred are counted per host
+    '''
+    def __init__(self, timeout=REQUEST_TIMEOUT, retries=RETRIES, backoff=BACKOFF, pool_size=POOL_SIZE):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = retry_policy(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+            raise_on_status=False) #the last response is returned if every retry fails
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "User-Agent": USER_AGENT})
+        self.hosts = {}
+        self.lock = threading.Lock() #the session is shared by the threads of the fetch worker
+
+    def get(self, url, **kwargs):
+        '''
+        Method for making a GET request with the shared session, takes the same arguments as requests.get.
+        The bytes of streamed responses are counted once they are read with save_stream
+        '''
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.record(url, time.perf_counter()-start, 0, error=True)
+            raise
+        end = time.perf_counter()
+        self.record(url, end-start, 0 if kwargs.get("stream") else wire_bytes(response))
+        Tracing.record("http_get", start, end, {"url": url})
+        return response
+
+    def save_stream(self, response, out_file):
+        '''
+        Method for writing a streamed response into a file object a chunk at a time, returns the number of bytes written
+        '''
+        written = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            out_file.write(chunk)
+            written += len(chunk)
+        self.record(response.url, 0, wire_bytes(response), request=False)
+        return written
+
+    def record(self, url, seconds, size, error=False, request=True):
+        host = urlsplit(url).netloc.lower()
+        with self.lock:
+            counters = self.hosts.setdefault(host, {"requests": 0, "errors": 0, "seconds": 0.0, "bytes": 0})
+            counters["requests"] += request
+            counters["errors"] += error
+            counters["seconds"] += seconds
+            counters["bytes"] += size
+
+    def statistics(self):
+        '''
+        Method for getting the counters of every host, with the mean latency of its requests in seconds
+        '''
+        with self.lock:
+            return {host: dict(counters, latency=counters["seconds"]/counters["requests"] if counters["requests"] else 0.0)
+                for host, counters in self.hosts.items()}
+
+    def close(self):
+        self.session.close()
+
+def retry_policy(**kwargs):
+    '''
+    function for making the Retry of the session for GET and HEAD requests, urllib3 before 1.26 (which the
+    requests version in the README brings) calls the methods retried method_whitelist instead of allowed_methods
+    '''
+    try:
+        return Retry(allowed_methods=RETRY_METHODS, **kwargs)
+    except TypeError:
+        return Retry(method_whitelist=RETRY_METHODS, **kwargs)
+
+def wire_bytes(response):
+    '''
+    function for getting the number of bytes of a response read from the connection (before it was decompressed)
+    '''
+    try:
+        return response.raw.tell()
+    except AttributeError: #responses that did not come from a connection
+        return len(response.content or b"")
+
+#the client used by the whole program, the module functions below are shortcuts to it
+shared_client = HttpClient()
+
+def get(url, **kwargs):
+    return shared_client.get(url, **kwargs)
+
+def save_stream(response, out_file):
+    return shared_client.save_stream(response, out_file)
+
+def statistics():
+    return shared_client.statistics()
@@ -0,0 +1,105 @@
+import HttpClient
+
+DEFAULT_INTERVAL = 60 #seconds between polls, the summary feeds are updated every minute
+
+class LiveSync:
+    '''
+    Keeps the earthquakes of a summary feed up to date by polling it with conditional requests, so the server only
+    sends the feed again if it has changed since the last poll (checked with its ETag and Last-Modified headers).
+    Features are kept by event id, and each poll gives only the earthquakes that are new or updated and the ids
+    of those that have dropped out of the feed
+    '''
+    def __init__(self, url, features=(), headers=None, interval=DEFAULT_INTERVAL):
+        self.url = url
+        self.interval = interval
+        self.features = {quake["id"]: quake for quake in features}
+        self.etag = headers.get("ETag") if headers else None
+        self.last_modified = headers.get("Last-Modified") if headers else None
+        self.polls = 0
+        self.unchanged = 0 #polls answered with 304 Not Modified
+        self.worker = None
+        self.on_changes = None
+        self.on_error = None
+        self.after_id = None
+
+    def conditional_headers(self):
+        '''
+        Method for getting the headers that make the server answer with 304 Not Modified if the feed has not changed
+        '''
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def poll(self):
+        '''
+        Method for requesting the feed once, returns the new or updated features and the removed event ids
+        (both empty if the feed has not changed)
+        '''
+        response = HttpClient.get(self.url, headers=self.conditional_headers())
+        self.polls += 1
+        if response.status_code == 304:
+            self.unchanged += 1
+            return [], []
+        response.raise_for_status()
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        return self.merge(response.json()["features"])
+
+    def merge(self, features):
+        '''
+        Method for replacing the kept features with those of a new copy of the feed, comparing them by id and 'updated' time
+        '''
+        changed = [quake for quake in features if quake["id"] not in self.features
+            or self.features[quake["id"]]["properties"].get("updated") != quake["properties"].get("updated")]
+        new_features = {quake["id"]: quake for quake in features}
+        removed = [event_id for event_id in self.features if event_id not in new_features]
+        self.features = new_features
+        return changed, removed
+
+    def collection(self):
+        '''
+        Method for getting the kept features as a GeoJSON feature collection, like the one the feed sends
+        '''
+        features = list(self.features.values())
+        return {"type": "FeatureCollection", "metadata": {"url": self.url, "title": "Live Sync", "status": 200,
+            "count": len(features)}, "features": features}
+
+    def start(self, worker, on_changes, on_error=None):
+        '''
+        Method for polling the feed every interval seconds on the "live" lane of a FetchWorker, on_changes is called
+        in the tkinter thread with the changed features and removed ids whenever the feed has changed, and on_error
+        with the error of a poll that failed
+        '''
+        self.stop()
+        self.worker = worker
+        self.on_changes = on_changes
+        self.on_error = on_error
+        self.schedule()
+
+    def schedule(self):
+        self.after_id = self.worker.widget.after(int(self.interval*1000), self.start_poll)
+
+    def stop(self):
+        if self.worker is None:
+            return
+        if self.after_id is not None:
+            self.worker.widget.after_cancel(self.after_id)
+            self.after_id = None
+        self.worker.cancel("live")
+
+    def start_poll(self):
+        self.after_id = None
+        self.worker.submit("live", self.poll, on_done=self.finish_poll, on_error=self.fail_poll, timeout=max(self.interval, 60))
+
+    def finish_poll(self, result):
+        if result[0] or result[1]:
+            self.on_changes(*result)
+        self.schedule()
+
+    def fail_poll(self, error):
+        if self.on_error is not None:
+            self.on_error(error)
+        self.schedule() #the next poll is tried as usual
@@ -0,0 +1,154 @@
+import hashlib
+import copy
+import pickle
+import threading
+import json
+import os
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from mpl_toolkits.basemap import Basemap
+from PIL import Image
+
+#the projection and extent used by the map page, mercator projection between -80 and 80 degrees latitude
+MAP_OPTIONS = {"projection": "merc", "llcrnrlat": -80, "urcrnrlat": 80,
+    "llcrnrlon": -180, "urcrnrlon": 180, "resolution": "c"}
+
+MAP_TITLE = "Earthquake Events - Mercator Projection"
+MAP_FIGSIZE = (12, 4) #size of the map page figure in inches
+CACHE_DIRECTORY = "map_cache"
+BACKGROUND_DPI = 150
+ZOOM_DETAIL = 1.0 #screen pixels per pixel of the background image past which the static layers are drawn as vectors
+STYLE_VERSION = 1 #increase when the look of draw_static_layers changes, so old cached images are not used
+
+#basemaps and rendered backgrounds already loaded by this process, the lock stops the main thread from
+#loading them a second time while they are being warmed up in the background
+_basemaps = {}
+_backgrounds = {}
+_cache_lock = threading.RLock()
+
+def cache_key(map_options, figsize=None, dpi=None):
+    '''
+    function for creating a short key out of the projection, extent, resolution and figure size,
+    used to name the cached files on disk
+    '''
+    figsize = None if figsize is None else [float(size) for size in figsize] #(12, 4) and (12.0, 4.0) are the same size
+    key_data = {"map_options": map_options, "figsize": figsize, "dpi": dpi, "style": STYLE_VERSION}
+    key_data = json.dumps(key_data, sort_keys=True, default=float)
+    return hashlib.sha1(key_data.encode("utf-8")).hexdigest()[:16]
+
+def load_basemap(map_options=MAP_OPTIONS):
+    '''
+    function for getting the Basemap object of a projection, building the basemap reads all of the
+    coastline and boundary data so it is kept in memory and pickled to disk after the first time
+    '''
+    key = cache_key(map_options)
+    with _cache_lock:
+        if key in _basemaps:
+            return _basemaps[key]
+
+        filename = os.path.join(CACHE_DIRECTORY, "basemap_{}.pickle".format(key))
+        try:
+            with open(filename, "rb") as in_file:
+                basemap = pickle.load(in_file)
+        except (OSError, EOFError, AttributeError, pickle.UnpicklingError): #not cached yet or cached by an older version
+            basemap = Basemap(**map_options)
+            os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+            with open(filename, "wb") as out_file:
+                pickle.dump(basemap, out_file, pickle.HIGHEST_PROTOCOL)
+
+        _basemaps[key] = basemap
+        return basemap
+
+def draw_static_layers(basemap, axes):
+    '''
+    function for drawing the parts of the map that never change onto the axes (coastlines, continents, borders)
+    '''
+    basemap.drawcoastlines(ax=axes)
+    basemap.fillcontinents(color="tan", lake_color="lightblue", ax=axes)
+    basemap.drawstates(color="darkred", ax=axes)
+    basemap.drawmapboundary(fill_color="lightblue", ax=axes)
+    basemap.drawcountries(ax=axes)
+
+def draw_grid(basemap, axes):
+    '''
+    function for drawing the labelled parallels and meridians, these are drawn onto the real axes
+    as their labels sit outside of the map
+    '''
+    basemap.drawparallels(np.arange(-90.,91.,30.), labels=(True, True, False, False), dashes=(2,2), ax=axes)
+    basemap.drawmeridians(np.arange(-180.,181.,60.), labels=(False, False, False, True), dashes=(2,2), ax=axes)
+
+def render_background(basemap, figsize, dpi=BACKGROUND_DPI):
+    '''
+    function for rasterizing the static layers of the map into an RGBA image array, using an off screen
+    figure with the same aspect ratio as the map so that the image covers the map extent exactly
+    '''
+    basemap = copy.copy(basemap) #drawing the map boundary stores it on the basemap, which must not leak into other figures
+    width = figsize[0]
+    height = width*(basemap.ymax-basemap.ymin)/(basemap.xmax-basemap.xmin)
+    figure = Figure(figsize=(width, height), dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_axes([0, 0, 1, 1])
+    axes.set_axis_off()
+
+    draw_static_layers(basemap, axes)
+    basemap.set_axes_limits(ax=axes)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+def load_background(basemap, map_options, figsize, dpi=BACKGROUND_DPI):
+    '''
+    function for getting the pre-rendered background of a map, either from memory, from the disk
+    or by rendering it (and then saving it) if it has not been rendered before
+    '''
+    figsize = tuple(float(size) for size in figsize)
+    key = cache_key(map_options, figsize, dpi)
+    with _cache_lock:
+        if key in _backgrounds:
+            return _backgrounds[key]
+
+        filename = os.path.join(CACHE_DIRECTORY, "background_{}.png".format(key))
+        try:
+            with Image.open(filename) as image:
+                background = np.asarray(image.convert("RGBA"))
+        except OSError:
+            background = render_background(basemap, figsize, dpi)
+            os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+            Image.fromarray(background).save(filename)
+
+        _backgrounds[key] = background
+        return background
+
+def background_scale(basemap, axes, image_width):
+    '''
+    function for getting how many screen pixels one pixel of a background image image_width pixels wide covers
+    in the current view of the axes, the image looks pixelated once this is over ZOOM_DETAIL
+    '''
+    x_min, x_max = axes.get_xlim()
+    return axes.bbox.width/abs(x_max-x_min)*(basemap.xmax-basemap.xmin)/image_width
+
+def draw_vector_layers(basemap, axes):
+    '''
+    function for drawing the static layers onto the axes as vectors, used in place of the background image once the
+    view is zoomed in too far for it. Drawing the layers resets the view to the whole map, so the current view is
+    put back (without calling the view callbacks again, as this is called from them). Returns the artists that were drawn
+    '''
+    view = (axes.get_xlim(), axes.get_ylim())
+    children = set(axes.get_children())
+    draw_static_layers(copy.copy(basemap), axes)
+    axes.set_xlim(view[0], emit=False)
+    axes.set_ylim(view[1], emit=False)
+    return [artist for artist in axes.get_children() if artist not in children]
+
+def draw_background(basemap, axes, map_options=MAP_OPTIONS):
+    '''
+    function for placing the cached background image onto the axes, covering the extent of the basemap,
+    followed by the parallels and meridians
+    '''
+    background = load_background(basemap, map_options, axes.figure.get_size_inches())
+    image = axes.imshow(background, extent=(basemap.xmin, basemap.xmax, basemap.ymin, basemap.ymax),
+        origin="upper", interpolation="none", zorder=0) #unsampled images are the fastest to redraw
+    draw_grid(basemap, axes)
+    axes.set_frame_on(False)
+    return image
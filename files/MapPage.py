@@ -1,21 +1,19 @@
 from tkinter import messagebox
 import tkinter as tk
-import json
 
 import Pmw
-import numpy as np
-import matplotlib as mp
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
-from mpl_toolkits.basemap import Basemap
-from matplotlib.lines import Line2D
-mp.use("TkAgg")
 
-from TKCustomClasses import MapPoint
+import MapBackground
+import Tracing
+from EventStore import EventStore
+from PointLayer import PointLayer, create_legend_handles
+from ClusterLayer import ClusterLayer
 
 class MapPage(tk.Frame):
     '''
-    A page that will show the map of currently plotted earthquakes from the 'current_data.json' file
+    A page that will show the map of currently plotted earthquakes from the data fetched by the settings page
     '''
     def __init__(self, parent, controller):
         super().__init__(parent)
@@ -36,35 +34,44 @@ class MapPage(tk.Frame):
         self.menubar.addmenuitem("pages", "command", "Switch To Settings Page",
             command=lambda: self.controller.show_frame("SettingsPage"), label="Settings Page")
 
+        self.cluster_variable = tk.BooleanVar(self, value=False)
+        self.menubar.addmenu("view", "Map Display Options")
+        self.menubar.addmenuitem("view", "checkbutton", "Group Nearby Earthquakes Into Clusters That Split When Zooming In",
+            command=self.toggle_clusters, variable=self.cluster_variable, label="Cluster Events")
+
         self.map_frame = tk.Frame(self)
         self.map_frame.pack(side="bottom", fill="both", expand=True)
 
-        #Line2D objects are used here to be placed in the legend of the graph for more detail on the map
-        legend_elements = [Line2D([0], [0], marker="o", color="green", label="Small (below 3)"),
-                    Line2D([0], [0], marker="o", color="yellow", label="Medium (below 6)"),
-                    Line2D([0], [0], marker="o", color="red", label="Large (above 6)")]
-
-        self.map_figure = plt.figure(num=None, figsize=(12, 4))
+        self.map_figure = Figure(figsize=MapBackground.MAP_FIGSIZE) #pyplot is not needed as the figure is only shown inside this page
         self.map_axes = self.map_figure.add_subplot(111)
-        self.map_axes_legend = self.map_axes.legend(handles=legend_elements, loc="upper right") #placing the legend
-        self.map_axes.set_title("Earthquake Events - Mercator Projection")
+        self.map_axes_legend = self.map_axes.legend(handles=create_legend_handles(), loc="upper right") #placing the legend
+        self.map_axes.set_title(MapBackground.MAP_TITLE)
         self.map_figure.tight_layout() #makes sure that when placing the map onto the GUI, it is responsive
 
-        self.figure_basemap = Basemap(projection="merc", llcrnrlat=-80, urcrnrlat=80,
-            llcrnrlon=-180, urcrnrlon=180, resolution="c") #defines that the map is using mercator projection
-        
-        self.figure_basemap.drawcoastlines()
-        self.figure_basemap.fillcontinents(color="tan", lake_color="lightblue")
-        self.figure_basemap.drawstates(color="darkred")
-        self.figure_basemap.drawparallels(np.arange(-90.,91.,30.), labels=(True, True, False, False), dashes=(2,2))
-        self.figure_basemap.drawmeridians(np.arange(-180.,181.,60.), labels=(False, False, False, True), dashes=(2,2))
-        self.figure_basemap.drawmapboundary(fill_color="lightblue")
-        self.figure_basemap.drawcountries()
+        #the basemap and a pre-rendered image of the static map layers are cached, so the coastlines and
+        #borders are not drawn again on every launch and on every redraw of the figure
+        self.figure_basemap = MapBackground.load_basemap(MapBackground.MAP_OPTIONS)
+        self.background_image = MapBackground.draw_background(self.figure_basemap, self.map_axes)
+        self.vector_layers = None #the static layers drawn as vectors, only once the map is zoomed in past the image
+        self.map_background = None
+        self.background_view = None
+
+        self.point_layer = PointLayer(self.map_axes, self.figure_basemap) #every earthquake is drawn by this one layer
+        self.cluster_layer = ClusterLayer(self.map_axes, self.point_layer)
+        self.hovered_target = None
+        self.hover_annotation = self.map_axes.annotate("", xy=(0, 0), xytext=(10, 10), textcoords="offset points",
+            bbox={"boxstyle": "round", "fc": "white", "alpha": .8}, zorder=6, visible=False)
+        self.points_background = None
+        #the cluster level, and whether the static layers are drawn as vectors, are chosen again whenever the map is zoomed or panned
+        self.map_axes.callbacks.connect("xlim_changed", self.on_view_changed)
+        self.map_axes.callbacks.connect("ylim_changed", self.on_view_changed)
 
         self.figure_canvas = FigureCanvasTkAgg(self.map_figure, self.map_frame) #creates the figure and draws the map onto it
         self.figure_canvas.draw()
         self.figure_canvas.get_tk_widget().pack(side="bottom", fill="both", expand=True)
-        self.canvas_pick_event = self.figure_canvas.mpl_connect("pick_event", self.display_point_info)
+        #clicks and hovering are resolved with the point layer's spatial index instead of matplotlib picking
+        self.canvas_pick_event = self.figure_canvas.mpl_connect("button_press_event", self.display_point_info)
+        self.canvas_hover_event = self.figure_canvas.mpl_connect("motion_notify_event", self.display_hover_info)
         
         self.figure_toolbar = NavigationToolbar2Tk(self.figure_canvas, self.map_frame) #Toolbar with additional options is added to the figure
         self.figure_toolbar.update()
@@ -73,54 +80,217 @@ class MapPage(tk.Frame):
     def refresh_plot(self, event):
         '''
         Method for checking whether there is any different data to plot and if so
-        reads it from the json file, done by checking the local_url against controller's current_url
+        plots the data held by the controller, done by checking the local_url against controller's current_url
         '''
         if self.local_url == self.controller.current_url:
             return "Same Request"
 
         self.local_url = self.controller.current_url
-        with open("current_data.json", "r") as json_file:
-            data = json.load(json_file)
-        
-        self.plot_points(data)
-        messagebox.showinfo(title="Data Plotted", message="{} points plotted".format(data["metadata"]["count"]))
+        added, removed, updated = self.plot_points(self.controller.current_data)
+        messagebox.showinfo(title="Data Plotted", message="{} points plotted\n({} new, {} removed, {} updated)".format(
+            len(self.point_layer), added, removed, updated))
 
     def plot_points(self, filedata):
         '''
-        Method for creating MapPoint objects and plotting them on the figure, by first clearing the figure of any
-        previous plots and then reading 'current_data.json'
+        Method for plotting all earthquakes onto the figure as a single collection. The point layer only
+        changes the earthquakes that were added, removed or updated since the previous plot, and the
+        number of each is returned
         '''
-        self.map_axes.lines.clear()
-        
-        for quake in filedata["features"]:
-            lat=quake["geometry"]["coordinates"][1]
-            if lat > 80: lat=80
-            elif lat <-80: lat=-80
-            nx,ny = self.figure_basemap((quake["geometry"]["coordinates"][0],), (lat,))
-
-            new_point = MapPoint(nx, ny, quake["properties"]["mag"], quake["properties"]["place"],
-                quake["properties"]["time"], quake["properties"]["felt"], quake["properties"]["cdi"],
-                quake["properties"]["mmi"], quake["properties"]["alert"], quake["properties"]["tsunami"],
-                quake["properties"]["sig"], quake["properties"]["title"], quake["properties"]["status"],
-                quake["properties"]["dmin"], quake["properties"]["gap"], quake["properties"]["magType"],
-                quake["properties"]["type"])
-            
-            self.map_axes.add_line(new_point)
-        self.figure_canvas.draw()
+        with Tracing.span("plot_points", events=len(filedata["features"])):
+            with Tracing.span("event_store"):
+                store = EventStore(filedata["features"]) #the GeoJSON is only walked once, here
+            changes = self.point_layer.set_store(store)
+            self.redraw_changed_points(changes)
+        return changes
+
+    def plot_changes(self, changed, removed):
+        '''
+        Method for plotting only the earthquakes a live sync found new or updated (GeoJSON features) and the event ids
+        it found removed, without reading the whole feed again. Returns the number of added, removed and updated earthquakes
+        '''
+        with Tracing.span("plot_changes", events=len(changed)+len(removed)):
+            changes = self.point_layer.apply_changes(changed, removed)
+            self.redraw_changed_points(changes)
+        return changes
+
+    def redraw_changed_points(self, changes):
+        '''
+        Method for drawing the figure again after the point layer changed, the figure is only drawn again if any earthquake changed
+        '''
+        if any(changes):
+            self.cluster_layer.set_points()
+            self.hovered_target = None #the rows of the earthquakes may have moved
+            self.hover_annotation.set_visible(False)
+            self.draw_point_layer()
+
+    def toggle_clusters(self):
+        '''
+        Method for switching the level of detail mode, where nearby earthquakes are grouped into clusters
+        '''
+        self.cluster_layer.set_enabled(self.cluster_variable.get())
+        self.hovered_target = None
+        self.hover_annotation.set_visible(False)
+        self.draw_point_layer()
+
+    def on_view_changed(self, axes):
+        '''
+        Method called when the toolbar zooms or pans the map
+        '''
+        self.update_background_detail()
+        self.cluster_layer.update_view()
+
+    def get_layer_artists(self):
+        '''
+        Method for getting the artists drawn over the cached background whenever the earthquake layer changes
+        '''
+        return [self.point_layer.collection]+self.cluster_layer.artists()+[self.map_axes_legend]
+
+    def current_view(self):
+        '''
+        Method for getting the visible extent and on screen size of the map, the cached backgrounds are only valid for one view
+        '''
+        return (self.map_axes.get_xlim(), self.map_axes.get_ylim(), self.map_axes.bbox.bounds)
+
+    @Tracing.traced("draw_point_layer")
+    def draw_point_layer(self):
+        '''
+        Method for drawing only the earthquake layer over the cached background of the map. The background
+        is captured (without any earthquakes) again only when the view or the window size has changed
+        '''
+        if self.background_view != self.current_view():
+            self.update_background_detail()
+            hidden_artists = self.get_layer_artists()+[self.hover_annotation]
+            visible = [artist.get_visible() for artist in hidden_artists]
+            for artist in hidden_artists:
+                artist.set_visible(False)
+            with Tracing.span("canvas_draw"):
+                self.figure_canvas.draw()
+            self.map_background = self.figure_canvas.copy_from_bbox(self.map_axes.bbox)
+            self.background_view = self.current_view() #the axes position is only final once the figure is drawn
+            for artist, was_visible in zip(hidden_artists, visible):
+                artist.set_visible(was_visible)
+
+        self.figure_canvas.restore_region(self.map_background)
+        for artist in self.get_layer_artists(): #the legend stays on top of the earthquakes
+            self.map_axes.draw_artist(artist)
+        #the map with its earthquakes is kept as well, so the tooltip can be moved without drawing every earthquake
+        self.points_background = self.figure_canvas.copy_from_bbox(self.map_axes.bbox)
+        self.map_axes.draw_artist(self.hover_annotation)
+        self.figure_canvas.blit(self.map_axes.bbox)
+
+    def update_background_detail(self):
+        '''
+        Method for showing the static layers as vectors when the view is zoomed in so far that the background image
+        would look pixelated, and the image again when zoomed back out. The vectors are only drawn the first time
+        '''
+        image_width = self.background_image.get_size()[1]
+        detailed = MapBackground.background_scale(self.figure_basemap, self.map_axes, image_width) > MapBackground.ZOOM_DETAIL
+        if detailed and self.vector_layers is None:
+            with Tracing.span("vector_layers"):
+                self.vector_layers = MapBackground.draw_vector_layers(self.figure_basemap, self.map_axes)
+        self.background_image.set_visible(not detailed)
+        for artist in self.vector_layers or ():
+            artist.set_visible(detailed)
+
+    def draw_hover_annotation(self):
+        '''
+        Method for redrawing only the tooltip over the cached map and earthquake layer
+        '''
+        if self.points_background is None or self.background_view != self.current_view():
+            self.draw_point_layer()
+            return
+        self.figure_canvas.restore_region(self.points_background)
+        self.map_axes.draw_artist(self.hover_annotation)
+        self.figure_canvas.blit(self.map_axes.bbox)
+
+    def find_event_point(self, event):
+        '''
+        Method for finding what is under the mouse, returns ("point", index of the earthquake in the point layer),
+        ("cluster", level, index of the cluster) or None. A cluster of a single earthquake counts as that earthquake
+        '''
+        if event.inaxes is not self.map_axes or self.figure_toolbar.mode: #the toolbar is being used to pan or zoom
+            return None
+
+        #the size of a typographic point in map coordinates, which changes with the zoom level
+        x_min, x_max = self.map_axes.get_xlim()
+        data_per_point = (x_max-x_min)/self.map_axes.bbox.width*self.map_figure.dpi/72
+        if self.cluster_layer.level is None:
+            index = self.point_layer.find_point(event.xdata, event.ydata, data_per_point)
+            return None if index is None else ("point", index)
+
+        cluster, index = self.cluster_layer.find_cluster(event.xdata, event.ydata, data_per_point)
+        if index is None:
+            return None
+        if cluster["counts"][index] == 1:
+            return ("point", int(cluster["firsts"][index]))
+        return ("cluster", self.cluster_layer.level, index)
+
+    def display_hover_info(self, event):
+        '''
+        Method for showing a tooltip with the title of the earthquake (or the size of the cluster) under the mouse
+        '''
+        target = self.find_event_point(event)
+        if target == self.hovered_target:
+            return
+        self.hovered_target = target
+
+        if target is None:
+            self.hover_annotation.set_visible(False)
+        elif target[0] == "point":
+            index = target[1]
+            self.hover_annotation.xy = (self.point_layer.xs[index], self.point_layer.ys[index])
+            self.hover_annotation.set_text(self.point_layer.get_point(index).title)
+            self.hover_annotation.set_visible(True)
+        else:
+            cluster, index = self.cluster_layer.tree.levels[target[1]], target[2]
+            self.hover_annotation.xy = (cluster["xs"][index], cluster["ys"][index])
+            self.hover_annotation.set_text("{} earthquakes, largest M {:.1f}\nclick to zoom in".format(
+                cluster["counts"][index], cluster["max_magnitudes"][index]))
+            self.hover_annotation.set_visible(True)
+        self.draw_hover_annotation()
     
     def display_point_info(self, event):
         '''
-        Method when an individual point is picked, prompts the user to view information about it
+        Method when an individual point is clicked, prompts the user to view information about it,
+        clicking a cluster zooms into it instead
         '''
-        line_obj = event.artist
+        if event.button != 1:
+            return
+        with Tracing.span("pick"):
+            target = self.find_event_point(event)
+        if target is None:
+            return
+        if target[0] == "cluster":
+            self.zoom_to_cluster(target[1], target[2])
+            return
+        point_obj = self.point_layer.get_point(target[1])
         
-        messagebox.showinfo(title="Point Selected", message="Here is more info about the point - {}".format(line_obj.place))
-        self.figure_canvas.mpl_disconnect(self.canvas_pick_event)
-        self.controller.call_display_info(line_obj)
-        self.controller.show_frame("PointInfoPage")
+        messagebox.showinfo(title="Point Selected", message="Here is more info about the point - {}".format(point_obj.place))
+        with Tracing.span("display_point_info", place=point_obj.place): #timed after the message box, which waits for the user
+            self.figure_canvas.mpl_disconnect(self.canvas_pick_event)
+            self.controller.call_display_info(point_obj)
+            self.controller.show_frame("PointInfoPage")
+
+    def zoom_to_cluster(self, level, index):
+        '''
+        Method for zooming the view into a cluster so that it splits up, the previous view is kept
+        in the toolbar's history so the back button returns to it
+        '''
+        cluster = self.cluster_layer.tree.levels[level]
+        (x_min, x_max), (y_min, y_max) = self.map_axes.get_xlim(), self.map_axes.get_ylim()
+        half_width, half_height = (x_max-x_min)/8, (y_max-y_min)/8
+        x, y = cluster["xs"][index], cluster["ys"][index]
+
+        self.figure_toolbar.push_current()
+        self.map_axes.set_xlim(x-half_width, x+half_width)
+        self.map_axes.set_ylim(y-half_height, y+half_height)
+        self.figure_toolbar.push_current()
+        self.hovered_target = None
+        self.hover_annotation.set_visible(False)
+        self.draw_point_layer()
 
     def reconnect_pick_event(self):
         '''
-        Method to reconnect pick event with the figure after a previous disconnect
+        Method to reconnect the click event with the figure after a previous disconnect
         '''
-        self.canvas_pick_event = self.figure_canvas.mpl_connect("pick_event", self.display_point_info)
\ No newline at end of file
+        self.canvas_pick_event = self.figure_canvas.mpl_connect("button_press_event", self.display_point_info)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import json
+import os
+import re
+
+from DiskCache import DiskCache, CACHE_DIRECTORY
+
+PLACE_CACHE_FILE = os.path.join(CACHE_DIRECTORY, "place_info.sqlite")
+FOUND_TTL = 30*24*60*60 #wikipedia articles about places rarely change
+MISSING_TTL = 24*60*60 #places without an article are looked up again after a day, in case one was written
+MAX_BYTES = 50*1024*1024
+DISTANCE_PATTERN = re.compile(r"^\s*place:\s*\d[\d.]*\s*km\s+[a-z]+\s+of\s+", re.IGNORECASE) #"Place: 95km NNW of "
+
+def normalize_place(place_text):
+    '''
+    function for turning the text of the place label into the key it is cached under, so "Place: 12km SW of
+    Ridgecrest, CA" and "Place: 3km N of  ridgecrest, ca" are the same place. Returns None for places that are
+    not looked up (those not given as a distance from a named place)
+    '''
+    match = DISTANCE_PATTERN.match(place_text)
+    if match is None:
+        return None
+    place = " ".join(place_text[match.end():].split()).lower()
+    return place or None
+
+class PlaceCache:
+    '''
+    A persistent cache of the wikipedia information about places, holding the article title that was found, its
+    cleaned text and the bytes of its thumbnail. Places without an article are cached too (for a shorter time),
+    so they are not searched for on every click
+    '''
+    def __init__(self, filename=PLACE_CACHE_FILE, max_bytes=MAX_BYTES):
+        self.cache = DiskCache(filename, max_bytes)
+
+    def get(self, place):
+        '''
+        Method for getting the information of a place as a dictionary of its title, text, image (bytes or None) and
+        image_url (the url of an image that has not been downloaded yet, or None), returns None if the place has not been looked up
+        '''
+        value = self.cache.get(place)
+        if value is None:
+            return None
+        header_size = int.from_bytes(value[:4], "big")
+        info = json.loads(value[4:4+header_size])
+        info["image"] = value[4+header_size:] or None
+        info.setdefault("image_url", None)
+        return info
+
+    def set(self, place, title, text, image=None, image_url=None):
+        '''
+        Method for storing the information found for a place, a place without text is stored as missing
+        '''
+        header = json.dumps({"title": title, "text": text, "image_url": image_url}).encode("utf-8")
+        ttl = FOUND_TTL if text else MISSING_TTL
+        self.cache.set(place, len(header).to_bytes(4, "big")+header+(image or b""), ttl)
+
+    def statistics(self):
+        return self.cache.statistics()
+
+    def close(self):
+        self.cache.close()
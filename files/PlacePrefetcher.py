@@ -0,0 +1,78 @@
+import threading
+
+import Tracing
+from PlaceCache import normalize_place
+
+PREFETCH_LIMIT = 20 #distinct places looked up after a dataset loads
+PREFETCH_RATE = 1.0 #requests per second at most, so the prefetch does not flood wikipedia
+
+def rank_places(features, limit=PREFETCH_LIMIT):
+    '''
+    function for getting the place labels ("Place: ...") of the places most likely to be clicked, the places of the most
+    significant earthquakes (then the largest) come first. Places shared by many earthquakes are only given once,
+    and every place is given if limit is None
+    '''
+    best = {}
+    for quake in features:
+        properties = quake["properties"]
+        place_text = "Place: {}".format(properties.get("place"))
+        place = normalize_place(place_text)
+        if place is None:
+            continue
+        score = (properties.get("sig") or 0, properties.get("mag") or 0)
+        if place not in best or score > best[place][0]:
+            best[place] = (score, place_text)
+    ranked = sorted(best.values(), key=lambda item: item[0], reverse=True)
+    return [place_text for score, place_text in ranked[:limit]]
+
+class PlacePrefetcher:
+    '''
+    Looks up the wikipedia information of the places of the most significant earthquakes in the background after a
+    dataset loads, so it is already in the place cache when they are clicked. lookup is called with a place label and
+    returns the number of requests it made (0 if nothing had to be fetched), every request counts towards the rate budget.
+    If resolve_all is given, it is called with place labels (like WikiBatch.resolve) so the places are resolved in batches,
+    first the most significant places so their lookups then only download their images, then every other place of the dataset
+    '''
+    def __init__(self, lookup, resolve_all=None, limit=PREFETCH_LIMIT, rate=PREFETCH_RATE):
+        self.lookup = lookup
+        self.resolve_all = resolve_all
+        self.limit = limit
+        self.rate = rate
+        self.worker = None
+        self.stopped = None #set to stop the prefetch that is running
+
+    def run(self, features, stopped):
+        '''
+        Method run on the "prefetch" lane that looks up the ranked places one at a time, returns the number of places fetched
+        '''
+        ranked = rank_places(features, None)
+        top, rest = ranked[:self.limit], ranked[self.limit:]
+        if self.resolve_all is not None:
+            self.resolve_all(top, stopped, 1/self.rate) #a batch is a single request
+        fetched = 0
+        for place_text in top:
+            if stopped.is_set():
+                break
+            requests = self.lookup(place_text)
+            if requests:
+                fetched += 1
+                stopped.wait(requests/self.rate) #waits out the rate budget, but stops at once if asked to
+        if self.resolve_all is not None and rest and not stopped.is_set():
+            self.resolve_all(rest, stopped, 1/self.rate) #the other places are clicked less often, so they come last
+        return fetched
+
+    def start(self, worker, features):
+        '''
+        Method for prefetching the places of features on the "prefetch" lane of a FetchWorker, replacing a prefetch still running
+        '''
+        self.stop()
+        self.worker = worker
+        self.stopped = threading.Event()
+        worker.submit("prefetch", self.run, features, self.stopped,
+            on_error=lambda error: Tracing.note("prefetch", "Prefetching place information failed: {}".format(error)))
+
+    def stop(self):
+        if self.worker is None:
+            return
+        self.stopped.set() #a running prefetch only notices this between places
+        self.worker.cancel("prefetch")
@@ -1,14 +1,40 @@
 from tkinter import messagebox
 import tkinter as tk
-import shutil
+import collections
+import concurrent.futures
 import json
-import re
+import io
+import threading
 
 import Pmw
 import requests
-from bs4 import BeautifulSoup as BS4
 from PIL import ImageTk, Image
 
+import HttpClient
+import Tracing
+import WikiExtract
+from PlaceCache import PlaceCache, PLACE_CACHE_FILE, normalize_place
+from PlacePrefetcher import PlacePrefetcher
+from WikiBatch import WikiBatch
+
+WIKI_TIMEOUT = 60 #seconds before fetching the information about a place is given up
+WIKI_WORKERS = 4 #threads for the requests of a lookup that run at the same time (the candidate titles and the image)
+THUMBNAIL_SIZE = (300, 300) #images are shrunk to fit in this size once, when they are decoded
+PHOTO_CACHE_SIZE = 32 #decoded images kept ready to show, the least recently shown are dropped first
+
+@Tracing.traced("decode_thumbnail")
+def decode_thumbnail(image_bytes, size=THUMBNAIL_SIZE):
+    '''
+    function for decoding the bytes of an image and shrinking it to fit the page, returns None if they are not an image
+    '''
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        image.thumbnail(size)
+        image.load()
+    except OSError:
+        return None
+    return image
+
 class PointInfoPage(tk.Frame):
     '''
     A page that will show the map of currently plotted earthquakes
@@ -19,6 +45,16 @@ class PointInfoPage(tk.Frame):
         self.infopage_balloon = Pmw.Balloon(self)
         self.font = ("Helvitica", 12)
         self.title_font = ("Helvetica", 12, "bold")
+        self.place_cache = PlaceCache(PLACE_CACHE_FILE) #places that were looked up before are shown without any request
+        self.wiki_image_data = False #the title of the article found for the place
+        self.wiki_image_bytes = None #the thumbnail downloaded by get_wiki_image
+        self.wiki_request_failed = False #set if a request failed, so the missing information is not cached
+        self.wiki_executor = concurrent.futures.ThreadPoolExecutor(WIKI_WORKERS, thread_name_prefix="wiki")
+        self.wiki_image_future = None #the image lookup started as soon as the title of the article was known
+        self.photos = collections.OrderedDict() #article title to its image, ready to be shown
+        self.wiki_lock = threading.Lock() #lookups take turns (one that timed out may still be running), as they share the attributes above
+        self.wiki_batch = WikiBatch(self.place_cache)
+        self.place_prefetcher = PlacePrefetcher(self.prefetch_place_info, self.wiki_batch.resolve)
 
         self.menubar = Pmw.MenuBar(self, hull_relief="raised", hull_borderwidth=1, balloon=self.infopage_balloon)
         self.menubar.pack(fill="x")
@@ -57,8 +93,8 @@ class PointInfoPage(tk.Frame):
         self.wiki_scrolledtext = Pmw.ScrolledText(self.wiki_frame_bottom, text_padx=4, text_pady=4)
         self.wiki_scrolledtext.configure(text_state="disabled")
 
-        image = Image.open("default_image.png")
-        self.wiki_photo = ImageTk.PhotoImage(image)
+        self.default_photo = ImageTk.PhotoImage(Image.open("default_image.png")) #decoded once, it is shown for every place without an image
+        self.wiki_photo = self.default_photo
         self.wiki_photo_label = tk.Label(self.wiki_frame_top, image=self.wiki_photo)
         self.wiki_photo_label.image = self.wiki_photo
 
@@ -105,7 +141,7 @@ class PointInfoPage(tk.Frame):
     def on_show_frame(self, page_name):
         '''
         If the user switches back to the settings or map page, then the program first reconnects the pick event to 
-        all MapPoint objects on the map.
+        the earthquakes on the map.
         '''
         self.controller.call_reconnect()
         self.controller.show_frame(page_name)
@@ -132,36 +168,145 @@ class PointInfoPage(tk.Frame):
         self.mmi_label.config(text="MMI: {}".format(point_obj.mmi))
         self.cdi_label.config(text="CDI: {}".format(point_obj.cdi))
 
-    def configure_scrolledtext(self):
+    def request_place_info(self):
+        '''
+        Method for fetching the wikipedia text and image of the place shown by the labels on the "wiki" lane of the
+        controller's fetch worker, a newer selection supersedes one that is still being fetched
+        '''
+        self.wiki_scrolledtext.settext("Loading...")
+        self.configure_event_photo(None)
+        self.controller.fetch_worker.submit("wiki", self.fetch_place_info, self.place_label.cget("text"),
+            on_done=self.show_place_info, on_error=lambda error: self.show_place_info((False, None, None)), timeout=WIKI_TIMEOUT,
+            stoppable=True)
+
+    def fetch_place_info(self, place_text, stopped=None):
+        '''
+        Method run on the fetch worker's thread that gets the text about a place (given as the text of the place label)
+        and its image, returns the text, the title of the article and its decoded image. The image is None if there is
+        none, or if the image of the title is already kept ready to show. stopped is passed on to lookup_place_info
+        '''
+        text_content, title, image_bytes = self.lookup_place_info(place_text, stopped)
+        if image_bytes is None or title in self.photos:
+            return text_content, title, None
+        return text_content, title, decode_thumbnail(image_bytes)
+
+    def prefetch_place_info(self, place_text):
+        '''
+        Method used by the place prefetcher to download the image of a place resolved by the wiki batch into the place cache,
+        returns the number of requests made. None of the attributes shared by the lookups are used, so the wiki_lock is not
+        taken and places clicked meanwhile are not kept waiting. Places the batch could not resolve are looked up once clicked
+        '''
+        place = normalize_place(place_text)
+        info = self.place_cache.get(place) if place is not None else None
+        if info is None or info["image"] is not None or info["image_url"] is None:
+            return 0 #nothing is left to download, or only a whole lookup would find it
+        image = self.download_image_bytes(info["image_url"])
+        if image is not None:
+            self.place_cache.set(place, info["title"], info["text"], image, info["image_url"])
+        return 1
+
+    @Tracing.traced("lookup_place_info")
+    def lookup_place_info(self, place_text, stopped=None):
+        '''
+        Method for getting the text about a place, the title of its article and the bytes of its image (None if there is no image). The information
+        is read from the place cache if the place was looked up before, otherwise it is fetched and cached (even if nothing
+        was found, but not if a request failed). Once stopped is set (the lookup was superseded or timed out) it returns
+        early without caching anything
+        '''
+        place = normalize_place(place_text)
+        with self.wiki_lock:
+            if stopped is not None and stopped.is_set(): #superseded while waiting for the lookup before it
+                return False, None, None
+            info = self.place_cache.get(place) if place is not None else None
+            if info is not None and info["image"] is None and info["image_url"] is not None:
+                #places resolved by the wiki batch only have the url of their image until they are shown
+                if self.download_wiki_image(info["image_url"]):
+                    info["image"] = self.wiki_image_bytes
+                    self.place_cache.set(place, info["title"], info["text"], info["image"], info["image_url"])
+            if info is not None:
+                self.wiki_image_data, self.wiki_image_bytes = info["title"], info["image"]
+                return info["text"], info["title"], info["image"]
+
+            self.wiki_request_failed = False
+            self.wiki_image_bytes = None
+            self.wiki_image_future = None
+            text_content = self.get_wiki_text(place_text, on_title=self.start_wiki_image)
+            if stopped is not None and stopped.is_set():
+                if self.wiki_image_future is not None and not self.wiki_image_future.cancel():
+                    self.wiki_image_future.result() #a running image download would overwrite the image of the next lookup
+                return False, None, None
+            if self.wiki_image_future is not None:
+                image_found = self.wiki_image_future.result()
+            else:
+                image_found = bool(self.wiki_image_data) and self.get_wiki_image()
+            image = self.wiki_image_bytes if image_found else None
+            if place is not None and not self.wiki_request_failed:
+                self.place_cache.set(place, self.wiki_image_data or None, text_content or False, image)
+            return text_content, self.wiki_image_data or None, image
+
+    def start_wiki_image(self, title):
+        '''
+        Method for starting the image lookup of an article on the wiki executor, so it runs alongside the rest of the text lookup
+        '''
+        if title:
+            self.wiki_image_future = self.wiki_executor.submit(self.get_wiki_image, title)
+
+    def show_place_info(self, result):
+        '''
+        Method called in the tkinter thread with the result of fetch_place_info
+        '''
+        text_content, title, image = result
+        self.configure_scrolledtext(text_content)
+        self.configure_event_photo(self.get_photo(title, image))
+
+    def get_photo(self, title, image):
+        '''
+        Method for getting the image of an article ready to show, from the photos already shown or made from its decoded
+        image (which is then kept). Returns None if the article has no image
+        '''
+        if title in self.photos:
+            self.photos.move_to_end(title)
+            return self.photos[title]
+        if image is None:
+            return None
+        photo = ImageTk.PhotoImage(image)
+        if title:
+            self.photos[title] = photo
+            while len(self.photos) > PHOTO_CACHE_SIZE:
+                self.photos.popitem(last=False)
+        return photo
+
+    def configure_scrolledtext(self, text_content):
         '''
-        Method for retrieving text information about the place affected by communicating
-        with the wikipedia API, and configuring the textbox with it
+        Method for configuring the textbox with the text information retrieved from the wikipedia API about the place affected
         '''
-        text_content = self.get_wiki_text()
         if not text_content:
             text_content = "No Information Found"
         self.wiki_scrolledtext.settext(text_content)
 
-    def configure_event_photo(self):
+    def configure_event_photo(self, photo):
         '''
-        Method for retrieving a picture of the place affected by communicating with the
-        wikipedia API, and configuring the wiki_photo_label with it
+        Method for configuring the wiki_photo_label with the picture of the place affected downloaded from the
+        wikipedia API, or the default picture if none was found (photo is None)
         '''
-        use_default = "current_image.png" if self.get_wiki_image() else "default_image.png"
-        image = Image.open(use_default)
-        self.wiki_photo = ImageTk.PhotoImage(image)
+        self.wiki_photo = photo if photo is not None else self.default_photo
         self.wiki_photo_label.config(image=self.wiki_photo)
         self.wiki_photo_label.image = self.wiki_photo
 
-    def wiki_image_url_request(self):
+    @Tracing.traced("wiki_image_url_request")
+    def wiki_image_url_request(self, title=None):
         '''
-        Method used for the direct request to the wikipedia API for an image url for later download
+        Method used for the direct request to the wikipedia API for an image url for later download,
+        the title is the one of the article that was found if it is not given
         '''
+        title = self.wiki_image_data if title is None else title
         try:
-            response = requests.get("https://en.wikipedia.org/w/api.php?action=query&titles={}&prop=pageimages&format=json&pithumbsize=300".format(self.wiki_image_data))
-        except requests.exceptions.ConnectionError:
+            response = HttpClient.get("https://en.wikipedia.org/w/api.php?action=query&titles={}&prop=pageimages&format=json&pithumbsize=300".format(title))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.wiki_request_failed = True
             return False
         if not response.ok:
+            self.wiki_request_failed = True
             return False
 
         data = response.json()
@@ -178,36 +323,56 @@ class PointInfoPage(tk.Frame):
 
         return data
 
-    def get_wiki_image(self):
+    def get_wiki_image(self, title=None):
         '''
-        Method used to download the image of the affected place onto the disk, with
-        the image's download url
+        Method used to download the image of the affected place with the image's download url,
+        the bytes of the image are kept in wiki_image_bytes
         '''
-        image_url = self.wiki_image_url_request()
+        image_url = self.wiki_image_url_request(title)
         if not image_url:
             return False #if no image was found then there is no point in continuing
-        
-        try:
-            response = requests.get(image_url, stream=True)
-        except requests.exceptions.ConnectionError:
-            return False
-        if not response.ok:
+        return self.download_wiki_image(image_url)
+
+    @Tracing.traced("download_wiki_image")
+    def download_wiki_image(self, image_url):
+        '''
+        Method for downloading an image into wiki_image_bytes, returns whether it was downloaded
+        '''
+        image_bytes = self.download_image_bytes(image_url)
+        if image_bytes is None:
+            self.wiki_request_failed = True
             return False
-        with open("current_image.png", "wb") as out_file:
-            shutil.copyfileobj(response.raw, out_file) #statement for writing the image's raw data to disk as a png image file
-        del response
+        self.wiki_image_bytes = image_bytes #the image is kept in memory and decoded by fetch_place_info
 
         return True
 
+    def download_image_bytes(self, image_url):
+        '''
+        Method for downloading an image, returns its bytes or None if the request failed
+        '''
+        try:
+            response = HttpClient.get(image_url, stream=True)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            return None
+        if not response.ok:
+            return None
+        image_file = io.BytesIO()
+        HttpClient.save_stream(response, image_file) #the image is read a chunk at a time as it is downloaded
+        del response
+        return image_file.getvalue()
+
+    @Tracing.traced("wiki_text_url_request")
     def wiki_text_url_request(self, data):
         '''
         Method used for the direct request to the wikipedia API for text information regarding the affected place
         '''
         try:
-            response = requests.get("https://en.wikipedia.org/w/api.php?action=parse&format=json&section=0&prop=text&page={}".format(data))
-        except requests.exceptions.ConnectionError:
+            response = HttpClient.get("https://en.wikipedia.org/w/api.php?action=parse&format=json&section=0&prop=text&page={}".format(data))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.wiki_request_failed = True
             return False
         if not response.ok:
+            self.wiki_request_failed = True
             return False
 
         data = response.json()
@@ -217,7 +382,8 @@ class PointInfoPage(tk.Frame):
             data = data["parse"]["text"]["*"] #the retrieved here
             return data
 
-    def get_wiki_text(self):
+    @Tracing.traced("get_wiki_text")
+    def get_wiki_text(self, place_text=None, on_title=None):
         '''
         By using the place name, this method creates and formats the url most likely to get
         an accurate match with the wikipedia place.
@@ -226,22 +392,28 @@ class PointInfoPage(tk.Frame):
         
         example_text = "Salamanca, Chile"
         
-        first one request is made with the argument of "Salamanca, Chile"
-        if that fails then a second request is made with the argument of "Salamanca"
-        if the result is still not acceptable then a final third request is made with
-        the argument of "Chile", just to be able to get the general information about
-        the country instead
+        requests are made with the arguments "Salamanca, Chile" and "Chile" at the same time,
+        the first one is used if it found an article, otherwise the second (just to be able to
+        get the general information about the country instead). If the article found is a
+        redirect or a list of meanings then the link it gives is followed
+
+        place_text is the text of the place label, which is read from the label if it is not given.
+        on_title is called with the title of the article as soon as it is known, so its image can be
+        looked up while the text of a redirect is still being fetched
         '''
-        search_data = self.place_label.cget("text").split()
+        search_data = (self.place_label.cget("text") if place_text is None else place_text).split()
         if not search_data[1][0].isdigit():
             self.wiki_image_data = False
             return False
         
         search_data = " ".join(search_data[4:])
-        response = self.wiki_text_url_request(search_data)
+        candidates = [search_data] + search_data.split(",")[1:2] #the place with its region, then only the region
+        futures = [self.wiki_executor.submit(self.wiki_text_url_request, candidate) for candidate in candidates]
+        response = futures[0].result()
+        region_future = futures[1] if response and len(futures) > 1 else None #kept in case the place is a list of meanings
         if not response:
             search_data = search_data.split(",")
-            response = self.wiki_text_url_request(search_data[1])
+            response = futures[1].result() if len(futures) > 1 else False
             if not response:
                 self.wiki_image_data = False
                 return False
@@ -250,26 +422,32 @@ class PointInfoPage(tk.Frame):
         else:
             self.wiki_image_data = search_data
 
-        soup = BS4(response, features="lxml")
-        data = soup.find("p").getText() #retrieves text and parses out all of the unecessary html tags
+        article = WikiExtract.parse_article(response) #the html is read once, without building a tree of it
+        data = article.first_paragraph() #the text of the first paragraph without any of its html tags
+        redirect = None
         if "Redirect to:" in data: #instead of the text, if theres a redirect link, then it is followed to find the right text
-            data = soup.find("a").getText() #finds all <a> tags in the text
-            self.wiki_image_data = data
-            response = self.wiki_text_url_request(data) # uses the link found in the first <a> tag for redirect, its almost always the first link
+            redirect = article.links[0] #the first link is almost always the redirect
         elif "commonly refers to:" in data or "may also refer to:" in data: #different format of redirect, gets the first item from the list of links
-            data = soup.find_all("a")[1] #in this case its the second <a> tag link
-            self.wiki_image_data = data
-            response = self.wiki_text_url_request(data)
+            redirect = article.links[1] #in this case its the second link
         elif "may refer to:" in data: #different format of redirect
             search_data = search_data if isinstance(search_data, list) else search_data.split() #sometimes if the first request was successful, then the place name wouldn't have been split into a list, so its easier to just expect a list instead
-            self.wiki_image_data = search_data[1]
-            response = self.wiki_text_url_request(search_data[1])
-        
-        soup = BS4(response, features="lxml")
-        all_text=""
-        for string in soup.find_all("p"): #finds all <p> tags and appends them onto all_text with no newline characters (to avoid text formatting issues)
-            if "\n" not in string:
-                all_text+=string.get_text() 
-        all_text = "".join(re.split("\[\d+\]", all_text)) #sometimes wikipedia articles could have appendix links, e.g [3], which need to be removed
-
-        return all_text #the text is returned for use in configuring the textbox
+            if region_future is not None and region_future.result(): #the region was already fetched alongside the place
+                self.wiki_image_data = search_data[1]
+                article = WikiExtract.parse_article(region_future.result())
+            else:
+                redirect = search_data[1]
+        if redirect is not None:
+            self.wiki_image_data = redirect
+        if on_title is not None:
+            on_title(self.wiki_image_data) #the image is looked up while the text of the redirect is fetched
+        if redirect is not None:
+            response = self.wiki_text_url_request(redirect)
+            article = WikiExtract.parse_article(response) if response else None
+        for future in futures: #candidates that are not used are cancelled if they are still waiting, or their answers ignored
+            future.cancel()
+        if article is None:
+            return False
+
+        #the paragraphs are joined leaving out those with newline characters (to avoid text formatting issues), and without
+        #appendix links, e.g [3]
+        return article.text() #the text is returned for use in configuring the textbox
@@ -0,0 +1,242 @@
+import numpy as np
+from matplotlib.colors import to_rgba_array
+from matplotlib.lines import Line2D
+
+import Tracing
+from EventStore import EventStore
+from SpatialIndex import KDTree
+
+#the colours used for small (below 3), medium (below 6) and large (above 6) earthquakes, matching the map legend
+POINT_COLORS = to_rgba_array(["green", "yellow", "red"], alpha=.3)
+MIN_PICK_RADIUS = 5 #in points, so that the smallest earthquakes can still be clicked
+COMPACT_ROWS = 1000 #rows a live sync can leave unused in the store before it is compacted
+REINDEX_ROWS = 1000 #rows that can be added, moved or updated since the spatial index was built before it is built again
+
+def calculate_point_styles(magnitudes):
+    '''
+    function for calculating the marker size (radius in points) and colour of every earthquake at once,
+    this is the array version of the sizing the MapPoint artists of single earthquakes used to do
+    '''
+    magnitudes = np.nan_to_num(np.asarray(magnitudes, dtype=float)) #events without a magnitude are drawn as the smallest point
+    markersizes = np.power(2, magnitudes)/np.power(2, magnitudes//2)
+    categories = np.where(magnitudes<=3, 0, np.where(magnitudes<=6, 1, 2))
+    return markersizes, POINT_COLORS[categories]
+
+def create_legend_handles():
+    '''
+    function for creating the Line2D objects placed in the legend of the map, explaining the colours of the earthquakes
+    '''
+    return [Line2D([0], [0], marker="o", color="green", label="Small (below 3)"),
+        Line2D([0], [0], marker="o", color="yellow", label="Medium (below 6)"),
+        Line2D([0], [0], marker="o", color="red", label="Large (above 6)")]
+
+class PointLayer:
+    '''
+    Holds the projected coordinates of all earthquakes as arrays and draws them onto the map axes as
+    a single collection, instead of one artist per earthquake which is slow to build and redraw.
+    Every earthquake is kept under its USGS event id, so a new set of earthquakes only changes the
+    rows of the earthquakes that were added, removed or updated
+    '''
+    def __init__(self, axes, basemap):
+        self.axes = axes
+        self.basemap = basemap
+        self.store = EventStore() #the properties of the plotted earthquakes
+        self.store_rows = np.empty(0, dtype=np.int64) #the row in the store of every row of the arrays
+        self.ids = [] #the event id of every row of the arrays
+        self.rows = {} #the row of every event id
+        self.updated = np.empty(0)
+        self.xs = np.empty(0)
+        self.ys = np.empty(0)
+        self.magnitudes = np.empty(0)
+        self.markersizes = np.empty(0)
+        self.colors = POINT_COLORS[:0]
+        self.max_markersize = 0
+        self.spatial_index = KDTree(self.xs, self.ys)
+        self.index_valid = np.empty(0, dtype=bool) #whether each row of the spatial index is still the row of the arrays
+        self.collection = self.axes.scatter(self.xs, self.ys, s=self.markersizes, marker="o",
+            facecolors=self.colors, edgecolors=self.colors, zorder=2)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_features(self, features):
+        '''
+        Method for replacing the plotted earthquakes with a new list of GeoJSON features
+        '''
+        return self.set_store(EventStore(features))
+
+    def set_store(self, store):
+        '''
+        Method for replacing the plotted earthquakes with the earthquakes of an EventStore. Only earthquakes
+        that are new or whose 'updated' time has changed are projected and styled again, and earthquakes
+        that are missing from the new store are removed. Returns the number of added, removed and updated earthquakes
+        '''
+        self.store = store
+        store_rows = np.array([store.rows.get(event_id, -1) for event_id in self.ids], dtype=np.int64)
+        kept = np.flatnonzero(store_rows >= 0)
+        new_updated, old_updated = store.updated[store_rows[kept]], self.updated[kept]
+        changed = [self.ids[row] for row in kept[(new_updated != old_updated)
+            & ~(np.isnan(new_updated) & np.isnan(old_updated))]]
+        removed = [self.ids[row] for row in np.flatnonzero(store_rows < 0)]
+
+        #the rows of ids that appear more than once in the store are those of their last feature
+        unique_rows = np.fromiter(store.rows.values(), dtype=np.int64, count=len(store.rows))
+        plotted = np.zeros(len(store), dtype=bool)
+        plotted[store_rows[kept]] = True
+        added = [store.ids[row] for row in unique_rows[~plotted[unique_rows]]]
+
+        self.store_rows = store_rows #the rows of removed earthquakes are -1 until they are removed
+        if not (added or removed or changed):
+            return 0, 0, 0
+        return self.update_rows(added, removed, changed)
+
+    def apply_changes(self, features, removed_ids):
+        '''
+        Method for changing only the earthquakes a live sync reported, features are the new or updated GeoJSON features
+        and removed_ids the event ids that dropped out. The features are appended to the store instead of building
+        the store of every earthquake again, and the store is compacted once most of its rows are no longer plotted.
+        Returns the number of added, removed and updated earthquakes
+        '''
+        removed = [event_id for event_id in dict.fromkeys(removed_ids) if event_id in self.rows]
+        removed_set = set(removed)
+        features = [quake for quake in features if quake["id"] not in removed_set]
+        feature_ids = list(dict.fromkeys(quake["id"] for quake in features))
+        changed = [event_id for event_id in feature_ids if event_id in self.rows]
+        added = [event_id for event_id in feature_ids if event_id not in self.rows]
+        if not (added or removed or changed):
+            return 0, 0, 0
+        with Tracing.span("event_store", events=len(features)):
+            self.store.extend(features)
+        changes = self.update_rows(added, removed, changed)
+        if len(self.store) > 2*len(self.ids)+COMPACT_ROWS: #rows of updated and removed earthquakes are left behind in the store
+            self.store = self.store.take(self.store_rows)
+            self.store_rows = np.arange(len(self.ids), dtype=np.int64)
+        return changes
+
+    def update_rows(self, added, removed, changed):
+        '''
+        Method for removing, styling again and appending the rows of the earthquakes that changed, the rows of added and
+        changed event ids are read from the store. Only the rows of the arrays that changed are written, so a small change
+        costs little however many earthquakes are plotted. Returns the number of added, removed and updated earthquakes
+        '''
+        store = self.store
+        self.remove_rows([self.rows[event_id] for event_id in removed])
+        for event_id in removed:
+            del self.rows[event_id]
+
+        #the earthquakes that were updated are styled again in place, the new earthquakes are appended
+        changed_rows = np.array([self.rows[event_id] for event_id in changed], dtype=np.int64)
+        new_rows = np.array([store.rows[event_id] for event_id in changed+added], dtype=np.int64)
+        with Tracing.span("projection", events=len(new_rows)):
+            xs, ys = self.project(store, new_rows)
+        magnitudes, updated = store.magnitudes[new_rows], store.updated[new_rows]
+        markersizes, colors = calculate_point_styles(magnitudes)
+        count = len(changed)
+
+        for array, values in ((self.xs, xs), (self.ys, ys), (self.magnitudes, magnitudes), (self.updated, updated),
+                (self.markersizes, markersizes), (self.colors, colors), (self.store_rows, new_rows)):
+            array[changed_rows] = values[:count]
+        self.xs, self.ys = np.concatenate((self.xs, xs[count:])), np.concatenate((self.ys, ys[count:]))
+        self.magnitudes = np.concatenate((self.magnitudes, magnitudes[count:]))
+        self.updated = np.concatenate((self.updated, updated[count:]))
+        self.markersizes = np.concatenate((self.markersizes, markersizes[count:]))
+        self.colors = np.concatenate((self.colors, colors[count:]))
+        self.store_rows = np.concatenate((self.store_rows, new_rows[count:]))
+
+        for event_id in added:
+            self.rows[event_id] = len(self.ids)
+            self.ids.append(event_id)
+
+        self.max_markersize = self.markersizes.max() if len(self.ids) else 0
+        with Tracing.span("artist_build", events=len(self.ids)):
+            self.collection.set_offsets(np.column_stack((self.xs, self.ys)))
+            self.collection.set_sizes(self.markersizes**2)
+            self.collection.set_facecolors(self.colors)
+            self.collection.set_edgecolors(self.colors)
+        self.update_index(changed_rows)
+        return len(added), len(removed), len(changed)
+
+    def update_index(self, changed_rows):
+        '''
+        Method for marking the updated rows as missing from the spatial index, the rows added since it was built are
+        past its end or on rows remove_rows marked already. Rows missing from the index are checked one by one by
+        find_point, and the index is only built again once more than REINDEX_ROWS rows are missing from it
+        '''
+        self.index_valid[changed_rows[changed_rows < len(self.index_valid)]] = False
+        if len(self.unindexed_rows()) > REINDEX_ROWS or not len(self.index_valid):
+            with Tracing.span("spatial_index"):
+                self.spatial_index = KDTree(self.xs, self.ys)
+                self.index_valid = np.ones(len(self.ids), dtype=bool)
+
+    def unindexed_rows(self):
+        '''
+        Method for getting the rows whose position is not in the spatial index, as they were added, moved or updated since it was built
+        '''
+        valid = self.index_valid[:len(self.ids)]
+        return np.concatenate((np.flatnonzero(~valid), np.arange(len(valid), len(self.ids))))
+
+    def project(self, store, rows):
+        '''
+        Method for projecting the coordinates of rows of the store with a single basemap call
+        '''
+        if not len(rows):
+            return np.empty(0), np.empty(0)
+        lats = np.clip(store.lats[rows], -80, 80) #mercator projection is only drawn between -80 and 80 degrees
+        xs, ys = self.basemap(store.lons[rows], lats)
+        return np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+
+    def remove_rows(self, removed_rows):
+        '''
+        Method for removing rows from the arrays by moving the last rows into the gaps they leave,
+        so only the ids of the moved rows have to be changed
+        '''
+        if not removed_rows:
+            return
+        removed_rows = np.array(removed_rows, dtype=np.int64)
+        old_count = len(self.ids)
+        new_count = old_count-len(removed_rows)
+        gaps = np.sort(removed_rows[removed_rows < new_count])
+        moved = np.setdiff1d(np.arange(new_count, old_count), removed_rows) #the kept rows past the new end
+
+        for name in ("xs", "ys", "magnitudes", "updated", "markersizes", "colors", "store_rows"):
+            array = getattr(self, name)
+            array[gaps] = array[moved]
+            setattr(self, name, array[:new_count])
+        self.index_valid[gaps[gaps < len(self.index_valid)]] = False #the index still has the removed earthquakes there
+        self.index_valid[new_count:] = False
+        for gap, row in zip(gaps, moved):
+            event_id = self.ids[row]
+            self.ids[gap] = event_id
+            self.rows[event_id] = int(gap)
+        del self.ids[new_count:]
+
+    def find_point(self, x, y, data_per_point):
+        '''
+        Method for finding the earthquake under the map position (x, y) using the spatial index, a point is hit
+        if the position is within its marker (or within MIN_PICK_RADIUS of a small marker). Of the points hit, the
+        one whose centre is nearest is returned, so a click inside a large marker is not lost to a small marker
+        that is closer but does not reach the click. data_per_point is the size of one typographic point in map
+        coordinates at the current zoom level
+        '''
+        if not len(self.ids):
+            return None
+        max_radius = max(self.max_markersize, MIN_PICK_RADIUS)*data_per_point
+        indices, distances = self.spatial_index.within(x, y, max_radius)
+        indexed = self.index_valid[indices]
+        indices, distances = indices[indexed], distances[indexed]
+        unindexed = self.unindexed_rows() #rows changed since the index was built
+        if len(unindexed):
+            indices = np.concatenate((indices, unindexed))
+            distances = np.concatenate((distances, np.hypot(self.xs[unindexed]-x, self.ys[unindexed]-y)))
+        hit = distances <= np.maximum(self.markersizes[indices], MIN_PICK_RADIUS)*data_per_point
+        if not hit.any():
+            return None
+        indices, distances = indices[hit], distances[hit]
+        return int(indices[np.argmin(distances)])
+
+    def get_point(self, index):
+        '''
+        Method for getting the properties of a single earthquake from the store only once they are needed,
+        so that they can be passed to the PointInfoPage
+        '''
+        return self.store.record(int(self.store_rows[index]), self.xs[index], self.ys[index])
@@ -1,12 +1,23 @@
 from tkinter import messagebox
+from tkinter import ttk
 import tkinter as tk
 import time
 import json
+import os
 import re
 
 import Pmw
 import requests
 
+import HttpClient
+import Tracing
+import UsgsQuery
+from DiskCache import DiskCache, CACHE_DIRECTORY
+from EventCatalog import EventCatalog
+from FetchPlanner import FetchPlanner, SERVER_LIMIT, MAX_EVENTS
+from LiveSync import LiveSync, DEFAULT_INTERVAL
+from FetchWorker import FetchTimeout
+
 #dictionary of many common timezones, some have been urlencoded to avoid errors with the GeoJson API
 TIMEZONES = {"UTC":"%2B00:00", "ECT":"%2B01:00", "EET":"%2B02:00", "ART": "%2B02:00",
     "EAT": "%2B03:00", "MET": "%2B03:30", "NET":"%2B04:00", "PLT":"%2B05:00",
@@ -17,6 +28,10 @@ TIMEZONES = {"UTC":"%2B00:00", "ECT":"%2B01:00", "EET":"%2B02:00", "ART": "%2B02
     "IET": "-05:00", "PRT": "-04:00", "CNT": "-03:30", "AGT": "-03:00", "BET": "-03:00",
     "CAT": "-01:00"}
 
+RESPONSE_CACHE_FILE = os.path.join(CACHE_DIRECTORY, "usgs_responses.sqlite")
+CATALOG_FILE = os.path.join(CACHE_DIRECTORY, "event_catalog.sqlite")
+DATA_TIMEOUT = 30*60 #seconds before a request is given up, queries fetched in parts can take a long time
+
 def create_counter(parent, label_text, current_value, min_, max_, increment):
     '''
     function for creating Pmw.Counter objects short hand
@@ -34,11 +49,33 @@ class SettingsPage(tk.Frame):
         self.controller = controller
         self.field_font = ("Helvitica", 16)
         self.setpage_balloon = Pmw.Balloon(self)
+        self.response_cache = DiskCache(RESPONSE_CACHE_FILE)
+        self.event_catalog = EventCatalog(CATALOG_FILE)
+        self.live_sync = None
+        self.pending_url = None #the url being fetched by the fetch worker
+        self.request_start = None #when the pending url was requested, for the timings
+        self.timings_panel = None
+        self.local_data = None #(window, data, EventStore) of the last complete query, narrower queries are filtered from it
 
         self.menubar = Pmw.MenuBar(self, hull_relief="raised", hull_borderwidth=1, balloon=self.setpage_balloon)
         self.menubar.pack(fill="x")
 
         self.menubar.addmenu("file", "File and Data Options")
+        self.save_data_variable = tk.BooleanVar(self, value=False)
+        self.menubar.addmenuitem("file", "checkbutton", "Also Write Fetched Data To 'current_data.json'",
+            variable=self.save_data_variable, label="Save Data To Disk")
+        self.prefetch_variable = tk.BooleanVar(self, value=False)
+        self.menubar.addmenuitem("file", "checkbutton", "Look Up The Places Of The Most Significant Earthquakes In The Background",
+            variable=self.prefetch_variable, label="Prefetch Place Info")
+        self.menubar.addmenuitem("file", "command", "Show How Often Requests Were Answered By The Cache",
+            command=self.show_cache_statistics, label="Cache Statistics")
+        self.menubar.addmenuitem("file", "command", "Show The Requests Made To Each Server",
+            command=self.show_network_statistics, label="Network Statistics")
+        self.tracing_variable = tk.BooleanVar(self, value=False)
+        self.menubar.addmenuitem("file", "checkbutton", "Time Every Stage Of Fetching, Plotting And Looking Up Earthquakes, Written To '{}'".format(Tracing.TRACE_FILE),
+            command=self.toggle_tracing, variable=self.tracing_variable, label="Record Timings")
+        self.menubar.addmenuitem("file", "command", "Show How Long Every Stage Took Recently",
+            command=self.show_timings_panel, label="Timings Panel")
         self.menubar.addmenuitem("file", "command", "Quit The Program",
             command=self.controller.on_close_window, label="Quit")
 
@@ -47,6 +84,9 @@ class SettingsPage(tk.Frame):
         self.menubar.addmenuitem("pages", "command", "Switch To Map Page",
             command=lambda: self.controller.show_frame("MapPage"), label="Map Page")
 
+        self.live_sync_variable = tk.BooleanVar(self, value=False)
+        self.menubar.addmenuitem("refresh", "checkbutton", "Keep The Standard URL Up To Date By Polling It For Changes",
+            command=self.toggle_live_sync, variable=self.live_sync_variable, label="Live Sync")
         self.menubar.addmenuitem("refresh", "command", "Use The Data You Specified",
             command=self.validate_data, label="use parameters")
         self.menubar.addmenuitem("refresh", "command", "A Standard URL",
@@ -73,6 +113,13 @@ class SettingsPage(tk.Frame):
         self.extra_labelframe = tk.LabelFrame(self.options_frame, text="Additional Options", padx=3, pady=3)
 
         self.options_frame.pack(side="top", fill="both", expand=True, padx=2, pady=2)
+        #shows the progress of requests in place of a message box, the bar and button are only packed while fetching
+        self.status_frame = tk.Frame(self)
+        self.status_frame.pack(side="bottom", fill="x")
+        self.status_label = tk.Label(self.status_frame, text="", anchor="w")
+        self.status_label.pack(side="left", fill="x", expand=True, padx=5)
+        self.progress_bar = ttk.Progressbar(self.status_frame, length=200)
+        self.cancel_button = tk.Button(self.status_frame, text="Cancel", command=self.cancel_request)
         self.coordframe_right_container.pack(side="left", fill="both", expand=True, padx=3, pady=3)
         self.searchtype_labelframe.pack(side="bottom", fill="both", expand=True, padx=3, pady=3)
         self.query_labelframe.pack(side="left", fill="both", expand=True, padx=5, pady=5)
@@ -124,7 +171,8 @@ class SettingsPage(tk.Frame):
         self.maxdepth_counter = create_counter(self.extra_labelframe, "Max Depth:", "1000", "-100", "1000", 1)
         self.minmag_counter = create_counter(self.extra_labelframe, "Min Magnitude:", "1", "0", None, 1)
         self.maxmag_counter = create_counter(self.extra_labelframe, "Max Magnitude:", "2", "1", None, 1)
-        self.limit_counter = create_counter(self.extra_labelframe, "Search Limit:", "1", "1", "20000", 1)
+        self.limit_counter = create_counter(self.extra_labelframe, "Search Limit:", "1", "1", str(MAX_EVENTS), 1)
+        self.sync_interval_counter = create_counter(self.extra_labelframe, "Sync Every:", str(DEFAULT_INTERVAL), "10", "3600", 10)
 
         balloon_helps = (
             (self.startdate_counter, "Limit to events on or after the specified start date"),
@@ -144,8 +192,9 @@ class SettingsPage(tk.Frame):
             (self.maxdepth_counter, "Limit to events with depth less than the specified maximum\nBetween -100 and 1000 km"),
             (self.minmag_counter, "Limit to events with a magnitude larger than the specified minimum"),
             (self.maxmag_counter, "Limit to events with a magnitude smaller than the specified maximum"),
-            (self.limit_counter, "Specify the amount of results returned from your query\nBetween 1 and 20000. Depending on the limit specified,\nreading data from the server may take quite long"),
+            (self.limit_counter, "Specify the amount of results returned from your query\nBetween 1 and {}. Limits over {} are fetched in parts,\nso reading data from the server may take quite long".format(MAX_EVENTS, SERVER_LIMIT)),
             (self.url_time_menu, "If you choose other url options in 'refresh', then this filters by what time interval to get earthquake data"),
+            (self.sync_interval_counter, "Specify how often the standard url is checked for new earthquakes\nwhen 'Live Sync' is switched on in 'refresh'\nBetween 10 and 3600 seconds"),
         )
         #this helps to reduce redundancy by looping through the tuple and both binding a tooltip and packing it to the screen at the same time
         for widget, helpmsg in balloon_helps:
@@ -220,7 +269,6 @@ class SettingsPage(tk.Frame):
             messagebox.showerror(title="Search Limit Error", message="Please check that the search limit you've entered is valid")
             return "Bad Limit"
 
-        print(base_url)
         self.request_new_data(base_url)
     
     def format_default_url(self, url):
@@ -231,28 +279,315 @@ class SettingsPage(tk.Frame):
         time_value = self.url_time_menu.getcurselection()
         self.request_new_data(url.format(time_value.lower()))
 
+    def toggle_live_sync(self):
+        '''
+        Method for starting or stopping the live sync of the current standard url
+        '''
+        url = self.controller.current_url
+        if self.live_sync_variable.get() and url is not None and UsgsQuery.FEED_PATTERN.search(url):
+            self.start_live_sync(url)
+        else:
+            self.stop_live_sync()
+
+    def start_live_sync(self, url, headers=None):
+        '''
+        Method for polling a standard url for changes, starting from the data the controller already has
+        '''
+        self.stop_live_sync()
+        interval = self.sync_interval_counter.component("entry").get()
+        self.live_sync = LiveSync(url, self.controller.current_data["features"], headers,
+            float(interval) if interval else DEFAULT_INTERVAL)
+        self.live_sync.start(self.controller.fetch_worker, self.apply_live_changes, self.show_live_sync_error)
+        self.status_label.configure(text="Live sync of the {} feed every {:g}s".format(
+            UsgsQuery.FEED_PATTERN.search(url).group(1), self.live_sync.interval))
+
+    def stop_live_sync(self):
+        if self.live_sync is not None:
+            self.live_sync.stop()
+            self.live_sync = None
+            self.status_label.configure(text="")
+
+    def apply_live_changes(self, changed, removed):
+        '''
+        Method called by the live sync when the feed has changed, only the changes are pushed to the map page
+        '''
+        self.controller.push_live_data(self.live_sync.url, self.live_sync.collection(), changed, removed)
+        self.status_label.configure(text="Live sync at {}: {} new or updated, {} removed ({} polls, {} unchanged)".format(
+            time.strftime("%H:%M:%S"), len(changed), len(removed), self.live_sync.polls, self.live_sync.unchanged))
+
+    def show_live_sync_error(self, error):
+        '''
+        Method called by the live sync when a poll failed, the next poll is tried as usual
+        '''
+        self.status_label.configure(text="Live sync at {} failed, trying again in {:g}s: {}".format(
+            time.strftime("%H:%M:%S"), self.live_sync.interval, error))
+
     def request_new_data(self, chosen_url):
         '''
-        This method uses the requests module to request the earthquake data using the chosen_url arguement.
-        If the url is the same as the previos request's url, then the previous data is still on the disk and the
-        program uses that instead of starting a new request (simple memoization).
+        This method fetches the earthquake data of the chosen_url on the "data" lane of the controller's fetch worker,
+        so the window keeps responding while it is downloaded, and shows the progress at the bottom of the page.
+        If the url is the same as the previos request's url, then the previous data is still held by the controller and the
+        program uses that instead of starting a new request (simple memoization). A new request supersedes one still running
         '''
-        if self.controller.current_url == chosen_url:
+        if self.controller.current_url == chosen_url or self.pending_url == chosen_url:
             return
-        else:
-            messagebox.showinfo(title="Loading", message="Fetching data please wait for another notification...")
+
+        self.pending_url = chosen_url
+        self.request_start = time.perf_counter()
+        self.show_progress(0)
+        self.controller.fetch_worker.submit("data", self.fetch_data, chosen_url,
+            on_done=lambda result: self.finish_request(chosen_url, result),
+            on_error=lambda error: self.fail_request(error),
+            on_progress=self.show_progress, timeout=DATA_TIMEOUT, stoppable=True)
+
+    def fetch_data(self, chosen_url, progress=None, stopped=None):
+        '''
+        Method for getting the data of a url, run on the fetch worker's thread so no tkinter objects are touched here.
+        Queries asking for part of the data already loaded are filtered from it without any request. Responses are kept in a cache on the disk for a time that depends on the url, so going back to an earlier request
+        does not download it again. Event queries are answered by the local event catalog, which only fetches the times it
+        does not cover yet. Returns the outcome (a string or the response), the parsed data (None if the request failed)
+        and the raw content of the data if there is one. Once stopped is set (the request was cancelled, superseded or
+        timed out) no more parts are fetched and "Cancelled" is returned
+        '''
+        window = UsgsQuery.QueryWindow.from_url(chosen_url)
+        data = self.filter_local_data(window, chosen_url)
+        if data is not None:
+            return "Filtered Data", data, None
+
+        cache_key = UsgsQuery.canonicalize_url(chosen_url)
+        content = self.response_cache.get(cache_key)
+        if content is not None:
+            with Tracing.span("json_parse"):
+                return "Cached Data", json.loads(content), content
+
+        gaps = [None] if window is None else self.event_catalog.missing_windows(window)
+        if not gaps:
+            return "Catalog Data", self.event_catalog.query(window, chosen_url), None
+
+        #if the catalog covers none of the window the url is fetched as it is, otherwise only the gaps are fetched
+        whole_window = window is None or (len(gaps) == 1 and (gaps[0].start, gaps[0].end) == (window.start, window.end))
+        if window is not None and (window.limit is None or window.limit > SERVER_LIMIT):
+            return self.request_in_parts(chosen_url, window, gaps, whole_window, progress, stopped)
+        for done, gap in enumerate(gaps):
+            if stopped is not None and stopped.is_set():
+                return "Cancelled", None, None #the gaps fetched so far are kept by the catalog
+            if progress is not None and len(gaps) > 1:
+                progress(done, len(gaps), len(self.event_catalog))
             try:
-                response = requests.get(chosen_url)
-            except requests.exceptions.ConnectionError:
-                messagebox.showerror(title="Connection Error", message="Please check you're internet connection\nas a request could not be made")
-                return "Bad Connection"
+                response = HttpClient.get(chosen_url if whole_window else gap.url(chosen_url))
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                return "Bad Connection", None, None
             if not response.ok:
-                messagebox.showerror(title="Server Error", message="There was an error in retrieving the data\nThe data collection service could be down right now")
-                return response
+                return response, None, None
+
+            with Tracing.span("json_parse"):
+                data = response.json() #the data is only parsed here and handed to the map page in memory
+            if gap is not None:
+                self.event_catalog.add_features(data["features"])
+                if gap.limit is None or len(data["features"]) < gap.limit: #a window cut off by the limit is not covered
+                    self.event_catalog.add_coverage(gap)
+
+        if whole_window:
+            self.response_cache.set(cache_key, response.content, UsgsQuery.cache_ttl(chosen_url))
+            return response, data, response.content
+        return response, self.event_catalog.query(window, chosen_url), None
+
+    def filter_local_data(self, window, chosen_url):
+        '''
+        Method for answering a query from the last complete query held in memory if its window covers the new one,
+        with numpy filters over the columns of its events. Returns the data in the order and with the limit the
+        server would use, or None if the query has to be fetched. numpy and the EventStore are only imported here,
+        so the settings page does not load them at startup
+        '''
+        import numpy as np
+        from EventStore import EventStore
+
+        local_data = self.local_data
+        if window is None or local_data is None or not local_data[0].covers(window):
+            return None
+        local_window, data, store = local_data
+        if store is None: #the columns are only built once a query is filtered from the data
+            store = EventStore(data["features"])
+            self.local_data = (local_window, data, store)
+
+        times = store.numbers["time"]
+        rows = np.flatnonzero(window.matches(store.lons, store.lats, store.depths, times, store.magnitudes))
+        rows = rows[np.argsort(times[rows], kind="stable")]
+        if window.orderby != "time-asc":
+            rows = rows[::-1]
+        features = [data["features"][row] for row in rows[:window.limit]]
+        return {"type": "FeatureCollection", "metadata": {"url": chosen_url, "title": "Filtered Earthquakes", "status": 200,
+            "count": len(features)}, "features": features}
+
+    def remember_local_data(self, chosen_url, data):
+        '''
+        Method for keeping the data of a query in memory for filter_local_data, only queries that were not cut off by their limit are kept
+        '''
+        window = UsgsQuery.QueryWindow.from_url(chosen_url)
+        if window is not None and (window.limit is None or len(data["features"]) < window.limit):
+            self.local_data = (window, data, None)
+
+    def request_in_parts(self, chosen_url, window, gaps, whole_window, progress=None, stopped=None):
+        '''
+        Method for fetching queries that can match more events than the server returns at once, the FetchPlanner
+        splits them into windows under the server limit which are fetched at the same time and added to the catalog
+        as they arrive
+        '''
+        planner = FetchPlanner(chosen_url, progress=progress, stopped=stopped)
+        def on_window_fetched(part, features, complete):
+            self.event_catalog.add_features(features)
+            if complete:
+                self.event_catalog.add_coverage(part)
+
+        try:
+            features = planner.fetch_all(gaps, window.limit if whole_window else None, on_window_fetched)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            return "Bad Connection", None, None
+        except requests.exceptions.HTTPError as error:
+            return error.response, None, None
+        if planner.stopped.is_set():
+            return "Cancelled", None, None
+
+        if not whole_window:
+            return "Fetched In Parts", self.event_catalog.query(window, chosen_url), None
+        data = {"type": "FeatureCollection", "metadata": {"url": chosen_url, "title": "USGS Earthquakes", "status": 200,
+            "count": len(features)}, "features": features}
+        content = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        if not planner.truncated:
+            self.response_cache.set(UsgsQuery.canonicalize_url(chosen_url), content, UsgsQuery.cache_ttl(chosen_url))
+        return "Fetched In Parts", data, content
+
+    def finish_request(self, chosen_url, result):
+        '''
+        Method called in the tkinter thread with the result of fetch_data, hands the data to the controller
+        or shows what went wrong. Returns the outcome of the request
+        '''
+        self.record_request(chosen_url)
+        self.pending_url = None
+        self.show_progress(None)
+        outcome, data, content = result
+        if data is None:
+            if isinstance(outcome, str):
+                messagebox.showerror(title="Connection Error", message="Please check you're internet connection\nas a request could not be made")
             else:
-                self.controller.modify_url(chosen_url)
-                with open("current_data.json", "w") as json_file:
-                    data = response.json()
-                    json.dump(data, json_file)
-                    messagebox.showinfo(title="Data Retrieved", message="{} earthquakes were found".format(data["metadata"]["count"]))
-                return response
\ No newline at end of file
+                messagebox.showerror(title="Server Error", message="There was an error in retrieving the data\nThe data collection service could be down right now")
+            return outcome
+
+        self.use_new_data(chosen_url, data, content)
+        if outcome != "Filtered Data":
+            self.remember_local_data(chosen_url, data)
+        if self.prefetch_variable.get():
+            self.controller.call_prefetch_place_info(data["features"])
+        sources = {"Filtered Data": " (filtered locally from the loaded data)", "Cached Data": " (from the cache)",
+            "Catalog Data": " (from the local catalog)"}
+        source = sources.get(outcome if isinstance(outcome, str) else None, " (from the server)")
+        messagebox.showinfo(title="Data Retrieved", message="{} earthquakes were found{}".format(data["metadata"]["count"], source))
+        if self.live_sync_variable.get() and UsgsQuery.FEED_PATTERN.search(chosen_url):
+            self.start_live_sync(chosen_url, getattr(outcome, "headers", None))
+        return outcome
+
+    def fail_request(self, error):
+        '''
+        Method called in the tkinter thread when fetch_data raised an error or took too long
+        '''
+        self.record_request(self.pending_url)
+        self.pending_url = None
+        self.show_progress(None)
+        if isinstance(error, FetchTimeout):
+            messagebox.showerror(title="Timeout Error", message="The request took too long and was stopped\nPlease try again later")
+        else:
+            messagebox.showerror(title="Server Error", message="There was an error in retrieving the data\n{}".format(error))
+
+    def record_request(self, chosen_url):
+        '''
+        Method for timing a request from request_new_data until its result reached the tkinter thread
+        '''
+        if self.request_start is not None:
+            Tracing.record("request_new_data", self.request_start, args={"url": chosen_url})
+            self.request_start = None
+
+    def cancel_request(self):
+        '''
+        Method for cancelling the request that is being fetched, anything it has fetched so far is still kept by the catalog
+        '''
+        self.controller.fetch_worker.cancel("data")
+        self.pending_url = None
+        self.request_start = None
+        self.show_progress(None)
+
+    def show_progress(self, done, total=0, events=0):
+        '''
+        Method for showing the progress of a request at the bottom of the page, None hides it. Requests fetched
+        in parts report how many parts are done, the others only show that they are running
+        '''
+        if done is None:
+            self.progress_bar.stop()
+            self.progress_bar.pack_forget()
+            self.cancel_button.pack_forget()
+            self.status_label.configure(text="")
+            return
+        if not self.progress_bar.winfo_ismapped():
+            self.cancel_button.pack(side="right", padx=5)
+            self.progress_bar.pack(side="right", padx=5)
+        if total:
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode="determinate", maximum=total, value=done)
+            self.status_label.configure(text="Fetched {} of {} parts ({} earthquakes)".format(done, total, events))
+        else:
+            self.progress_bar.configure(mode="indeterminate")
+            self.progress_bar.start(15)
+            self.status_label.configure(text="Fetching data...")
+
+    def use_new_data(self, chosen_url, data, content=None):
+        '''
+        Method for handing the parsed data to the controller, and writing the raw content to the disk if saving is switched on
+        (data put together by the catalog has no raw content so it is serialized)
+        '''
+        if self.live_sync is not None and self.live_sync.url != chosen_url:
+            self.stop_live_sync()
+        self.controller.modify_data(chosen_url, data)
+        if self.save_data_variable.get():
+            with open("current_data.json", "wb") as json_file:
+                json_file.write(content if content is not None else json.dumps(data).encode("utf-8"))
+
+    def show_network_statistics(self):
+        '''
+        Method for showing the number of requests made to each server, how long they took and how much was downloaded
+        '''
+        lines = ["{}\n    {} requests ({} failed), {:.0f} ms on average, {:.1f} MB".format(host, counters["requests"],
+            counters["errors"], counters["latency"]*1000, counters["bytes"]/1024/1024)
+            for host, counters in sorted(HttpClient.statistics().items())]
+        messagebox.showinfo(title="Network Statistics", message="\n".join(lines) or "No requests have been made yet")
+
+    def show_cache_statistics(self):
+        '''
+        Method for showing how often requests were answered by the response cache
+        '''
+        stats = self.response_cache.statistics()
+        messagebox.showinfo(title="Cache Statistics", message="Hits: {}\nMisses: {} ({} expired)\nHit rate: {:.0%}\n"
+            "Entries: {} ({:.1f} MB)\nEvicted: {}".format(stats["hits"], stats["misses"], stats["expired"], stats["hit_rate"],
+            stats["entries"], stats["bytes"]/1024/1024, stats["evictions"]))
+
+    def toggle_tracing(self):
+        '''
+        Method for starting or stopping the recording of timings, the spans recorded are written to the trace file when it stops
+        '''
+        if self.tracing_variable.get():
+            Tracing.shared_tracer.clear()
+            Tracing.enable()
+            return
+        Tracing.disable()
+        count = Tracing.write()
+        messagebox.showinfo(title="Timings Recorded", message="{} spans were written to '{}'\n"
+            "(open it with chrome://tracing or ui.perfetto.dev)".format(count, Tracing.TRACE_FILE))
+
+    def show_timings_panel(self):
+        '''
+        Method for showing the window with the latest timings of every stage, only one is kept open. TKCustomClasses is
+        only imported here, so the settings page does not load it at startup
+        '''
+        from TKCustomClasses import TimingsPanel
+        if self.timings_panel is not None and self.timings_panel.winfo_exists():
+            self.timings_panel.lift()
+            return
+        self.timings_panel = TimingsPanel(self)
@@ -0,0 +1,89 @@
+import numpy as np
+
+class KDTree:
+    '''
+    A 2d tree over the projected x/y coordinates of the plotted earthquakes, used to find the earthquake
+    nearest to the mouse without checking every point. The tree is stored implicitly, the points are reordered
+    so that every node is a slice of the arrays split at its middle position, alternating between x and y
+    '''
+    LEAF_SIZE = 32
+
+    def __init__(self, xs, ys):
+        self.points = np.column_stack((np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)))
+        self.indices = np.arange(len(self.points))
+        self.splits = {} #the median of every node, kept as the child nodes are reordered afterwards
+
+        stack = [(0, len(self.points), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi-lo <= self.LEAF_SIZE:
+                continue
+            mid = (lo+hi)//2
+            #puts the median at mid, with smaller values before it and larger values after it
+            order = np.argpartition(self.points[lo:hi, axis], mid-lo)
+            self.points[lo:hi] = self.points[lo:hi][order]
+            self.indices[lo:hi] = self.indices[lo:hi][order]
+            self.splits[(lo, hi)] = self.points[mid, axis]
+            stack.append((lo, mid, 1-axis))
+            stack.append((mid, hi, 1-axis))
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, x, y, max_distance=np.inf):
+        '''
+        Method for finding the point closest to (x, y) within max_distance, returns the index of the point
+        (as it was given to the tree) and its distance, or (None, None) if there is no point close enough
+        '''
+        best_position, best_distance = None, max_distance
+        stack = [(0, len(self.points), 0, 0.0)]
+        while stack:
+            lo, hi, axis, bound = stack.pop()
+            if bound > best_distance: #the whole node is further away than the best point found so far
+                continue
+
+            if hi-lo <= self.LEAF_SIZE:
+                if hi == lo:
+                    continue
+                distances = np.hypot(self.points[lo:hi, 0]-x, self.points[lo:hi, 1]-y)
+                position = int(np.argmin(distances))
+                if distances[position] <= best_distance:
+                    best_position, best_distance = lo+position, distances[position]
+                continue
+
+            mid = (lo+hi)//2
+            difference = (x if axis == 0 else y)-self.splits[(lo, hi)]
+            near, far = ((lo, mid), (mid, hi)) if difference < 0 else ((mid, hi), (lo, mid))
+            stack.append((far[0], far[1], 1-axis, abs(difference)))
+            stack.append((near[0], near[1], 1-axis, bound)) #searched first as it was added last
+
+        if best_position is None:
+            return None, None
+        return int(self.indices[best_position]), float(best_distance)
+
+    def within(self, x, y, max_distance):
+        '''
+        Method for finding every point within max_distance of (x, y), returns the indices of the points
+        (as they were given to the tree) and their distances as arrays
+        '''
+        positions, distances = [], []
+        stack = [(0, len(self.points), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi-lo <= self.LEAF_SIZE:
+                node_distances = np.hypot(self.points[lo:hi, 0]-x, self.points[lo:hi, 1]-y)
+                inside = np.flatnonzero(node_distances <= max_distance)
+                positions.append(lo+inside)
+                distances.append(node_distances[inside])
+                continue
+
+            mid = (lo+hi)//2
+            difference = (x if axis == 0 else y)-self.splits[(lo, hi)]
+            if difference-max_distance <= 0: #the circle reaches below the split
+                stack.append((lo, mid, 1-axis))
+            if difference+max_distance >= 0:
+                stack.append((mid, hi, 1-axis))
+
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        return self.indices[np.concatenate(positions)], np.concatenate(distances)
@@ -1,34 +1,62 @@
+from tkinter import messagebox
 import tkinter as tk
-import datetime
-import math
-from matplotlib.lines import Line2D
-class MapPoint(Line2D):
-    def __init__(self, x, y, magnitude, place, time, felt, cdi, mmi, alert, tsunami, sig, title, status, dmin, gap, magtype, type_):
+
+import Tracing
+
+PANEL_REFRESH = 1000 #milliseconds between updates of the timings panel
+NOTES_SHOWN = 8 #latest notes of the tracer shown under the timings
+
+def format_timings(summary):
+    '''
+    function for formatting the rolling summary of the tracer as a table of the stages with their latencies in milliseconds
+    '''
+    lines = ["{:<24} {:>7} {:>9} {:>9} {:>9} {:>9}".format("Stage", "Count", "Last", "Mean", "p95", "Max")]
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["mean"]): #the slowest stages first
+        lines.append("{:<24} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(name, stats["count"],
+            stats["last"]*1000, stats["mean"]*1000, stats["p95"]*1000, stats["max"]*1000))
+    return "\n".join(lines)
+
+def format_notes(notes):
+    '''
+    function for formatting notes of the tracer (such as background tasks that failed) one per line, newest last
+    '''
+    return "\n".join("{} {}: {}".format(clock, name, text) for clock, name, text in notes)
+
+class TimingsPanel(tk.Toplevel):
+    '''
+    A window showing how long every stage of fetching, plotting and looking up earthquakes took recently,
+    updated every second while timings are being recorded
+    '''
+    def __init__(self, parent, trace_file=Tracing.TRACE_FILE):
+        super().__init__(parent)
+        self.title("Timings (ms)")
+        self.trace_file = trace_file
+        self.timings_label = tk.Label(self, font=("Courier", 10), justify="left", anchor="nw")
+        self.timings_label.pack(fill="both", expand=True, padx=5, pady=5)
+        self.notes_label = tk.Label(self, font=("Courier", 10), justify="left", anchor="nw")
+        self.notes_label.pack(fill="x", padx=5)
+        self.status_label = tk.Label(self, anchor="w")
+        self.status_label.pack(side="left", fill="x", expand=True, padx=5)
+        tk.Button(self, text="Save Trace", command=self.save_trace).pack(side="right", padx=5, pady=5)
+        self.refresh_job = None
+        self.refresh()
+
+    def refresh(self):
+        summary = Tracing.summary()
+        self.timings_label.configure(text=format_timings(summary) if summary else "No timings have been recorded yet")
+        self.notes_label.configure(text=format_notes(Tracing.latest_notes()[-NOTES_SHOWN:]))
+        self.status_label.configure(text="Recording" if Tracing.enabled() else "Not recording (File > Record Timings)")
+        self.refresh_job = self.after(PANEL_REFRESH, self.refresh)
+
+    def save_trace(self):
         '''
-        The object used when plotting points on the map, by storing the earthquakes properties and passing them to the PointInfoPage when
-        clicked, thereby improving performance by not having to search through a list
+        Method for writing the spans recorded so far into the trace file
         '''
+        count = Tracing.write(self.trace_file)
+        messagebox.showinfo(title="Trace Saved", message="{} spans were written to '{}'".format(count, self.trace_file), parent=self)
 
-        #calculates the radius of the point on the map in proportion to the magnitude
-        markersize = math.pow(2, magnitude)/math.pow(2, magnitude//2)
-        if magnitude<=3: color="green"
-        elif 3<magnitude<=6: color="yellow"
-        else: color="red"
-        super().__init__(xdata=[x,], ydata=[y,],marker="o",markersize=markersize,color=color,alpha=.3,picker=markersize)
-
-        self.title = title
-        self.place = place
-        self.time = datetime.datetime.fromtimestamp(time/1000.0).isoformat()
-        self.magnitude = magnitude
-        self.felt = felt
-        self.cdi = cdi
-        self.mmi = mmi
-        self.alert = alert
-        self.tsunami = bool(tsunami)
-        self.sig = sig
-        self.status = status
-        self.dmin = dmin
-        self.gap = gap
-        self.magtype = magtype
-        self.type_ = type_
-
+    def destroy(self):
+        if self.refresh_job is not None:
+            self.after_cancel(self.refresh_job)
+            self.refresh_job = None
+        super().destroy()
@@ -0,0 +1,213 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+TRACE_FILE = "timings_trace.json"
+MAX_EVENTS = 200000 #spans kept for the trace file, later spans are only counted in the summary
+SUMMARY_WINDOW = 200 #latest durations of every stage that the rolling summary is worked out from
+NOTE_WINDOW = 50 #latest notes kept for the timings panel
+
+class NullSpan:
+    '''
+    The span given out while tracing is switched off, it does nothing so timed code costs one check and two empty calls
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    '''
+    A timed section of code, recorded by its tracer when the with block is left
+    '''
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+class Tracer:
+    '''
+    Times named stages of the program (fetching, parsing, plotting, drawing and the wikipedia lookups) from any thread.
+    Nothing is recorded while it is switched off. The spans can be written as a Chrome trace file (opened with
+    chrome://tracing or ui.perfetto.dev) and the latest durations of every stage are kept for a rolling summary
+    '''
+    def __init__(self, max_events=MAX_EVENTS, window=SUMMARY_WINDOW):
+        self.enabled = False
+        self.max_events = max_events
+        self.window = window
+        self.lock = threading.Lock()
+        self.notes = collections.deque(maxlen=NOTE_WINDOW) #kept when the spans are cleared, as they are not timings
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.origin = time.perf_counter() #the times of the trace file are counted from here
+            self.events = []
+            self.dropped = 0
+            self.threads = {}
+            self.durations = {}
+            self.counts = collections.Counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, **args):
+        '''
+        Method for timing a with block as the stage name, args are shown with the span in the trace file
+        '''
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def record(self, name, start, end=None, args=None):
+        '''
+        Method for recording a stage that started and ended at perf_counter times, used for stages that
+        start and end in different methods (like a request that is answered on another thread)
+        '''
+        if not self.enabled:
+            return
+        end = time.perf_counter() if end is None else end
+        thread = threading.current_thread()
+        with self.lock:
+            self.threads[thread.ident] = thread.name
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, end-start, thread.ident, args))
+            else:
+                self.dropped += 1
+            durations = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = collections.deque(maxlen=self.window)
+            durations.append(end-start)
+            self.counts[name] += 1
+
+    def note(self, name, text):
+        '''
+        Method for noting something the program did in the background (such as how long the startup took, or a background
+        task that failed). The latest notes are kept even while tracing is switched off so the timings panel can show
+        them, and while it is switched on they are also written to the trace file as instant events
+        '''
+        now = time.perf_counter()
+        thread = threading.current_thread()
+        with self.lock:
+            self.notes.append((time.strftime("%H:%M:%S"), name, text))
+            if not self.enabled:
+                return
+            self.threads[thread.ident] = thread.name
+            if len(self.events) < self.max_events:
+                self.events.append((name, now, None, thread.ident, {"note": text}))
+            else:
+                self.dropped += 1
+
+    def latest_notes(self):
+        '''
+        Method for getting the latest notes as (clock time, name, text), oldest first
+        '''
+        with self.lock:
+            return list(self.notes)
+
+    def summary(self):
+        '''
+        Method for getting the number of times every stage was timed, and the last, mean, 95th percentile
+        and longest of its latest durations in seconds
+        '''
+        with self.lock:
+            latest = {name: sorted(durations) for name, durations in self.durations.items()}
+            last = {name: durations[-1] for name, durations in self.durations.items()}
+            counts = dict(self.counts)
+        return {name: {"count": counts[name], "last": last[name], "mean": sum(durations)/len(durations),
+            "p95": durations[min(len(durations)-1, int(len(durations)*0.95))], "max": durations[-1]}
+            for name, durations in latest.items()}
+
+    def trace_events(self):
+        '''
+        Method for getting the spans in the Chrome trace event format, complete events with times in microseconds
+        (and instant events for the notes)
+        '''
+        pid = os.getpid()
+        with self.lock:
+            events, threads, origin = list(self.events), dict(self.threads), self.origin
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": name}}
+            for ident, name in threads.items()]
+        for name, start, duration, ident, args in events:
+            event = {"name": name, "cat": "gis", "ph": "X", "ts": round((start-origin)*1e6, 3), "pid": pid, "tid": ident}
+            if duration is None:
+                event.update(ph="i", s="t")
+            else:
+                event["dur"] = round(duration*1e6, 3)
+            if args:
+                event["args"] = {key: str(value) for key, value in args.items()}
+            trace.append(event)
+        return trace
+
+    def write(self, filename=TRACE_FILE):
+        '''
+        Method for writing the spans recorded so far into a Chrome trace file, returns the number of spans written
+        '''
+        trace = self.trace_events()
+        with open(filename, "w") as trace_file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, trace_file)
+        return sum(event["ph"] == "X" for event in trace)
+
+#the tracer used by the whole program, the module functions below are shortcuts to it
+shared_tracer = Tracer()
+
+def span(name, **args):
+    return shared_tracer.span(name, **args) if shared_tracer.enabled else NULL_SPAN
+
+def record(name, start, end=None, args=None):
+    shared_tracer.record(name, start, end, args)
+
+def note(name, text):
+    shared_tracer.note(name, text)
+
+def latest_notes():
+    return shared_tracer.latest_notes()
+
+def traced(name):
+    '''
+    decorator for timing every call of a function as the stage name
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not shared_tracer.enabled:
+                return function(*args, **kwargs)
+            with Span(shared_tracer, name, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def enabled():
+    return shared_tracer.enabled
+
+def enable():
+    shared_tracer.enable()
+
+def disable():
+    shared_tracer.disable()
+
+def summary():
+    return shared_tracer.summary()
+
+def write(filename=TRACE_FILE):
+    return shared_tracer.write(filename)
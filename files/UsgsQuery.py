@@ -0,0 +1,250 @@
+import datetime
+import copy
+import math
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+#how long the summary feeds are cached for in seconds, the hour feed is updated every minute by the USGS
+FEED_TTLS = {"hour": 60, "day": 5*60, "week": 15*60, "month": 30*60}
+RECENT_TTL = 5*60 #queries that reach into the last few weeks, where events are still being added and reviewed
+HISTORICAL_TTL = 30*24*60*60 #queries that ended long ago and are unlikely to change
+HISTORICAL_AGE = datetime.timedelta(days=30)
+
+TIME_PARAMETERS = ("starttime", "endtime", "updatedafter")
+NUMBER_PATTERN = re.compile(r"[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+FEED_PATTERN = re.compile(r"/summary/[^/]*_(hour|day|week|month)\.geojson$")
+
+def parse_time(value):
+    '''
+    function for converting an ISO 8601 time of a query into a naive datetime in UTC, times without a
+    timezone are already in UTC for the USGS. Returns None if the value is not a time
+    '''
+    try:
+        time = datetime.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except (ValueError, AttributeError):
+        return None
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time
+
+def format_time(time):
+    '''
+    function for writing a time the way the USGS accepts it, without a timezone as it is in UTC
+    '''
+    return time.isoformat(timespec="milliseconds" if time.microsecond else "seconds")
+
+def normalize_value(name, value):
+    '''
+    function for writing a parameter value in one way only, so "-90", "-90.0" and "-9e1" are the same
+    and times in any timezone are written in UTC
+    '''
+    if name in TIME_PARAMETERS:
+        time = parse_time(value.replace(" ", "+")) #an unencoded + of a timezone is read as a space
+        return value if time is None else format_time(time)
+    if NUMBER_PATTERN.fullmatch(value):
+        number = float(value)
+        return str(int(number)) if number.is_integer() and abs(number) < 1e15 else repr(number)
+    return value
+
+def replace_parameters(url, path=None, **parameters):
+    '''
+    function for changing the parameters (and optionally the path) of a url, parameters set to None are removed
+    '''
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query) if name.lower() not in parameters]
+    query += [(name, value) for name, value in parameters.items() if value is not None]
+    return urlunsplit((parts.scheme, parts.netloc, path or parts.path, urlencode(query, safe=":,"), ""))
+
+def query_parameters(url):
+    '''
+    function for getting the normalized parameters of a query url as a dictionary
+    '''
+    return {name.lower(): normalize_value(name.lower(), value)
+        for name, value in parse_qsl(urlsplit(url).query, keep_blank_values=False)}
+
+def canonicalize_url(url):
+    '''
+    function for turning a query url into the key it is cached under, urls asking for the same
+    data give the same key no matter the order or formatting of their parameters
+    '''
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(query_parameters(url).items()), safe=":,")
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+def cache_ttl(url, now=None):
+    '''
+    function for choosing how long the response of a url can be cached for, summary feeds are cached for
+    less than the time they are updated in and queries of a time window that ended long ago are cached the longest
+    '''
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    feed = FEED_PATTERN.search(urlsplit(url).path)
+    if feed:
+        return FEED_TTLS[feed.group(1)]
+
+    endtime = parse_time(query_parameters(url).get("endtime"))
+    if endtime is not None and now-endtime > HISTORICAL_AGE:
+        return HISTORICAL_TTL
+    return RECENT_TTL
+
+#the parameters of an event query that the local catalog can answer, queries using any other parameter go to the server
+WINDOW_PARAMETERS = {"format", "starttime", "endtime", "minlatitude", "maxlatitude", "minlongitude", "maxlongitude",
+    "latitude", "longitude", "maxradius", "maxradiuskm", "mindepth", "maxdepth", "minmagnitude", "maxmagnitude",
+    "limit", "orderby"}
+DEFAULT_QUERY_AGE = datetime.timedelta(days=30) #the USGS returns the last 30 days when there is no starttime
+KM_PER_DEGREE = 111.2
+
+def to_milliseconds(time):
+    '''
+    function for converting a naive UTC datetime into milliseconds since the epoch, as used by the GeoJSON times
+    '''
+    return (time-datetime.datetime(1970, 1, 1)).total_seconds()*1000
+
+def from_milliseconds(milliseconds):
+    '''
+    function for converting milliseconds since the epoch into a naive UTC datetime
+    '''
+    return datetime.datetime(1970, 1, 1)+datetime.timedelta(milliseconds=milliseconds)
+
+def is_event_query(url):
+    '''
+    function for checking whether a url is a query of the USGS event web service (rather than a summary feed)
+    '''
+    parts = urlsplit(url)
+    return parts.netloc.lower() == "earthquake.usgs.gov" and parts.path.rstrip("/").endswith("/fdsnws/event/1/query")
+
+def great_circle_degrees(lat1, lon1, lat2, lon2):
+    '''
+    function for calculating the angle in degrees between points on a sphere (haversine formula),
+    works on numpy arrays as well as single numbers. numpy is only imported once this is first used, so that it
+    is not loaded when the program starts
+    '''
+    import numpy as np
+
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2-lat1)/2)**2+np.cos(lat1)*np.cos(lat2)*np.sin((lon2-lon1)/2)**2
+    return np.degrees(2*np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+class QueryWindow:
+    '''
+    The time, area, depth and magnitude range asked for by an event query. The area is a rectangle of
+    latitudes and longitudes, or a circle (which also keeps the rectangle around it)
+    '''
+    def __init__(self, start, end, min_lat=-90, max_lat=90, min_lon=-180, max_lon=180, circle=None,
+            min_depth=-100, max_depth=1000, min_mag=None, max_mag=None, limit=None, orderby="time"):
+        self.start = start #in milliseconds since the epoch
+        self.end = end
+        self.min_lat, self.max_lat = min_lat, max_lat
+        self.min_lon, self.max_lon = min_lon, max_lon
+        self.circle = circle #(latitude, longitude, radius in degrees)
+        self.min_depth, self.max_depth = min_depth, max_depth
+        self.min_mag, self.max_mag = min_mag, max_mag
+        self.limit = limit
+        self.orderby = orderby
+
+    @classmethod
+    def from_url(cls, url, now=None):
+        '''
+        Method for reading the window of an event query url, returns None if the url is not an event query or uses
+        parameters the window does not cover (such as event types or alert levels)
+        '''
+        if not is_event_query(url):
+            return None
+        parameters = query_parameters(url)
+        if set(parameters)-WINDOW_PARAMETERS or parameters.get("format", "geojson") != "geojson" \
+                or parameters.get("orderby", "time") not in ("time", "time-asc"):
+            return None
+        try:
+            numbers = {name: float(value) for name, value in parameters.items()
+                if name not in ("format", "orderby", "starttime", "endtime")}
+        except ValueError:
+            return None
+
+        now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        start = parse_time(parameters["starttime"]) if "starttime" in parameters else now-DEFAULT_QUERY_AGE
+        end = parse_time(parameters["endtime"]) if "endtime" in parameters else now
+        if start is None or end is None:
+            return None
+
+        window = cls(to_milliseconds(start), to_milliseconds(end), numbers.get("minlatitude", -90), numbers.get("maxlatitude", 90),
+            numbers.get("minlongitude", -180), numbers.get("maxlongitude", 180), None, numbers.get("mindepth", -100),
+            numbers.get("maxdepth", 1000), numbers.get("minmagnitude"), numbers.get("maxmagnitude"),
+            int(numbers["limit"]) if "limit" in numbers else None, parameters.get("orderby", "time"))
+        if window.min_lon < -180 or window.max_lon > 180 or window.min_lon > window.max_lon:
+            return None #longitudes wrapping around the antimeridian are left to the server
+
+        if "latitude" in numbers or "longitude" in numbers:
+            radius = numbers.get("maxradius", numbers.get("maxradiuskm", 20001.6)/KM_PER_DEGREE)
+            window.set_circle(numbers.get("latitude", 0), numbers.get("longitude", 0), min(radius, 180))
+        return window
+
+    def set_circle(self, lat, lon, radius):
+        '''
+        Method for making the window a circle search, the rectangle is set to the latitudes and longitudes around the circle
+        '''
+        self.circle = (lat, lon, radius)
+        self.min_lat, self.max_lat = max(lat-radius, -90), min(lat+radius, 90)
+        if self.min_lat == -90 or self.max_lat == 90: #circles over a pole reach every longitude
+            self.min_lon, self.max_lon = -180, 180
+        else:
+            lon_radius = math.degrees(math.asin(min(math.sin(math.radians(radius))/math.cos(math.radians(lat)), 1)))
+            if lon-lon_radius < -180 or lon+lon_radius > 180 or radius >= 90:
+                self.min_lon, self.max_lon = -180, 180
+            else:
+                self.min_lon, self.max_lon = float(lon-lon_radius), float(lon+lon_radius)
+
+    def with_times(self, start, end):
+        '''
+        Method for copying the window with a different time range
+        '''
+        window = copy.copy(self)
+        window.start, window.end = start, end
+        return window
+
+    def contains(self, other):
+        '''
+        Method for checking whether every event that matches the other window (ignoring time and limit) also matches this one
+        '''
+        if not (self.min_depth <= other.min_depth and other.max_depth <= self.max_depth):
+            return False
+        if self.min_mag is not None and (other.min_mag is None or other.min_mag < self.min_mag):
+            return False
+        if self.max_mag is not None and (other.max_mag is None or other.max_mag > self.max_mag):
+            return False
+        if self.circle is None:
+            return self.min_lat <= other.min_lat and other.max_lat <= self.max_lat \
+                and self.min_lon <= other.min_lon and other.max_lon <= self.max_lon
+        if other.circle is None:
+            return False
+        distance = great_circle_degrees(self.circle[0], self.circle[1], other.circle[0], other.circle[1])
+        return distance+other.circle[2] <= self.circle[2]
+
+    def covers(self, other):
+        '''
+        Method for checking whether every event that matches the other window, including its time range, also matches this one
+        '''
+        return self.start <= other.start and other.end <= self.end and self.contains(other)
+
+    def matches(self, lons, lats, depths, times, magnitudes):
+        '''
+        Method for finding the events that match the window with vectorized comparisons, takes numpy arrays of the
+        event coordinates, times and magnitudes (nan where they are missing) and returns a boolean array
+        '''
+        mask = (times >= self.start) & (times <= self.end) & (depths >= self.min_depth) & (depths <= self.max_depth)
+        mask &= (lats >= self.min_lat) & (lats <= self.max_lat) & (lons >= self.min_lon) & (lons <= self.max_lon)
+        if self.min_mag is not None:
+            mask &= magnitudes >= self.min_mag
+        if self.max_mag is not None:
+            mask &= magnitudes <= self.max_mag
+        if self.circle is not None: #only the events inside the rectangle around the circle are measured
+            mask[mask] = great_circle_degrees(self.circle[0], self.circle[1], lats[mask], lons[mask]) <= self.circle[2]
+        return mask
+
+    def url(self, base_url):
+        '''
+        Method for creating the query url of the window, taking every other parameter from base_url
+        '''
+        parameters = {"starttime": format_time(from_milliseconds(self.start)), "endtime": format_time(from_milliseconds(self.end))}
+        if self.circle is None:
+            parameters.update(minlatitude=self.min_lat, maxlatitude=self.max_lat, minlongitude=self.min_lon, maxlongitude=self.max_lon,
+                latitude=None, longitude=None, maxradius=None, maxradiuskm=None)
+        return replace_parameters(base_url, **parameters)
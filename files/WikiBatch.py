@@ -0,0 +1,119 @@
+import threading
+
+import requests
+
+import HttpClient
+import Tracing
+from PlaceCache import normalize_place
+
+API_URL = "https://en.wikipedia.org/w/api.php"
+BATCH_SIZE = 20 #titles per request, the API gives at most 20 intro extracts at once
+THUMBNAIL_SIZE = 300 #pixels, the same size as the thumbnails of the info page
+
+def place_candidates(place_text):
+    '''
+    function for getting the titles tried for a place label in the order they are preferred, the place with its
+    region and then only the region (like PointInfoPage.get_wiki_text). "Place: 12km SW of Ridgecrest, CA" gives
+    ["Ridgecrest, CA", "CA"]
+    '''
+    search_data = " ".join(place_text.split()[4:])
+    return [title.strip() for title in [search_data] + search_data.split(",")[1:2] if title.strip()]
+
+class WikiBatch:
+    '''
+    Resolves the wikipedia information of many places with as few requests as the API allows, by asking for the
+    intro text, thumbnail and redirects of up to BATCH_SIZE titles in every request. The results are put into the
+    place cache, with the url of the thumbnail so only the thumbnails of the places that are shown are downloaded
+    '''
+    def __init__(self, place_cache, batch_size=BATCH_SIZE):
+        self.place_cache = place_cache
+        self.batch_size = batch_size
+        self.requests = 0
+
+    @Tracing.traced("wiki_batch_query")
+    def query(self, titles):
+        '''
+        Method for requesting the information of a batch of titles, returns a dictionary of every title to a dictionary of
+        the title of its article (after redirects), text and image_url, or to None if it has no article. Titles that
+        are lists of meanings (disambiguation pages) are given as "ambiguous", as the article they mean is not known.
+        The API can leave some of the properties out of a response and ask for them to be continued, the request is
+        made again with the continue parameters until every property has been given
+        '''
+        params = {"action": "query", "format": "json", "formatversion": 2, "titles": "|".join(titles), "redirects": 1,
+            "prop": "extracts|pageimages|pageprops", "exintro": 1, "explaintext": 1, "exlimit": "max", "piprop": "thumbnail",
+            "pithumbsize": THUMBNAIL_SIZE, "pilimit": "max", "ppprop": "disambiguation"}
+        renamed, pages = {}, {}
+        while True:
+            response = HttpClient.get(API_URL, params=params)
+            self.requests += 1
+            response.raise_for_status()
+            data = response.json()
+            #titles are normalized ("ridgecrest" to "Ridgecrest") and then redirected before they match a page
+            for item in data["query"].get("normalized", []) + data["query"].get("redirects", []):
+                renamed[item["from"]] = item["to"]
+            for page in data["query"].get("pages", []):
+                pages.setdefault(page["title"], {}).update(page) #the properties of a page can be split over the responses
+            if "continue" not in data:
+                break
+            params = dict(params, **data["continue"])
+
+        results = {}
+        for title in titles:
+            seen = {title}
+            while title in renamed and renamed[title] not in seen: #follows the chain, but not around a loop
+                title = renamed[title]
+                seen.add(title)
+            page = pages.get(title)
+            if page is None or page.get("missing") or page.get("invalid"):
+                result = None
+            elif "extract" not in page:
+                continue #the text was never given, the title is left unresolved instead of being cached as missing
+            elif not page["extract"]:
+                result = None
+            elif "disambiguation" in page.get("pageprops", {}):
+                result = "ambiguous"
+            else:
+                result = {"title": page["title"], "text": page["extract"], "image_url": page.get("thumbnail", {}).get("source")}
+            for original in seen:
+                results[original] = result
+        return results
+
+    def resolve(self, place_texts, stopped=None, interval=0):
+        '''
+        Method for resolving the places of many place labels and caching them, places already cached are skipped.
+        Waits interval seconds after every request (stopping early if stopped is set) and returns the number of
+        places cached. Places whose best title is a list of meanings, or whose request failed, are not cached so
+        they are looked up one at a time when they are clicked
+        '''
+        stopped = stopped if stopped is not None else threading.Event()
+        places = {}
+        for place_text in place_texts:
+            place = normalize_place(place_text)
+            if place is not None and place not in places and self.place_cache.get(place) is None:
+                places[place] = place_candidates(place_text)
+        titles = list(dict.fromkeys(title for candidates in places.values() for title in candidates))
+
+        results = {}
+        for start in range(0, len(titles), self.batch_size):
+            requests_made = self.requests
+            try:
+                results.update(self.query(titles[start:start+self.batch_size]))
+            except (requests.exceptions.RequestException, KeyError, ValueError) as error:
+                Tracing.note("wiki_batch", "Resolving places failed: {}".format(error)) #the titles of the batch are left unresolved
+            if stopped.wait(interval*(self.requests-requests_made)): #continued queries make more than one request
+                break
+
+        cached = 0
+        for place, candidates in places.items():
+            for title in candidates:
+                if title not in results or results[title] == "ambiguous":
+                    break #unresolved, or only the single lookup knows which meaning to follow
+                info = results[title]
+                if info is not None:
+                    self.place_cache.set(place, info["title"], info["text"], image_url=info["image_url"])
+                    cached += 1
+                    break
+            else:
+                self.place_cache.set(place, None, False) #none of the titles have an article
+                cached += 1
+        return cached
@@ -0,0 +1,87 @@
+import re
+from html.parser import HTMLParser
+
+CITATION_PATTERN = re.compile(r"\[\d+\]") #appendix links in the text of articles, e.g [3]
+#tags that close a paragraph that is still open when they start, like an html parser does
+BLOCK_TAGS = {"address", "article", "aside", "blockquote", "div", "dl", "fieldset", "figure", "footer", "form", "h1", "h2",
+    "h3", "h4", "h5", "h6", "header", "hr", "menu", "nav", "ol", "p", "pre", "section", "table", "ul"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+class ArticleParser(HTMLParser):
+    '''
+    Reads the html of a parsed wikipedia section in one pass, keeping only the text of its paragraphs and links
+    instead of building the whole tree of the document. Every paragraph is kept as its text and whether it has a
+    newline directly inside it (those are left out of the text of the article, like the original BeautifulSoup code did)
+    '''
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs = []
+        self.links = []
+        self.paragraph = None #the parts of the text of the paragraph being read
+        self.newline = False
+        self.depth = 0 #tags open inside the paragraph being read
+        self.link = None #the parts of the text of the link being read
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.end_paragraph() #a paragraph can not hold blocks, so it is closed
+        if tag == "p":
+            self.paragraph, self.newline, self.depth = [], False, 0
+        elif tag == "a":
+            self.end_link()
+            self.link = []
+        if self.paragraph is not None and tag not in VOID_TAGS and tag != "p":
+            self.depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        pass #self closing tags have no text
+
+    def handle_endtag(self, tag):
+        if tag == "p":
+            self.end_paragraph()
+            return
+        if tag == "a":
+            self.end_link()
+        if self.paragraph is not None and tag not in VOID_TAGS and self.depth:
+            self.depth -= 1
+
+    def handle_data(self, data):
+        if self.paragraph is not None:
+            self.paragraph.append(data)
+            if data == "\n" and self.depth == 0:
+                self.newline = True
+        if self.link is not None:
+            self.link.append(data)
+
+    def end_paragraph(self):
+        if self.paragraph is not None:
+            self.paragraphs.append(("".join(self.paragraph), self.newline))
+            self.paragraph = None
+
+    def end_link(self):
+        if self.link is not None:
+            self.links.append("".join(self.link))
+            self.link = None
+
+    def close(self):
+        super().close()
+        self.end_paragraph()
+        self.end_link()
+
+    def first_paragraph(self):
+        return self.paragraphs[0][0] if self.paragraphs else ""
+
+    def text(self):
+        '''
+        Method for getting the text of the article, the paragraphs joined without their citation markers
+        '''
+        return CITATION_PATTERN.sub("", "".join(text for text, newline in self.paragraphs if not newline))
+
+def parse_article(html):
+    '''
+    function for reading the html of a parsed wikipedia section into an ArticleParser
+    '''
+    parser = ArticleParser()
+    parser.feed(html)
+    parser.close()
+    return parser
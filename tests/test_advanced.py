@@ -1,7 +1,19 @@
 
+import io
 import os
+import re
 import sys
 import json
+import tempfile
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from matplotlib.colors import to_rgb
+from PIL import Image
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../files")))
 
@@ -9,6 +21,25 @@ import PointInfoPage
 import SettingsPage
 import MapPage
 import GisMain
+import PointLayer
+import MapBackground
+import SpatialIndex
+import ClusterLayer
+import BatchRender
+import EventStore
+import UsgsQuery
+import DiskCache
+import EventCatalog
+import FetchPlanner
+import LiveSync
+import FetchWorker
+import HttpClient
+import PlaceCache
+import PlacePrefetcher
+import WikiBatch
+import WikiExtract
+import Tracing
+from TKCustomClasses import format_timings
 
 import unittest
 import unittest.mock as mock
@@ -44,54 +75,30 @@ class MockResponse:
         self.json_data = json_data
         self.status_code = status_code
         self.ok = ok
+        self.content = json.dumps(json_data).encode("utf-8") #the raw bytes of the response
     
     def json(self):
         return self.json_data
 
-class MockTextNode:
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(response=self)
+
+def html_paragraphs(*paragraphs):
     '''
-    Imitates BS4 text nodes from parsed data, works for <a> and <p> html tags only
+    builds the html of a parsed wikipedia section with the given paragraphs, some with links and appendix links
     '''
-    def __init__(self, data, index):
-        self.data = data
-        self.index = index
-
-    def getText(self):
-        '''
-        the actual getText function returns a list of html tags
-        '''
-        return self.data[self.index]
-
-    def get_text(self):
-        '''
-        the actual get_text function returns all the non-html substrings in a string
-        '''
-        return self.data
+    return '<div class="mw-parser-output"><p class="mw-empty-elt">\n</p>{}</div>'.format("".join(
+        '<p>{}<sup class="reference"><a href="#cite_note-{}">[{}]</a></sup></p>'.format(text, number, number)
+        for number, text in enumerate(paragraphs, 1)))
 
-    def __contains__(self, item):
-        return False
-        
-
-class MockBS4:
+def html_links(text, *links):
     '''
-    Imitates the BeautifulSoup class for the various functions used. it mocks the html
-    parsing process
+    builds the html of a redirect or a list of meanings, a paragraph followed by a list of links
     '''
-    def __init__(self, data, **kwargs):
-        self.data = data
-    
-    def find(self, item):
-        '''
-        method for creating a text node for the right html tag
-        '''
-        if item == "p":
-            return MockTextNode(self.data, 0)
-        elif item == "a":
-            return MockTextNode(self.data, 1)
-    
-    def find_all(self, item):
-        return self.data
-        
+    return '<div class="mw-parser-output"><p>{}</p><ul>{}</ul></div>'.format(text, "".join(
+        '<li><a href="/wiki/{}">{}</a></li>'.format(link.replace(" ", "_"), link) for link in links))
+
 WIKI_GET_COUNT = 0
 def mocked_wiki_text_url_request(*args, **kwargs):
     global WIKI_GET_COUNT
@@ -104,18 +111,16 @@ def mocked_wiki_text_url_request(*args, **kwargs):
     '''
 
     if args[0] == "Hongtu, China": #2 good responses, after one redirect
-        return ["Redirect to:", "Redirect to Hongtu, China"]
+        return html_links("Redirect to:", "Redirect to Hongtu, China")
     elif args[0] == "Redirect to Hongtu, China":
-        return (MockTextNode("P1 about Hongtu, China", None), 
-            MockTextNode("P2 about Hongtu, China", None))
+        return html_paragraphs("P1 about Hongtu, China", "P2 about Hongtu, China")
     
     elif args[0] == "Salamanca, Chile": #1 bad response, 2 good responses, with a different type of redirect 
         return False
-    elif args[0] == "Salamanca":
-        return ["commonly refers to:", "Redirect to Salamanca"]
+    elif args[0] == " Chile":
+        return html_links("Chile commonly refers to:", "Chile", "Redirect to Salamanca")
     elif args[0] == "Redirect to Salamanca":
-        return (MockTextNode("P1 about Salamanca", None), 
-            MockTextNode("P2 about salamanca", None))
+        return html_paragraphs("P1 about Salamanca", "P2 about salamanca")
 
     elif args[0] == "Ridgecrest, CA": #2 bad responses, 2 good responses, with a different type of redirect
         return False
@@ -123,14 +128,12 @@ def mocked_wiki_text_url_request(*args, **kwargs):
         return False
     elif args[0] == " CA" and WIKI_GET_COUNT == 0:
         WIKI_GET_COUNT += 1
-        return ["may refer to:", "Redirect to California"]
+        return html_links("CA may refer to:", "Redirect to California")
     elif args[0] == " CA" and WIKI_GET_COUNT == 1:
-        return (MockTextNode("P1 about California", None),
-            MockTextNode("P2 about California", None))
+        return html_paragraphs("P1 about California", "P2 about California")
 
     elif args[0] == "Esso, Russia": #1 good response no redirects
-        return (MockTextNode("P1 about Esso, Russia", None),
-            MockTextNode("P2 about Esso, Russia", None))
+        return html_paragraphs("P1 about Esso, Russia", "P2 about Esso, Russia")
     
     elif args[0] == "London, England": #3 bad responses, no successful response
         return False
@@ -262,11 +265,14 @@ class TestPointInfoPage(unittest.TestCase):
     '''
 
     def setUp(self):
-        self.PI_page = PointInfoPage.PointInfoPage(None, mock.Mock())
-        self.imgpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))+r"\current_image.png"
+        self.cache_directory = tempfile.TemporaryDirectory() #every test starts with an empty place cache
+        with mock.patch("PointInfoPage.PLACE_CACHE_FILE", os.path.join(self.cache_directory.name, "places.sqlite")):
+            self.PI_page = PointInfoPage.PointInfoPage(None, mock.Mock())
 
     def tearDown(self):
-        pass
+        self.PI_page.wiki_executor.shutdown()
+        self.PI_page.place_cache.close()
+        self.cache_directory.cleanup()
 
     def test_configure_labels(self):
         #checks if the labels will have the correct strings configured
@@ -300,25 +306,109 @@ class TestPointInfoPage(unittest.TestCase):
             self.assertEqual(string, label)
 
     def test_configure_scrolledtext(self):
-        with mock.patch("PointInfoPage.PointInfoPage.get_wiki_text", side_effect=mocked_get_wiki_text) as mocked_get:
-            #check whether text was found and the scrolled text widget configured properly
-            real_call = self.PI_page.configure_scrolledtext()
-            text_value = self.PI_page.wiki_scrolledtext.component("text").get("1.0", "end")
-            self.assertEqual(text_value, "wiki info about topic\n", "Should be equal to 'wiki info about topic' string")
+        #check whether text was found and the scrolled text widget configured properly
+        real_call = self.PI_page.configure_scrolledtext(mocked_get_wiki_text())
+        text_value = self.PI_page.wiki_scrolledtext.component("text").get("1.0", "end")
+        self.assertEqual(text_value, "wiki info about topic\n", "Should be equal to 'wiki info about topic' string")
 
-            #check whether text was not found and the scrolled text widget configured properly
-            real_call = self.PI_page.configure_scrolledtext()
-            text_value = self.PI_page.wiki_scrolledtext.component("text").get("1.0", "end")
-            self.assertEqual(text_value, "No Information Found\n", "Should be equal to 'No Information Found' string")
+        #check whether text was not found and the scrolled text widget configured properly
+        real_call = self.PI_page.configure_scrolledtext(mocked_get_wiki_text())
+        text_value = self.PI_page.wiki_scrolledtext.component("text").get("1.0", "end")
+        self.assertEqual(text_value, "No Information Found\n", "Should be equal to 'No Information Found' string")
 
     def test_configure_event_photo(self):
-        with mock.patch("PointInfoPage.PointInfoPage.get_wiki_image", side_effect=lambda: False) as mocked_get:
-            #check whether image holder widget was configured properly
-            real_call = self.PI_page.configure_event_photo()
-            self.assertEqual(self.PI_page.wiki_photo_label.image, self.PI_page.wiki_photo)
+        #check whether image holder widget was configured properly
+        real_call = self.PI_page.configure_event_photo(None)
+        self.assertEqual(self.PI_page.wiki_photo_label.image, self.PI_page.default_photo)
+
+    def test_get_photo(self):
+        #check that images are decoded and shrunk once, and only the most recently shown are kept
+        image_file = io.BytesIO()
+        Image.new("RGB", (600, 400), "red").save(image_file, "PNG")
+        image = PointInfoPage.decode_thumbnail(image_file.getvalue())
+        self.assertEqual(image.size, (300, 200))
+        self.assertIsNone(PointInfoPage.decode_thumbnail(b"not an image"))
+
+        photo = self.PI_page.get_photo("Esso, Russia", image)
+        self.assertIs(self.PI_page.get_photo("Esso, Russia", None), photo)
+        self.assertIsNone(self.PI_page.get_photo("Fiji", None))
+        with mock.patch("PointInfoPage.PHOTO_CACHE_SIZE", 2):
+            self.PI_page.get_photo("China", image)
+            self.PI_page.get_photo("Esso, Russia", None) #shown again, so China is the least recently shown
+            self.PI_page.get_photo("Chile", image)
+        self.assertEqual(list(self.PI_page.photos), ["Esso, Russia", "Chile"])
+
+        #the image of a title that is already kept is not decoded again
+        with mock.patch("PointInfoPage.PointInfoPage.lookup_place_info", return_value=("text", "Chile", b"not decoded")), \
+                mock.patch("PointInfoPage.decode_thumbnail") as mocked_decode:
+            self.assertEqual(self.PI_page.fetch_place_info("Place: 5km N of Santiago, Chile"), ("text", "Chile", None))
+            mocked_decode.assert_not_called()
+
+    def test_request_place_info(self):
+        #check that the place is fetched on the wiki lane of the fetch worker and shown once it is done
+        self.PI_page.place_label.configure(text="Place: 95km NNW of Hongtu, China")
+        self.PI_page.request_place_info()
+        lane, function, place_text = self.PI_page.controller.fetch_worker.submit.call_args[0]
+        self.assertEqual((lane, place_text), ("wiki", "Place: 95km NNW of Hongtu, China"))
+
+        with mock.patch("PointInfoPage.PointInfoPage.get_wiki_text", return_value="wiki info about topic"), \
+                mock.patch("PointInfoPage.PointInfoPage.get_wiki_image", return_value=False):
+            self.PI_page.wiki_image_data = "China"
+            result = function(place_text)
+        self.assertEqual(result, ("wiki info about topic", "China", None))
+        self.PI_page.controller.fetch_worker.submit.call_args[1]["on_done"](result)
+        text_value = self.PI_page.wiki_scrolledtext.component("text").get("1.0", "end")
+        self.assertEqual(text_value, "wiki info about topic\n")
+
+    def test_fetch_place_info_cached(self):
+        #check that a place is only looked up once, and that failed lookups are not cached
+        def get_wiki_text(place_text, on_title=None):
+            self.PI_page.wiki_image_data = "Ridgecrest, California"
+            return "wiki info about topic"
+        with mock.patch("PointInfoPage.PointInfoPage.get_wiki_text", side_effect=get_wiki_text) as mocked_text, \
+                mock.patch("PointInfoPage.PointInfoPage.get_wiki_image", return_value=False) as mocked_image:
+            self.assertEqual(self.PI_page.fetch_place_info("Place: 54km NNW of Ridgecrest, CA"), ("wiki info about topic", "Ridgecrest, California", None))
+            self.assertEqual(self.PI_page.fetch_place_info("Place: 2km S of Ridgecrest, CA"), ("wiki info about topic", "Ridgecrest, California", None))
+            mocked_text.assert_called_once()
+            mocked_image.assert_called_once()
+
+        with mock.patch("HttpClient.get", side_effect=requests.exceptions.ConnectionError) as mocked_get:
+            self.assertEqual(self.PI_page.fetch_place_info("Place: 5km E of Esso, Russia"), (False, None, None))
+            self.assertIsNone(self.PI_page.place_cache.get("esso, russia"))
+
+    def test_prefetch_place_info(self):
+        #check that only the images of places resolved by the wiki batch are prefetched, without touching the image shown
+        with mock.patch("PointInfoPage.PointInfoPage.get_wiki_text") as mocked_text, \
+                mock.patch("PointInfoPage.PointInfoPage.download_image_bytes") as mocked_download:
+            self.assertEqual(self.PI_page.prefetch_place_info("Place: 40km E of Esso, Russia"), 0)
+            self.assertEqual(self.PI_page.prefetch_place_info("Place: Fiji region"), 0)
+            self.PI_page.place_cache.set("esso, russia", "Esso, Russia", "wiki info about Esso")
+            self.assertEqual(self.PI_page.prefetch_place_info("Place: 2km S of Esso, Russia"), 0) #the article has no image
+            mocked_text.assert_not_called()
+            mocked_download.assert_not_called()
+        self.assertIsNone(self.PI_page.wiki_image_bytes)
+
+    def test_fetch_place_info_image_url(self):
+        #check that the image of a place resolved by the wiki batch is downloaded once it is needed, and then cached
+        self.PI_page.place_cache.set("esso, russia", "Esso, Russia", "Esso is a village", image_url="https://upload.wikimedia.org/esso.jpg")
+        with mock.patch("PointInfoPage.PointInfoPage.download_image_bytes", return_value=b"\x89PNG image") as mocked_download:
+            with mock.patch.object(self.PI_page, "wiki_lock") as mocked_lock:
+                self.assertEqual(self.PI_page.prefetch_place_info("Place: 40km E of Esso, Russia"), 1)
+                self.assertEqual(self.PI_page.prefetch_place_info("Place: 40km E of Esso, Russia"), 0)
+                mocked_lock.__enter__.assert_not_called() #clicks are not kept waiting by the prefetch
+            mocked_download.assert_called_once_with("https://upload.wikimedia.org/esso.jpg")
+        self.assertEqual(self.PI_page.place_cache.get("esso, russia")["image"], b"\x89PNG image")
+        self.assertIsNone(self.PI_page.wiki_image_bytes)
+
+        #a place clicked before it was prefetched downloads its image with the lookup
+        self.PI_page.place_cache.set("ridgecrest, ca", "Ridgecrest, California", "Ridgecrest is a city", image_url="https://upload.wikimedia.org/ridgecrest.jpg")
+        with mock.patch("PointInfoPage.PointInfoPage.download_image_bytes", return_value=b"\x89PNG ridgecrest") as mocked_download:
+            self.assertEqual(self.PI_page.lookup_place_info("Place: 3km N of Ridgecrest, CA"),
+                ("Ridgecrest is a city", "Ridgecrest, California", b"\x89PNG ridgecrest"))
+            mocked_download.assert_called_once_with("https://upload.wikimedia.org/ridgecrest.jpg")
 
     def test_wiki_image_url_request(self):
-        with mock.patch("PointInfoPage.requests.get", side_effect=mocked_wiki_request_get) as mocked_get:
+        with mock.patch("HttpClient.get", side_effect=mocked_wiki_request_get) as mocked_get:
             #check a valid request and valid response - with image
             self.PI_page.wiki_image_data = "Thailand"
             real_call = self.PI_page.wiki_image_url_request()
@@ -349,8 +439,8 @@ class TestPointInfoPage(unittest.TestCase):
             self.assertFalse(real_call)
     
     @mock.patch("PointInfoPage.PointInfoPage.wiki_image_url_request", side_effect=mocked_get_image_url)
-    @mock.patch("PointInfoPage.requests.get", side_effect=mocked_wiki_request_get_2)
-    @mock.patch("PointInfoPage.shutil.copyfileobj", side_effect=mock.MagicMock())
+    @mock.patch("HttpClient.get", side_effect=mocked_wiki_request_get_2)
+    @mock.patch("HttpClient.save_stream", side_effect=mock.MagicMock())
     def test_get_wiki_image(self, mocked_img_url, mocked_get, mocked_shutil):
         #check that no image was received from the wiki_image_url_request() method
         real_call = self.PI_page.get_wiki_image()
@@ -369,7 +459,7 @@ class TestPointInfoPage(unittest.TestCase):
         self.assertFalse(real_call)
     
     def test_wiki_text_url_request(self):
-        with mock.patch("PointInfoPage.requests.get", side_effect=mocked_wiki_request_get_3) as mocked_get:
+        with mock.patch("HttpClient.get", side_effect=mocked_wiki_request_get_3) as mocked_get:
             #check a valid request and a valid response
             real_call = self.PI_page.wiki_text_url_request("Nothing")
             self.assertTrue(bool(real_call))
@@ -388,8 +478,7 @@ class TestPointInfoPage(unittest.TestCase):
             self.assertFalse(real_call)
 
     @mock.patch("PointInfoPage.PointInfoPage.wiki_text_url_request", side_effect=mocked_wiki_text_url_request)
-    @mock.patch("PointInfoPage.BS4", side_effect=MockBS4) 
-    def test_get_wiki_text(self, mocked_BS4_class, mocked_request):
+    def test_get_wiki_text(self, mocked_request):
         #Check if place does not contain any digits
         self.PI_page.place_label.configure(text="No Digits")
         real_call = self.PI_page.get_wiki_text()
@@ -426,6 +515,25 @@ class TestPointInfoPage(unittest.TestCase):
         self.assertFalse(self.PI_page.wiki_image_data)
         self.assertFalse(real_call)
 
+    def test_get_wiki_text_concurrent(self):
+        #check that the candidate titles are requested at the same time, and that the title is given as soon as it is known
+        def slow_request(title):
+            time.sleep(0.3)
+            if title == " Peru":
+                return html_links("Redirect to:", "Redirect to Peru")
+            elif title == "Redirect to Peru":
+                return html_paragraphs("P1 about Peru", "P2 about Peru")
+            return False
+        titles = []
+        with mock.patch("PointInfoPage.PointInfoPage.wiki_text_url_request", side_effect=slow_request) as mocked_request:
+            start = time.perf_counter()
+            real_call = self.PI_page.get_wiki_text("Place: 12km S of Lima, Peru", on_title=titles.append)
+            seconds = time.perf_counter()-start
+        self.assertEqual(real_call, "P1 about PeruP2 about Peru")
+        self.assertEqual(titles, ["Redirect to Peru"])
+        self.assertEqual(mocked_request.call_count, 3)
+        self.assertLess(seconds, 0.85) #two round trips instead of three
+
 class TestMapPage(unittest.TestCase):
     '''
     This tests the various methods and functionalities of the MapPage class
@@ -435,7 +543,6 @@ class TestMapPage(unittest.TestCase):
 
     def setUp(self):
         self.map_page = MapPage.MapPage(None, mock.Mock())
-        self.jsonpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))+r"\current_data.json"
 
     def tearDown(self):
         pass
@@ -449,12 +556,12 @@ class TestMapPage(unittest.TestCase):
 
         #Checks whether there is different data to be plotted, if yes, then it plots it
         self.map_page.local_url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&limit=5"
-        with open(self.jsonpath, "w") as out_file:
-            json.dump({"type":"FeatureCollection","metadata":{"generated":1565616904000,"url":"https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&limit=5","title":"USGS Earthquakes","status":200,"api":"1.8.1","limit":5,"offset":1,"count":5},"features":[{"type":"Feature","properties":{"mag":0.56000000000000005,"place":"7km WNW of The Geysers, CA","time":1565616767480,"updated":1565616862340,"tz":-480,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/nc73248286","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=nc73248286&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":5,"net":"nc","code":"73248286","ids":",nc73248286,","sources":",nc,","types":",geoserve,nearby-cities,origin,phase-data,","nst":8,"dmin":0.0016639999999999999,"rms":0.040000000000000001,"gap":93,"magType":"md","type":"earthquake","title":"M 0.6 - 7km WNW of The Geysers, CA"},"geometry":{"type":"Point","coordinates":[-122.8281631,38.810333300000003,2.0299999999999998]},"id":"nc73248286"},
+        #the data is handed over by the controller in memory
+        self.map_page.controller.current_data = {"type":"FeatureCollection","metadata":{"generated":1565616904000,"url":"https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&limit=5","title":"USGS Earthquakes","status":200,"api":"1.8.1","limit":5,"offset":1,"count":5},"features":[{"type":"Feature","properties":{"mag":0.56000000000000005,"place":"7km WNW of The Geysers, CA","time":1565616767480,"updated":1565616862340,"tz":-480,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/nc73248286","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=nc73248286&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":5,"net":"nc","code":"73248286","ids":",nc73248286,","sources":",nc,","types":",geoserve,nearby-cities,origin,phase-data,","nst":8,"dmin":0.0016639999999999999,"rms":0.040000000000000001,"gap":93,"magType":"md","type":"earthquake","title":"M 0.6 - 7km WNW of The Geysers, CA"},"geometry":{"type":"Point","coordinates":[-122.8281631,38.810333300000003,2.0299999999999998]},"id":"nc73248286"},
             {"type":"Feature","properties":{"mag":0.90000000000000002,"place":"7km NW of San Jacinto, CA","time":1565616601960,"updated":1565616828359,"tz":-480,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/ci38959312","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=ci38959312&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":12,"net":"ci","code":"38959312","ids":",ci38959312,","sources":",ci,","types":",geoserve,nearby-cities,origin,phase-data,scitech-link,","nst":13,"dmin":0.090730000000000005,"rms":0.23000000000000001,"gap":102,"magType":"ml","type":"earthquake","title":"M 0.9 - 7km NW of San Jacinto, CA"},"geometry":{"type":"Point","coordinates":[-117.00633329999999,33.832999999999998,23.300000000000001]},"id":"ci38959312"},
             {"type":"Feature","properties":{"mag":1.24,"place":"22km ESE of Little Lake, CA","time":1565616447250,"updated":1565616672288,"tz":-480,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/ci38959304","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=ci38959304&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":24,"net":"ci","code":"38959304","ids":",ci38959304,","sources":",ci,","types":",geoserve,nearby-cities,origin,phase-data,scitech-link,","nst":25,"dmin":0.085470000000000004,"rms":0.12,"gap":81,"magType":"ml","type":"earthquake","title":"M 1.2 - 22km ESE of Little Lake, CA"},"geometry":{"type":"Point","coordinates":[-117.684,35.8645,8.2400000000000002]},"id":"ci38959304"},
             {"type":"Feature","properties":{"mag":1.5800000000000001,"place":"16km SSW of Searles Valley, CA","time":1565615959780,"updated":1565616624630,"tz":-480,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/ci38959280","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=ci38959280&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":38,"net":"ci","code":"38959280","ids":",ci38959280,","sources":",ci,","types":",focal-mechanism,geoserve,nearby-cities,origin,phase-data,scitech-link,","nst":24,"dmin":0.039570000000000001,"rms":0.20999999999999999,"gap":55,"magType":"ml","type":"earthquake","title":"M 1.6 - 16km SSW of Searles Valley, CA"},"geometry":{"type":"Point","coordinates":[-117.47033329999999,35.634833299999997,2.4700000000000002]},"id":"ci38959280"},
-            {"type":"Feature","properties":{"mag":0.56999999999999995,"place":"22km ESE of Little Lake, CA","time":1565615877760,"updated":1565616104491,"tz":-480,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/ci38959272","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=ci38959272&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":5,"net":"ci","code":"38959272","ids":",ci38959272,","sources":",ci,","types":",geoserve,nearby-cities,origin,phase-data,scitech-link,","nst":13,"dmin":0.080879999999999994,"rms":0.089999999999999997,"gap":86,"magType":"ml","type":"earthquake","title":"M 0.6 - 22km ESE of Little Lake, CA"},"geometry":{"type":"Point","coordinates":[-117.6773333,35.864166699999998,7.29]},"id":"ci38959272"}],"bbox":[-122.8281631,33.833,2.03,-117.0063333,38.8103333,23.3]}, out_file)
+            {"type":"Feature","properties":{"mag":0.56999999999999995,"place":"22km ESE of Little Lake, CA","time":1565615877760,"updated":1565616104491,"tz":-480,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/ci38959272","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=ci38959272&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":5,"net":"ci","code":"38959272","ids":",ci38959272,","sources":",ci,","types":",geoserve,nearby-cities,origin,phase-data,scitech-link,","nst":13,"dmin":0.080879999999999994,"rms":0.089999999999999997,"gap":86,"magType":"ml","type":"earthquake","title":"M 0.6 - 22km ESE of Little Lake, CA"},"geometry":{"type":"Point","coordinates":[-117.6773333,35.864166699999998,7.29]},"id":"ci38959272"}],"bbox":[-122.8281631,33.833,2.03,-117.0063333,38.8103333,23.3]}
         real_call = self.map_page.refresh_plot(None)
         self.assertIsNone(real_call, "Should be a return of None")
 
@@ -471,8 +578,976 @@ class TestMapPage(unittest.TestCase):
         #checks whether all new points have been successfully plotted
         real_call = self.map_page.plot_points(json_data)
         self.assertTrue(self.map_page.map_figure.get_axes())
-        self.assertTrue(self.map_page.map_axes.lines)
-        self.assertEqual(len(self.map_page.map_axes.lines), 5)
+        self.assertIn(self.map_page.point_layer.collection, self.map_page.map_axes.collections)
+        self.assertEqual(len(self.map_page.point_layer.collection.get_offsets()), 5)
+
+        #checks that a picked point still carries the properties of its earthquake
+        point_obj = self.map_page.point_layer.get_point(2)
+        self.assertEqual(point_obj.place, json_data["features"][2]["properties"]["place"])
+        self.assertEqual(point_obj.magnitude, json_data["features"][2]["properties"]["mag"])
+
+    def test_plot_points_diff(self):
+        #checks that plotting a changed set of earthquakes only adds, removes and updates the events that changed
+        json_data = {"features": [{"type": "Feature", "id": event_id,
+            "properties": {"mag": 1.5, "updated": 1565616828359, "title": event_id},
+            "geometry": {"type": "Point", "coordinates": [-116.5, 33.5, 10]}} for event_id in ("ci1", "ci2", "ci3")]}
+        self.assertEqual(self.map_page.plot_points(json_data), (3, 0, 0))
+        self.assertEqual(self.map_page.plot_points(json_data), (0, 0, 0))
+
+        json_data["features"][1] = dict(json_data["features"][1], properties={"mag": 4.5, "updated": 1565616900000, "title": "ci2"})
+        json_data["features"][2] = dict(json_data["features"][2], id="ci4")
+        self.assertEqual(self.map_page.plot_points(json_data), (1, 1, 1))
+        self.assertEqual(sorted(self.map_page.point_layer.ids), ["ci1", "ci2", "ci4"])
+        self.assertEqual(self.map_page.point_layer.magnitudes[self.map_page.point_layer.rows["ci2"]], 4.5)
+
+    def test_background_detail(self):
+        #checks that the static layers are drawn as vectors once zoomed in past the background image, and the image is shown again when zoomed out
+        (x_min, x_max), (y_min, y_max) = self.map_page.map_axes.get_xlim(), self.map_page.map_axes.get_ylim()
+        self.assertTrue(self.map_page.background_image.get_visible())
+        self.assertIsNone(self.map_page.vector_layers)
+
+        self.map_page.map_axes.set_xlim(x_min, x_min+(x_max-x_min)/20)
+        self.map_page.map_axes.set_ylim(y_min, y_min+(y_max-y_min)/20)
+        self.assertFalse(self.map_page.background_image.get_visible())
+        self.assertTrue(self.map_page.vector_layers)
+        self.assertTrue(all(artist.get_visible() for artist in self.map_page.vector_layers))
+        self.assertAlmostEqual(self.map_page.map_axes.get_xlim()[1], x_min+(x_max-x_min)/20) #the zoomed view is kept
+
+        self.map_page.map_axes.set_xlim(x_min, x_max)
+        self.map_page.map_axes.set_ylim(y_min, y_max)
+        self.assertTrue(self.map_page.background_image.get_visible())
+        self.assertFalse(any(artist.get_visible() for artist in self.map_page.vector_layers))
+
+    def test_plot_changes(self):
+        #checks that the changes of a live sync are plotted without building the store of the whole feed again
+        features = [{"type": "Feature", "id": event_id, "properties": {"mag": 1.5, "updated": 1, "title": event_id},
+            "geometry": {"type": "Point", "coordinates": [-116.5, 33.5, 10]}} for event_id in ("ci1", "ci2", "ci3")]
+        self.map_page.plot_points({"features": features})
+        changed = [dict(features[1], properties={"mag": 4.5, "updated": 2, "title": "ci2"}), dict(features[2], id="ci4")]
+        with mock.patch("MapPage.EventStore") as mocked_store:
+            self.assertEqual(self.map_page.plot_changes(changed, ["ci3"]), (1, 1, 1))
+            mocked_store.assert_not_called()
+        point_layer = self.map_page.point_layer
+        self.assertEqual(sorted(point_layer.ids), ["ci1", "ci2", "ci4"])
+        self.assertEqual(point_layer.magnitudes[point_layer.rows["ci2"]], 4.5)
+        self.assertEqual(point_layer.get_point(point_layer.rows["ci2"]).magnitude, 4.5)
+        self.assertEqual(len(point_layer.collection.get_offsets()), 3)
+        self.assertEqual(self.map_page.plot_changes([], ["ci9"]), (0, 0, 0))
+
+        #the store is compacted once most of its rows are no longer plotted
+        with mock.patch("PointLayer.COMPACT_ROWS", 0):
+            self.map_page.plot_changes([dict(features[0], properties={"mag": 2.5, "updated": 2, "title": "ci1"}),
+                dict(features[2], id="ci4", properties={"mag": 3.5, "updated": 2, "title": "ci4"})], [])
+        self.assertEqual(len(point_layer.store), 3)
+        self.assertEqual(point_layer.get_point(point_layer.rows["ci1"]).magnitude, 2.5)
+
+    def test_plot_changes_index(self):
+        #checks that a small live change does not build the spatial index again, and the changed earthquakes can still be clicked
+        features = [{"type": "Feature", "id": "ci{}".format(number), "properties": {"mag": 1.5, "updated": 1, "title": "ci{}".format(number)},
+            "geometry": {"type": "Point", "coordinates": [-120+number, 33.5, 10]}} for number in range(5)]
+        self.map_page.plot_points({"features": features})
+        point_layer = self.map_page.point_layer
+        moved = dict(features[1], properties={"mag": 1.5, "updated": 2, "title": "ci1"},
+            geometry={"type": "Point", "coordinates": [-110, 40, 10]})
+        added = dict(features[0], id="ci9", properties={"mag": 1.5, "updated": 1, "title": "ci9"},
+            geometry={"type": "Point", "coordinates": [-105, 35, 10]})
+        with mock.patch("PointLayer.KDTree") as mocked_tree:
+            self.assertEqual(self.map_page.plot_changes([moved, added], ["ci0"]), (1, 1, 1))
+            mocked_tree.assert_not_called()
+        self.assertEqual(sorted(point_layer.unindexed_rows()), sorted([point_layer.rows["ci1"], point_layer.rows["ci9"],
+            point_layer.rows["ci4"]])) #ci4 was moved into the row of ci0
+        for event_id in ("ci1", "ci9", "ci4", "ci2"):
+            row = point_layer.rows[event_id]
+            self.assertEqual(point_layer.find_point(point_layer.xs[row], point_layer.ys[row], 1), row)
+            self.assertEqual(point_layer.get_point(row).title, event_id)
+
+        #the index is built again once too many rows are missing from it
+        with mock.patch("PointLayer.REINDEX_ROWS", 2):
+            self.map_page.plot_changes([dict(features[2], properties={"mag": 2.5, "updated": 2, "title": "ci2"})], [])
+        self.assertEqual(len(point_layer.unindexed_rows()), 0)
+
+    def test_find_point(self):
+        #checks that a click inside a large marker finds it, even when a small marker that does not reach the click is closer
+        features = [{"type": "Feature", "id": event_id, "properties": {"mag": magnitude, "updated": 1, "title": event_id},
+            "geometry": {"type": "Point", "coordinates": [longitude, 33.5, 10]}}
+            for event_id, magnitude, longitude in (("ci1", 7.0, -116.5), ("ci2", 0.5, -116.0))]
+        self.map_page.plot_points({"features": features})
+        point_layer = self.map_page.point_layer
+        large, small = point_layer.rows["ci1"], point_layer.rows["ci2"]
+        self.assertEqual(point_layer.markersizes[large], 16)
+
+        #the small marker is 22 points to the right of the large one and the click is 15 points to the right of the large one
+        data_per_point = (point_layer.xs[small]-point_layer.xs[large])/22
+        x, y = point_layer.xs[large]+15*data_per_point, point_layer.ys[large]
+        self.assertEqual(point_layer.find_point(x, y, data_per_point), large)
+        self.assertEqual(point_layer.find_point(point_layer.xs[small]-2*data_per_point, y, data_per_point), small)
+        self.assertIsNone(point_layer.find_point(point_layer.xs[small]+6*data_per_point, y, data_per_point))
+
+    def test_point_styles(self):
+        #checks the point sizes (radius in points, halved with every second magnitude) and colours of the legend
+        magnitudes = [0.57, 2.5, 4.2, 6.8, None]
+        markersizes, colors = PointLayer.calculate_point_styles(magnitudes)
+        for magnitude, markersize, color, name in zip(magnitudes, markersizes, colors, ("green", "green", "yellow", "red", "green")):
+            magnitude = magnitude or 0
+            self.assertAlmostEqual(markersize, 2**magnitude/2**(magnitude//2))
+            self.assertEqual(tuple(color[:3]), to_rgb(name))
+
+class TestMapBackground(unittest.TestCase):
+    '''
+    This tests that rendered backgrounds are cached under a key of everything that changes their look
+    '''
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.background = np.zeros((4, 8, 4), dtype=np.uint8)
+        self.background[1, 2] = (210, 180, 140, 255)
+
+    def tearDown(self):
+        MapBackground._backgrounds.clear()
+        self.cache_directory.cleanup()
+
+    def test_cache_key(self):
+        key = MapBackground.cache_key(MapBackground.MAP_OPTIONS, (12, 4), 150)
+        self.assertRegex(key, r"^[0-9a-f]{16}$")
+        self.assertEqual(key, MapBackground.cache_key(dict(MapBackground.MAP_OPTIONS), (12.0, 4.0), 150))
+        self.assertNotEqual(key, MapBackground.cache_key(MapBackground.MAP_OPTIONS, (12, 5), 150))
+        self.assertNotEqual(key, MapBackground.cache_key(MapBackground.MAP_OPTIONS, (12, 4), 100))
+        self.assertNotEqual(key, MapBackground.cache_key(dict(MapBackground.MAP_OPTIONS, resolution="l"), (12, 4), 150))
+        with mock.patch("MapBackground.STYLE_VERSION", MapBackground.STYLE_VERSION+1):
+            self.assertNotEqual(key, MapBackground.cache_key(MapBackground.MAP_OPTIONS, (12, 4), 150))
+
+    def test_load_background(self):
+        #a background is rendered once, written to the disk and read back from it by a new process
+        with mock.patch("MapBackground.CACHE_DIRECTORY", self.cache_directory.name), \
+                mock.patch("MapBackground.render_background", return_value=self.background) as mocked_render:
+            first = MapBackground.load_background(None, MapBackground.MAP_OPTIONS, (12, 4))
+            self.assertIs(MapBackground.load_background(None, MapBackground.MAP_OPTIONS, (12, 4)), first)
+            mocked_render.assert_called_once()
+            key = MapBackground.cache_key(MapBackground.MAP_OPTIONS, (12.0, 4.0), MapBackground.BACKGROUND_DPI)
+            self.assertTrue(os.path.isfile(os.path.join(self.cache_directory.name, "background_{}.png".format(key))))
+
+            MapBackground._backgrounds.clear() #as if the program was started again
+            loaded = MapBackground.load_background(None, MapBackground.MAP_OPTIONS, (12, 4))
+            mocked_render.assert_called_once()
+        np.testing.assert_array_equal(loaded, self.background)
+
+class TestSpatialIndex(unittest.TestCase):
+    '''
+    This tests that the spatial index used for clicking and hovering over earthquakes finds
+    the same nearest point as checking every point would
+    '''
+
+    def test_nearest(self):
+        rng = np.random.RandomState(5)
+        xs, ys = rng.normal(0, 1, 5000), rng.normal(0, 1, 5000)
+        xs[:1000] = 0.5 #many points sharing one coordinate
+        tree = SpatialIndex.KDTree(xs, ys)
+
+        for x, y in rng.normal(0, 1.5, (100, 2)):
+            distances = np.hypot(xs-x, ys-y)
+            index, distance = tree.nearest(x, y, 0.2)
+            if distances.min() <= 0.2:
+                self.assertAlmostEqual(distance, distances.min())
+                self.assertEqual(distances[index], distances.min())
+            else:
+                self.assertIsNone(index)
+
+        #check an empty index
+        self.assertEqual(SpatialIndex.KDTree([], []).nearest(0, 0), (None, None))
+
+    def test_within(self):
+        rng = np.random.RandomState(6)
+        xs, ys = rng.normal(0, 1, 5000), rng.normal(0, 1, 5000)
+        tree = SpatialIndex.KDTree(xs, ys)
+
+        for x, y in rng.normal(0, 1.5, (100, 2)):
+            distances = np.hypot(xs-x, ys-y)
+            indices, found = tree.within(x, y, 0.3)
+            self.assertEqual(sorted(indices), list(np.flatnonzero(distances <= 0.3)))
+            np.testing.assert_allclose(found, distances[indices])
+
+        indices, found = SpatialIndex.KDTree([], []).within(0, 0, 1)
+        self.assertEqual((len(indices), len(found)), (0, 0))
+
+class TestClusterTree(unittest.TestCase):
+    '''
+    This tests the precomputed clusters used for the level of detail mode of the map
+    '''
+
+    def test_levels(self):
+        rng = np.random.RandomState(7)
+        xs, ys = rng.uniform(0, 1000, 2000), rng.uniform(0, 500, 2000)
+        magnitudes = rng.uniform(0, 8, 2000)
+        tree = ClusterLayer.ClusterTree(xs, ys, magnitudes, (0, 1000, 0, 500))
+
+        for level in tree.levels:
+            #every earthquake belongs to exactly one cluster of every level
+            self.assertEqual(level["counts"].sum(), 2000)
+            self.assertEqual(level["max_magnitudes"].max(), magnitudes.max())
+        #clusters split up as the levels get more detailed
+        self.assertLess(len(tree.levels[0]["counts"]), len(tree.levels[-1]["counts"]))
+
+        #check the level chosen for a view of the whole map and for a view zoomed in past the last level
+        self.assertEqual(tree.level_for_view(1000, tree.BASE_CELLS), 0)
+        self.assertIsNone(tree.level_for_view(1e-3, tree.BASE_CELLS))
+
+class TestEventStore(unittest.TestCase):
+    '''
+    This tests that the columns of the event store give back the same properties as the GeoJSON they were read from
+    '''
+
+    def test_columns(self):
+        features = [{"type": "Feature", "id": "nc1", "geometry": {"type": "Point", "coordinates": [-122.8, 38.8, 2.03]},
+            "properties": {"mag": 0.56, "place": "7km WNW of The Geysers, CA", "time": 1565616767480, "updated": 1565616862340,
+            "felt": None, "cdi": None, "mmi": None, "alert": None, "status": "automatic", "tsunami": 0, "sig": 5,
+            "dmin": 0.001664, "gap": 93, "magType": "md", "type": "earthquake", "title": "M 0.6 - 7km WNW of The Geysers, CA"}},
+            {"type": "Feature", "id": "us2", "geometry": {"type": "Point", "coordinates": [142.1, 38.3]},
+            "properties": {"mag": 7.1, "place": "7km WNW of The Geysers, CA", "time": 1565616601960, "updated": 1565616828359,
+            "felt": 1200, "alert": "orange", "status": "reviewed", "tsunami": 1, "magType": "mww"}}]
+        store = EventStore.EventStore(features)
+
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.rows, {"nc1": 0, "us2": 1})
+        self.assertEqual(list(store.magnitudes), [0.56, 7.1])
+        self.assertTrue(np.isnan(store.depths[1]), "A missing depth should be stored as nan")
+        self.assertIs(store.places[0], store.places[1], "Equal places should share one string")
+        self.assertEqual(store.codes["status"].dtype, np.int16)
+
+        first, second = store.record(0), store.record(1)
+        self.assertEqual((first.magnitude, first.sig, first.gap, first.dmin), (0.56, 5, 93, 0.001664))
+        self.assertEqual((first.status, first.magtype, first.type_, first.alert), ("automatic", "md", "earthquake", None))
+        self.assertEqual((first.felt, first.cdi, first.tsunami), (None, None, False))
+        self.assertEqual(first.title, "M 0.6 - 7km WNW of The Geysers, CA")
+        self.assertEqual((second.felt, second.alert, second.tsunami, second.title), (1200, "orange", True, None))
+        #whole numbers are given back as they were in the GeoJSON, so they are shown without a decimal point
+        self.assertEqual("{} {}".format(first.gap, first.magnitude), "93 0.56")
+        whole = EventStore.EventStore([dict(features[1], properties={"mag": 5, "gap": 82.5, "dmin": 1})]).record(0)
+        self.assertEqual("{} {} {}".format(whole.magnitude, whole.gap, whole.dmin), "5 82.5 1")
+        #the time is formatted only when it is read
+        self.assertTrue(second.time.startswith("2019-08-1"))
+
+        #check an empty store
+        self.assertEqual(len(EventStore.EventStore([]).magnitudes), 0)
+
+    def test_extend_and_take(self):
+        #check that appended features move the rows of their ids, without changing the rows already handed out
+        features = [{"type": "Feature", "id": "ci{}".format(index), "geometry": {"type": "Point", "coordinates": [-116.5, 33.5, 10]},
+            "properties": {"mag": index, "status": "automatic", "title": "ci{}".format(index)}} for index in range(3)]
+        store = EventStore.EventStore(features)
+        record = store.record(1)
+        store.extend([{"type": "Feature", "id": "ci1", "geometry": {"type": "Point", "coordinates": [-116.6, 33.6, 12]},
+            "properties": {"mag": 4.5, "status": "reviewed", "alert": "green", "title": "ci1 updated"}}])
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.rows["ci1"], 3)
+        self.assertEqual((record.magnitude, record.status), (1.0, "automatic"))
+        updated = store.record(store.rows["ci1"])
+        self.assertEqual((updated.magnitude, updated.status, updated.alert, updated.title), (4.5, "reviewed", "green", "ci1 updated"))
+
+        compact = store.take([0, 3, 2])
+        self.assertEqual(compact.rows, {"ci0": 0, "ci1": 1, "ci2": 2})
+        self.assertEqual(list(compact.magnitudes), [0, 4.5, 2])
+        self.assertEqual(compact.record(1).status, "reviewed")
+
+class TestUsgsQuery(unittest.TestCase):
+    '''
+    This tests the canonical urls used as cache keys and the time each kind of url is cached for
+    '''
+
+    def test_canonicalize_url(self):
+        first = UsgsQuery.canonicalize_url("https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson"
+            "&starttime=2019-05-05T15:55:03%2B01:00&minlatitude=-90&minmagnitude=1.50&limit=100")
+        second = UsgsQuery.canonicalize_url("https://EARTHQUAKE.usgs.gov/fdsnws/event/1/query?limit=100.0"
+            "&minmagnitude=1.5&minlatitude=-90.0&starttime=2019-05-05T14:55:03&format=geojson")
+        self.assertEqual(first, second)
+        self.assertIn("starttime=2019-05-05T14:55:03", first)
+        self.assertNotEqual(first, UsgsQuery.canonicalize_url(first.replace("limit=100", "limit=101")))
+
+    def test_cache_ttl(self):
+        now = UsgsQuery.datetime.datetime(2019, 8, 12)
+        feed_url = "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/2.5_{}.geojson"
+        self.assertEqual(UsgsQuery.cache_ttl(feed_url.format("hour"), now), UsgsQuery.FEED_TTLS["hour"])
+        self.assertLess(UsgsQuery.cache_ttl(feed_url.format("hour"), now), UsgsQuery.cache_ttl(feed_url.format("month"), now))
+
+        query_url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=2019-01-01&endtime={}"
+        self.assertEqual(UsgsQuery.cache_ttl(query_url.format("2019-02-01"), now), UsgsQuery.HISTORICAL_TTL)
+        self.assertEqual(UsgsQuery.cache_ttl(query_url.format("2019-08-11"), now), UsgsQuery.RECENT_TTL)
+
+    def test_query_window(self):
+        url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=2019-01-01&endtime=2019-01-02&mindepth=0&maxdepth=100"
+        window = UsgsQuery.QueryWindow.from_url(url)
+        self.assertEqual(UsgsQuery.from_milliseconds(window.start), UsgsQuery.datetime.datetime(2019, 1, 1))
+        self.assertEqual((window.min_lat, window.max_lon, window.min_depth, window.min_mag), (-90, 180, 0, None))
+
+        #summary feeds and parameters the catalog does not know about are left to the server
+        self.assertIsNone(UsgsQuery.QueryWindow.from_url("https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/2.5_day.geojson"))
+        self.assertIsNone(UsgsQuery.QueryWindow.from_url(url+"&eventtype=earthquake"))
+
+    def test_matches(self):
+        url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=2019-01-01&endtime=2019-01-10"
+        broad = UsgsQuery.QueryWindow.from_url(url)
+        narrow = UsgsQuery.QueryWindow.from_url(url.replace("2019-01-01", "2019-01-02")+"&minmagnitude=3&latitude=10&longitude=20&maxradius=5")
+        self.assertTrue(broad.covers(narrow))
+        self.assertFalse(narrow.covers(broad))
+        self.assertFalse(UsgsQuery.QueryWindow.from_url(url.replace("2019-01-10", "2019-01-05")).covers(narrow))
+
+        day = UsgsQuery.to_milliseconds(UsgsQuery.datetime.datetime(2019, 1, 3))
+        lons, lats = np.array([20.0, 24.0, 21.0, 20.0]), np.array([10.0, 14.0, 11.0, 10.0])
+        times, magnitudes = np.full(4, day), np.array([4.0, 4.0, 2.0, np.nan])
+        #the second event is inside the rectangle around the circle but not the circle, the others are too small
+        self.assertEqual(narrow.matches(lons, lats, np.full(4, 10.0), times, magnitudes).tolist(), [True, False, False, False])
+        self.assertEqual(broad.matches(lons, lats, np.full(4, 10.0), times, magnitudes).tolist(), [True]*4)
+
+class TestDiskCache(unittest.TestCase):
+    '''
+    This tests the expiry and least recently used eviction of the on-disk response cache
+    '''
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.cache = DiskCache.DiskCache(os.path.join(self.cache_directory.name, "cache.sqlite"), max_bytes=2500)
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache_directory.cleanup()
+
+    def test_expiry(self):
+        self.cache.set("a", b"quakes", ttl=10, now=100)
+        self.assertEqual(self.cache.get("a", now=105), b"quakes")
+        self.assertIsNone(self.cache.get("a", now=111), "Should be None once the entry has expired")
+        self.assertIsNone(self.cache.get("b", now=111))
+        self.assertEqual(self.cache.statistics()["hits"], 1)
+        self.assertEqual(self.cache.statistics()["misses"], 2)
+        self.assertEqual(self.cache.statistics()["expired"], 1)
+
+    def test_eviction(self):
+        #random bytes do not compress, so each entry takes up about 1000 bytes
+        values = [os.urandom(1000) for _ in range(3)]
+        self.cache.set("a", values[0], ttl=60, now=1)
+        self.cache.set("b", values[1], ttl=60, now=2)
+        self.cache.get("a", now=3) #'b' is now the least recently used entry
+        self.cache.set("c", values[2], ttl=60, now=4)
+
+        self.assertIsNone(self.cache.get("b", now=5))
+        self.assertEqual(self.cache.get("a", now=5), values[0])
+        self.assertEqual(self.cache.get("c", now=5), values[2])
+        self.assertEqual(self.cache.statistics()["evictions"], 1)
+
+class TestEventCatalog(unittest.TestCase):
+    '''
+    This tests that the local event catalog answers queries like the event web service and only
+    asks for the parts of a query it has not fetched before
+    '''
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.catalog = EventCatalog.EventCatalog(os.path.join(self.cache_directory.name, "catalog.sqlite"))
+        self.base_url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime={}&endtime={}&minmagnitude={}&limit=100"
+
+    def tearDown(self):
+        self.catalog.close()
+        self.cache_directory.cleanup()
+
+    def make_feature(self, event_id, day, lon, lat, mag, updated=1):
+        time = UsgsQuery.to_milliseconds(UsgsQuery.datetime.datetime(2019, 1, day, 12))
+        return {"type": "Feature", "id": event_id, "geometry": {"type": "Point", "coordinates": [lon, lat, 10]},
+            "properties": {"mag": mag, "time": time, "updated": updated}}
+
+    def test_query(self):
+        self.catalog.add_features([self.make_feature("a", 2, 20, 10, 2.5), self.make_feature("b", 3, 21, 11, 4.5),
+            self.make_feature("c", 4, -120, 35, 5.5), self.make_feature("d", 5, 22, 12, 1.5)])
+        #an event is only replaced by a more recent update
+        self.catalog.add_features([self.make_feature("b", 3, 21, 11, 6.0, updated=2), self.make_feature("c", 4, -120, 35, 0.1, updated=0)])
+        self.assertEqual(len(self.catalog), 4)
+
+        window = UsgsQuery.QueryWindow.from_url(self.base_url.format("2019-01-01", "2019-01-10", 2))
+        data = self.catalog.query(window)
+        #newest events first, like the event web service
+        self.assertEqual([quake["id"] for quake in data["features"]], ["c", "b", "a"])
+        self.assertEqual(data["features"][1]["properties"]["mag"], 6.0)
+        self.assertEqual(data["metadata"]["count"], 3)
+
+        #a circle search leaves out the event on the other side of the world
+        window = UsgsQuery.QueryWindow.from_url(self.base_url.format("2019-01-01", "2019-01-10", 2)+"&latitude=10&longitude=20&maxradius=5")
+        self.assertEqual([quake["id"] for quake in self.catalog.query(window)["features"]], ["b", "a"])
+
+    def test_missing_windows(self):
+        window = UsgsQuery.QueryWindow.from_url(self.base_url.format("2019-01-01", "2019-01-10", 2))
+        self.assertEqual(len(self.catalog.missing_windows(window)), 1)
+
+        self.catalog.add_coverage(UsgsQuery.QueryWindow.from_url(self.base_url.format("2019-01-03", "2019-01-05", 1)))
+        self.catalog.add_coverage(UsgsQuery.QueryWindow.from_url(self.base_url.format("2019-01-04", "2019-01-07", 1)))
+        gaps = self.catalog.missing_windows(window)
+        self.assertEqual([(UsgsQuery.from_milliseconds(gap.start).day, UsgsQuery.from_milliseconds(gap.end).day) for gap in gaps],
+            [(1, 3), (7, 10)])
+        self.assertIn("starttime=2019-01-07T00:00:00", gaps[1].url(self.base_url.format("2019-01-01", "2019-01-10", 2)))
+
+        #coverage of smaller magnitudes does not cover a query of larger magnitudes, but not the other way round
+        self.assertEqual(len(self.catalog.missing_windows(UsgsQuery.QueryWindow.from_url(self.base_url.format("2019-01-03", "2019-01-06", 1)))), 0)
+        self.assertEqual(len(self.catalog.missing_windows(UsgsQuery.QueryWindow.from_url(self.base_url.format("2019-01-03", "2019-01-06", 0)))), 1)
+
+class TestFetchPlanner(unittest.TestCase):
+    '''
+    This tests that queries over the server limit are split into windows the server can answer and merged again
+    '''
+
+    def setUp(self):
+        #one event every hour through January 2019, with the first event also returned by a later window
+        start = UsgsQuery.to_milliseconds(UsgsQuery.datetime.datetime(2019, 1, 1))
+        self.events = [{"type": "Feature", "id": "us{}".format(hour), "geometry": {"type": "Point", "coordinates": [hour%360-180, 0, 10]},
+            "properties": {"time": start+hour*3600000+1, "updated": 1}} for hour in range(31*24)]
+        self.url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=2019-01-01&endtime=2019-02-01"
+
+    def serve(self, url, **kwargs):
+        window = UsgsQuery.QueryWindow.from_url(url.replace("/count?", "/query?"))
+        matched = [quake for quake in self.events if window.start <= quake["properties"]["time"] <= window.end
+            and window.min_lon <= quake["geometry"]["coordinates"][0] <= window.max_lon]
+        if "/count?" in url:
+            return MockResponse({"count": len(matched)}, 200, True)
+        self.assertIn("limit=100", url)
+        return MockResponse({"features": matched[:100]}, 200, True)
+
+    @mock.patch("HttpClient.get")
+    def test_fetch_all(self, mocked_get):
+        mocked_get.side_effect = self.serve
+        progress = mock.Mock()
+        planner = FetchPlanner.FetchPlanner(self.url, server_limit=100, progress=progress)
+        window = UsgsQuery.QueryWindow.from_url(self.url)
+
+        planned = planner.plan([window])
+        self.assertTrue(all(count <= 100 for part, count in planned))
+        self.assertEqual(sum(count for part, count in planned), len(self.events))
+
+        fetched = []
+        features = planner.fetch_all([window], on_window_fetched=lambda part, part_features, complete: fetched.append(complete))
+        self.assertEqual(len(features), len(self.events))
+        self.assertEqual(features[0]["id"], "us743") #newest first
+        self.assertTrue(all(fetched))
+        progress.assert_called_with(len(fetched), len(fetched), len(self.events))
+
+        #with a limit only the newest windows are fetched
+        mocked_get.reset_mock()
+        features = planner.fetch_all([window], limit=150)
+        self.assertEqual([quake["id"] for quake in features[:2]], ["us743", "us742"])
+        self.assertEqual(len(features), 150)
+        self.assertLess(mocked_get.call_count, 2*len(planned))
+
+        #a stopped planner fetches nothing more
+        mocked_get.reset_mock()
+        stopped = FetchPlanner.threading.Event()
+        stopped.set()
+        planner = FetchPlanner.FetchPlanner(self.url, server_limit=100, stopped=stopped)
+        self.assertEqual(planner.fetch_all([window]), [])
+        mocked_get.assert_not_called()
+
+    @mock.patch("HttpClient.get")
+    def test_split_by_area(self, mocked_get):
+        mocked_get.side_effect = self.serve
+        planner = FetchPlanner.FetchPlanner(self.url, server_limit=100)
+        #every event of a short window, so it has to be split by longitude
+        for quake in self.events:
+            quake["properties"]["time"] = UsgsQuery.to_milliseconds(UsgsQuery.datetime.datetime(2019, 1, 2))
+        window = UsgsQuery.QueryWindow.from_url(self.url.replace("2019-01-01", "2019-01-01T23:45:00").replace("2019-02-01", "2019-01-02T00:30:00"))
+        planned = planner.plan([window])
+        self.assertTrue(all(part.end-part.start == window.end-window.start for part, count in planned))
+        self.assertTrue(all("minlongitude" in planner.fetch_url(part) for part, count in planned))
+        self.assertEqual(len(planner.fetch_all([window])), len(self.events)) #events on the edge of two halves are only kept once
+
+class MockServerHandler(BaseHTTPRequestHandler):
+    '''
+    A small local server for the http client tests, /busy fails once before it answers
+    '''
+    protocol_version = "HTTP/1.1" #keeps connections alive
+    busy_requests = 0
+    client_ports = set() #one port for every connection that was opened
+
+    def do_GET(self):
+        MockServerHandler.client_ports.add(self.client_address[1])
+        body = json.dumps({"features": [{"id": index} for index in range(500)]}).encode("utf-8")
+        if self.path == "/busy" and MockServerHandler.busy_requests == 0:
+            MockServerHandler.busy_requests += 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "")
+        if compressed:
+            body = gzip.compress(body)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TestHttpClient(unittest.TestCase):
+    '''
+    This tests that the shared http client reuses its connections, asks for compressed responses,
+    retries busy servers and counts what it has downloaded
+    '''
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockServerHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.client = HttpClient.HttpClient(backoff=0.01)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get(self):
+        MockServerHandler.client_ports.clear()
+        first = self.client.get(self.url+"/data")
+        second = self.client.get(self.url+"/data")
+        self.assertEqual(len(first.json()["features"]), 500)
+        self.assertEqual(first.headers["Content-Encoding"], "gzip")
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(len(MockServerHandler.client_ports), 1) #the second request used the same connection
+
+        counters = self.client.statistics()["127.0.0.1:{}".format(self.server.server_address[1])]
+        self.assertEqual(counters["requests"], 2)
+        self.assertLess(counters["bytes"], len(first.content)*2) #the compressed size is counted
+
+        #a busy server is tried again
+        self.assertEqual(self.client.get(self.url+"/busy").status_code, 200)
+        self.assertEqual(MockServerHandler.busy_requests, 1)
+
+    def test_save_stream(self):
+        response = self.client.get(self.url+"/data", stream=True)
+        with tempfile.TemporaryFile() as out_file:
+            written = self.client.save_stream(response, out_file)
+            out_file.seek(0)
+            self.assertEqual(len(json.loads(out_file.read())["features"]), 500)
+        self.assertGreater(written, self.client.statistics()["127.0.0.1:{}".format(self.server.server_address[1])]["bytes"])
+
+    def test_retry_policy(self):
+        '''
+        checks that the retried methods are given as method_whitelist to versions of urllib3 without allowed_methods
+        '''
+        def old_retry(total, status_forcelist=None, method_whitelist=None):
+            return method_whitelist
+        with mock.patch("HttpClient.Retry", side_effect=old_retry):
+            self.assertEqual(HttpClient.retry_policy(total=1), {"GET", "HEAD"})
+
+class TestPlaceCache(unittest.TestCase):
+    '''
+    This tests the persistent cache of the wikipedia information about places
+    '''
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.cache = PlaceCache.PlaceCache(os.path.join(self.cache_directory.name, "places.sqlite"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache_directory.cleanup()
+
+    def test_normalize_place(self):
+        self.assertEqual(PlaceCache.normalize_place("Place: 12km SW of Ridgecrest, CA"), "ridgecrest, ca")
+        self.assertEqual(PlaceCache.normalize_place("Place: 3 km N of  Ridgecrest,  CA"), "ridgecrest, ca")
+        self.assertIsNone(PlaceCache.normalize_place("Place: Near the coast of Central Chile"))
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get("ridgecrest, ca"))
+        self.cache.set("ridgecrest, ca", "Ridgecrest, California", "Ridgecrest is a city", b"\x89PNG image")
+        self.cache.set("nowhere", None, False)
+        self.cache.set("esso, russia", "Esso, Russia", "Esso is a village", image_url="https://upload.wikimedia.org/esso.jpg")
+        self.assertEqual(self.cache.get("ridgecrest, ca"), {"title": "Ridgecrest, California", "text": "Ridgecrest is a city",
+            "image": b"\x89PNG image", "image_url": None})
+        self.assertEqual(self.cache.get("nowhere"), {"title": None, "text": False, "image": None, "image_url": None})
+        self.assertEqual(self.cache.get("esso, russia")["image_url"], "https://upload.wikimedia.org/esso.jpg")
+
+        #places without an article expire sooner
+        later = DiskCache.time.time()+PlaceCache.MISSING_TTL+1
+        self.assertIsNone(self.cache.cache.get("nowhere", later))
+        self.assertIsNotNone(self.cache.cache.get("ridgecrest, ca", later))
+
+class TestPlacePrefetcher(unittest.TestCase):
+    '''
+    This tests the ranking of the places to prefetch and the rate budget of the prefetcher
+    '''
+
+    def quake(self, place, sig, mag):
+        return {"properties": {"place": place, "sig": sig, "mag": mag}}
+
+    def test_rank_places(self):
+        features = [self.quake("12km SW of Ridgecrest, CA", 50, 2.1), self.quake("Fiji region", 900, 6.5),
+            self.quake("95km NNW of Hongtu, China", 600, 5.8), self.quake("3km N of ridgecrest,  CA", 700, 5.1),
+            self.quake("40km E of Esso, Russia", 600, 6.0), self.quake(None, 1000, 7.0)]
+        #places are given once, by their most significant earthquake, and places with no distance are left out
+        self.assertEqual(PlacePrefetcher.rank_places(features), ["Place: 3km N of ridgecrest,  CA",
+            "Place: 40km E of Esso, Russia", "Place: 95km NNW of Hongtu, China"])
+        self.assertEqual(PlacePrefetcher.rank_places(features, 1), ["Place: 3km N of ridgecrest,  CA"])
+
+    def test_run(self):
+        features = [self.quake("{}km N of Town {}, CA".format(number, number), number, 4.0) for number in range(1, 6)]
+        #the first place is already cached and the third takes two requests
+        lookup = mock.Mock(side_effect=lambda place_text: 0 if "Town 5" in place_text else 2 if "Town 3" in place_text else 1)
+        prefetcher = PlacePrefetcher.PlacePrefetcher(lookup, limit=4, rate=20)
+        start = time.perf_counter()
+        self.assertEqual(prefetcher.run(features, threading.Event()), 3)
+        self.assertGreaterEqual(time.perf_counter()-start, 0.2) #one wait of the rate budget for each request
+        self.assertEqual([call[0][0] for call in lookup.call_args_list], ["Place: 5km N of Town 5, CA",
+            "Place: 4km N of Town 4, CA", "Place: 3km N of Town 3, CA", "Place: 2km N of Town 2, CA"])
+
+        #a stopped prefetch does not look up any more places
+        stopped = threading.Event()
+        lookup = mock.Mock(side_effect=lambda place_text: stopped.set() or 1)
+        prefetcher = PlacePrefetcher.PlacePrefetcher(lookup, rate=0.01)
+        start = time.perf_counter()
+        self.assertEqual(prefetcher.run(features, stopped), 1)
+        self.assertLess(time.perf_counter()-start, 1)
+
+    def test_run_resolve_all(self):
+        #the most significant places are resolved and looked up before the other places of the dataset are resolved
+        features = [self.quake("{}km N of Town {}, CA".format(number, number), number, 4.0) for number in range(1, 6)]
+        calls = mock.Mock()
+        calls.lookup.return_value = 0
+        prefetcher = PlacePrefetcher.PlacePrefetcher(calls.lookup, calls.resolve_all, limit=2, rate=1000)
+        stopped = threading.Event()
+        prefetcher.run(features, stopped)
+        self.assertEqual(calls.mock_calls, [
+            mock.call.resolve_all(["Place: 5km N of Town 5, CA", "Place: 4km N of Town 4, CA"], stopped, 0.001),
+            mock.call.lookup("Place: 5km N of Town 5, CA"), mock.call.lookup("Place: 4km N of Town 4, CA"),
+            mock.call.resolve_all(["Place: 3km N of Town 3, CA", "Place: 2km N of Town 2, CA", "Place: 1km N of Town 1, CA"], stopped, 0.001)])
+
+class TestWikiBatch(unittest.TestCase):
+    '''
+    This tests the resolution of many places with batched requests to the wikipedia API
+    '''
+
+    PAGES = {
+        "Ridgecrest, California": {"extract": "Ridgecrest is a city", "thumbnail": {"source": "https://upload.wikimedia.org/ridgecrest.jpg"}},
+        "Esso, Russia": {"extract": "Esso is a village"},
+        "California": {"extract": "California is a state"},
+        "Salamanca": {"extract": "Salamanca may refer to:", "pageprops": {"disambiguation": ""}},
+        "Chile": {"extract": "Chile is a country"},
+    }
+    REDIRECTS = {"Ridgecrest, CA": "Ridgecrest, California", "CA": "California"}
+
+    def setUp(self):
+        self.cache_directory = tempfile.TemporaryDirectory()
+        self.place_cache = PlaceCache.PlaceCache(os.path.join(self.cache_directory.name, "places.sqlite"))
+        self.batch = WikiBatch.WikiBatch(self.place_cache, batch_size=2)
+        self.queried = []
+
+    def tearDown(self):
+        self.place_cache.close()
+        self.cache_directory.cleanup()
+
+    def serve(self, url, params=None, **kwargs):
+        #imitates the query API, with its normalized titles, redirects, missing pages and disambiguation pages
+        titles = params["titles"].split("|")
+        self.queried.append(titles)
+        if "Fail" in titles:
+            raise requests.exceptions.ConnectionError()
+        data = {"normalized": [], "redirects": [], "pages": []}
+        for title in titles:
+            if title[0].islower():
+                data["normalized"].append({"from": title, "to": title[0].upper()+title[1:]})
+                title = title[0].upper()+title[1:]
+            if title in self.REDIRECTS:
+                data["redirects"].append({"from": title, "to": self.REDIRECTS[title]})
+                title = self.REDIRECTS[title]
+            data["pages"].append(dict(self.PAGES.get(title, {"missing": True}), title=title))
+        return MockResponse({"batchcomplete": True, "query": data}, 200, True)
+
+    def test_place_candidates(self):
+        self.assertEqual(WikiBatch.place_candidates("Place: 12km SW of Ridgecrest, CA"), ["Ridgecrest, CA", "CA"])
+        self.assertEqual(WikiBatch.place_candidates("Place: 5km E of Esso"), ["Esso"])
+
+    def test_query(self):
+        with mock.patch("HttpClient.get", side_effect=self.serve):
+            results = self.batch.query(["Ridgecrest, CA", "esso, Russia", "Salamanca", "Nowhere"])
+        self.assertEqual(results["Ridgecrest, CA"], {"title": "Ridgecrest, California", "text": "Ridgecrest is a city",
+            "image_url": "https://upload.wikimedia.org/ridgecrest.jpg"})
+        self.assertEqual(results["esso, Russia"]["title"], "Esso, Russia")
+        self.assertEqual(results["Salamanca"], "ambiguous")
+        self.assertIsNone(results["Nowhere"])
+
+    def test_resolve(self):
+        self.place_cache.set("esso, russia", "Esso, Russia", "Esso is a village")
+        place_texts = ["Place: 12km SW of Ridgecrest, CA", "Place: 3km N of Ridgecrest, CA", "Place: 40km E of Esso, Russia",
+            "Place: 53km S of Salamanca, Chile", "Place: 10km N of London, England", "Place: Fiji region", "Place: 1km N of Fail"]
+        with mock.patch("HttpClient.get", side_effect=self.serve):
+            self.assertEqual(self.batch.resolve(place_texts), 3)
+        #the 7 distinct titles of the 5 places not cached yet are asked for 2 at a time
+        self.assertEqual(self.queried, [["Ridgecrest, CA", "CA"], ["Salamanca, Chile", "Chile"], ["London, England", "England"], ["Fail"]])
+        self.assertEqual(self.place_cache.get("ridgecrest, ca")["image_url"], "https://upload.wikimedia.org/ridgecrest.jpg")
+        self.assertEqual(self.place_cache.get("salamanca, chile")["text"], "Chile is a country") #the place has no article so the region is used
+        self.assertEqual(self.place_cache.get("london, england")["text"], False)
+        self.assertIsNone(self.place_cache.get("fail")) #failed requests are not cached
+
+    def test_query_continue(self):
+        #the extracts left out of a response are asked for again with the continue parameters
+        def serve(url, params=None, **kwargs):
+            self.queried.append(params.get("excontinue"))
+            pages = [{"title": "Esso, Russia", "extract": "Esso is a village"}, {"title": "Chile"}]
+            if params.get("excontinue") is None:
+                return MockResponse({"continue": {"excontinue": 1, "continue": "||"}, "query": {"pages": pages}}, 200, True)
+            return MockResponse({"batchcomplete": True, "query": {"pages": [pages[0], dict(pages[1], extract="Chile is a country")]}}, 200, True)
+        with mock.patch("HttpClient.get", side_effect=serve):
+            results = self.batch.query(["Esso, Russia", "Chile"])
+        self.assertEqual(self.queried, [None, 1])
+        self.assertEqual(results["Esso, Russia"]["text"], "Esso is a village")
+        self.assertEqual(results["Chile"]["text"], "Chile is a country")
+        self.assertEqual(self.batch.requests, 2)
+
+        #a page whose extract was never given is left unresolved instead of being cached as missing
+        with mock.patch("HttpClient.get", return_value=MockResponse({"batchcomplete": True,
+                "query": {"pages": [{"title": "Chile"}]}}, 200, True)):
+            self.assertEqual(self.batch.query(["Chile"]), {})
+            self.assertEqual(self.batch.resolve(["Place: 53km S of Chile"]), 0)
+        self.assertIsNone(self.place_cache.get("chile"))
+
+class TestWikiExtract(unittest.TestCase):
+    '''
+    This tests that the text read from the html of wikipedia articles is the same as the text
+    BeautifulSoup gave the earlier versions of the PointInfoPage
+    '''
+
+    ARTICLE = ('<div class="mw-parser-output"><table class="infobox"><tr><td><p>Infobox <a href="/wiki/Kern">Kern</a></p></td></tr>'
+        '</table><p class="mw-empty-elt">\n</p><p><b>Ridgecrest</b> is a city in <a href="/wiki/Kern_County">Kern County</a>, '
+        'California &amp; the <i>Indian Wells Valley</i>.<sup class="reference"><a href="#cite_note-1">[1]</a></sup>\n</p>'
+        '<p>Its population was 27,616<br/>in 2010.[12] &#8211; see <a href="/wiki/China_Lake">China Lake</a>.</p>'
+        '<p>\n<b>Not shown</b></p><ul><li><a href="/wiki/Trona">Trona</a></li></ul><p>Unclosed <div>block</div> after</div>')
+
+    def soup_article(self, html):
+        #the text BeautifulSoup gives, as the PointInfoPage read it before
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, features="lxml")
+        text = "".join(paragraph.get_text() for paragraph in soup.find_all("p") if "\n" not in paragraph)
+        return soup.find("p").getText(), [link.getText() for link in soup.find_all("a")], "".join(re.split(r"\[\d+\]", text))
+
+    def test_parse_article(self):
+        for html in (self.ARTICLE, html_links("Redirect to:", "California"), html_paragraphs("P1 about Esso", "P2 about Esso")):
+            article = WikiExtract.parse_article(html)
+            self.assertEqual((article.first_paragraph(), article.links, article.text()), self.soup_article(html))
+        article = WikiExtract.parse_article(self.ARTICLE)
+        #paragraphs with a newline directly inside them are left out, and so are the appendix links
+        self.assertEqual(article.text(), "Infobox KernIts population was 27,616in 2010. \u2013 see China Lake.Unclosed ")
+        self.assertEqual(WikiExtract.parse_article("").first_paragraph(), "")
+
+class TestTracing(unittest.TestCase):
+    '''
+    This tests the timing of stages, their rolling summary and the Chrome trace file they are written to
+    '''
+
+    def test_disabled(self):
+        tracer = Tracing.Tracer()
+        with tracer.span("plot_points"):
+            pass
+        tracer.record("request_new_data", time.perf_counter())
+        self.assertIs(tracer.span("plot_points"), Tracing.NULL_SPAN)
+        self.assertEqual((tracer.events, tracer.summary()), ([], {}))
+
+    def test_summary(self):
+        tracer = Tracing.Tracer(max_events=15, window=10)
+        tracer.enable()
+        for number in range(20):
+            tracer.record("canvas_draw", 0, (number+1)/1000)
+        with tracer.span("json_parse", bytes=10):
+            pass
+        summary = tracer.summary()
+        #only the latest durations are summarized, but every one is counted
+        self.assertEqual(summary["canvas_draw"]["count"], 20)
+        self.assertAlmostEqual(summary["canvas_draw"]["mean"], 0.0155)
+        self.assertAlmostEqual(summary["canvas_draw"]["p95"], 0.02)
+        self.assertAlmostEqual(summary["canvas_draw"]["last"], 0.02)
+        self.assertEqual(summary["json_parse"]["count"], 1)
+        self.assertEqual((len(tracer.events), tracer.dropped), (15, 6))
+        self.assertEqual(format_timings(summary).splitlines()[1].split()[:2], ["canvas_draw", "20"])
+
+    def test_write(self):
+        tracer = Tracing.Tracer()
+        tracer.enable()
+        with tracer.span("wiki_text_url_request", page="Chile"):
+            time.sleep(0.01)
+        thread = threading.Thread(target=lambda: tracer.record("http_get", tracer.origin+0.5, tracer.origin+0.75))
+        thread.start()
+        thread.join()
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "trace.json")
+            self.assertEqual(tracer.write(filename), 2)
+            with open(filename) as trace_file:
+                trace = json.load(trace_file)["traceEvents"]
+        spans = {event["name"]: event for event in trace if event["ph"] == "X"}
+        self.assertGreaterEqual(spans["wiki_text_url_request"]["dur"], 10000) #in microseconds
+        self.assertEqual(spans["wiki_text_url_request"]["args"], {"page": "Chile"})
+        self.assertEqual((spans["http_get"]["ts"], spans["http_get"]["dur"]), (500000, 250000))
+        self.assertNotEqual(spans["http_get"]["tid"], spans["wiki_text_url_request"]["tid"])
+        self.assertEqual(sum(event["ph"] == "M" for event in trace), 2) #the names of both threads
+
+    def test_note(self):
+        #notes are kept while tracing is switched off, and written to the trace file as instant events while it is on
+        tracer = Tracing.Tracer()
+        tracer.note("startup", "Settings page ready in 0.250s")
+        self.assertEqual(tracer.events, [])
+        tracer.enable()
+        tracer.note("warm_up", "Could not warm up the map")
+        tracer.clear()
+        self.assertEqual([(name, text) for clock, name, text in tracer.latest_notes()],
+            [("startup", "Settings page ready in 0.250s"), ("warm_up", "Could not warm up the map")])
+        tracer.note("live_sync", "Live sync failed")
+        instant = [event for event in tracer.trace_events() if event["ph"] == "i"]
+        self.assertEqual([(event["name"], event["args"]) for event in instant], [("live_sync", {"note": "Live sync failed"})])
+        self.assertNotIn("live_sync", tracer.summary())
+
+    def test_traced(self):
+        function = Tracing.traced("decode")(lambda value: value*2)
+        self.assertEqual(function(2), 4)
+        self.assertEqual(Tracing.summary(), {})
+        Tracing.enable()
+        try:
+            self.assertEqual(function(3), 6)
+            self.assertEqual(Tracing.summary()["decode"]["count"], 1)
+        finally:
+            Tracing.disable()
+            Tracing.shared_tracer.clear()
+
+class TestFetchWorker(unittest.TestCase):
+    '''
+    This tests that fetches run off the calling thread, and that superseded and slow fetches do not call back
+    '''
+
+    def setUp(self):
+        self.worker = FetchWorker.FetchWorker(mock.Mock())
+
+    def wait(self, *jobs):
+        FetchWorker.concurrent.futures.wait([job.future for job in jobs])
+        self.worker.poll()
+
+    def test_submit(self):
+        results, errors = [], []
+        first = self.worker.submit("data", lambda value: value*2, 1, on_done=results.append)
+        second = self.worker.submit("data", lambda value: value*2, 2, on_done=results.append)
+        failing = self.worker.submit("wiki", lambda: 1/0, on_error=errors.append)
+        self.wait(first, second, failing)
+        self.assertEqual(results, [4]) #the first fetch was superseded by the second
+        self.assertIsInstance(errors[0], ZeroDivisionError)
+        self.assertFalse(self.worker.jobs)
+
+    def test_progress_and_timeout(self):
+        release = FetchWorker.threading.Event()
+        def slow_fetch(progress):
+            progress(1, 2, 10)
+            release.wait(5)
+            return "done"
+
+        progress, errors, results = [], [], []
+        job = self.worker.submit("data", slow_fetch, on_done=results.append, on_error=errors.append,
+            on_progress=lambda *values: progress.append(values), timeout=60)
+        while job.progress is None:
+            FetchWorker.time.sleep(0.01)
+        self.worker.poll()
+        self.assertEqual(progress, [(1, 2, 10)])
+        self.assertTrue(self.worker.is_busy("data"))
+
+        job.timeout = 0
+        self.worker.poll()
+        self.assertIsInstance(errors[0], FetchWorker.FetchTimeout)
+        release.set()
+        self.wait(job)
+        self.assertEqual(results, []) #the result of a fetch that timed out is thrown away
+        self.assertFalse(self.worker.is_busy("data"))
+
+    def test_stoppable(self):
+        #check that a superseded stoppable fetch is told to stop, so the fetch after it does not wait for it
+        started = FetchWorker.threading.Event()
+        def long_fetch(stopped):
+            started.set()
+            return "stopped" if stopped.wait(5) else "finished"
+
+        results = []
+        first = self.worker.submit("data", long_fetch, on_done=results.append, stoppable=True)
+        started.wait(5)
+        second = self.worker.submit("data", lambda: "second", on_done=results.append)
+        self.assertTrue(first.stopped.is_set())
+        self.wait(first, second)
+        self.assertEqual(first.future.result(), "stopped")
+        self.assertEqual(results, ["second"])
+
+class TestLiveSync(unittest.TestCase):
+    '''
+    This tests that a live sync only asks for a feed again if it has changed, and only reports the earthquakes that changed
+    '''
+
+    def make_response(self, status_code, features=(), etag=None):
+        response = MockResponse({"features": list(features)}, status_code, status_code < 400)
+        response.headers = {"ETag": etag, "Last-Modified": "Mon, 12 Aug 2019 13:00:00 GMT"} if etag else {}
+        return response
+
+    @mock.patch("HttpClient.get")
+    def test_poll(self, mocked_get):
+        first = [{"id": "ci1", "properties": {"updated": 1}}, {"id": "ci2", "properties": {"updated": 1}}]
+        sync = LiveSync.LiveSync("https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/1.0_hour.geojson", first)
+
+        mocked_get.return_value = self.make_response(304)
+        self.assertEqual(sync.poll(), ([], []))
+        self.assertEqual(mocked_get.call_args[1]["headers"], {}) #nothing to compare against yet
+
+        second = [{"id": "ci3", "properties": {"updated": 1}}, {"id": "ci2", "properties": {"updated": 2}}]
+        mocked_get.return_value = self.make_response(200, second, '"abc"')
+        changed, removed = sync.poll()
+        self.assertEqual([quake["id"] for quake in changed], ["ci3", "ci2"])
+        self.assertEqual(removed, ["ci1"])
+        self.assertEqual(sync.collection()["metadata"]["count"], 2)
+
+        mocked_get.return_value = self.make_response(304)
+        self.assertEqual(sync.poll(), ([], []))
+        self.assertEqual(mocked_get.call_args[1]["headers"]["If-None-Match"], '"abc"')
+        self.assertEqual((sync.polls, sync.unchanged), (3, 2))
+
+        mocked_get.return_value = self.make_response(503)
+        self.assertRaises(requests.exceptions.HTTPError, sync.poll)
+
+    def test_fail_poll(self):
+        #check that a failed poll is reported to on_error and the next poll is still scheduled
+        sync = LiveSync.LiveSync("https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/1.0_hour.geojson")
+        worker, on_error = mock.Mock(), mock.Mock()
+        sync.start(worker, mock.Mock(), on_error)
+        worker.widget.after.reset_mock()
+        error = requests.exceptions.ConnectionError("no connection")
+        sync.fail_poll(error)
+        on_error.assert_called_once_with(error)
+        worker.widget.after.assert_called_once()
+
+class TestBatchRender(unittest.TestCase):
+    '''
+    This tests the headless renderer that turns GeoJSON files into map images without the map page
+    '''
+
+    def test_render_all(self):
+        json_data = {"features": [{"type": "Feature", "id": "ci{}".format(index),
+            "properties": {"mag": index, "updated": 1565616828359},
+            "geometry": {"type": "Point", "coordinates": [130+index, 35, 10]}} for index in range(8)]}
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "quakes.json")
+            with open(source, "w") as out_file:
+                json.dump(json_data, out_file)
+
+            results = BatchRender.render_all([source, os.path.join(directory, "missing.json")], directory,
+                ("png", "svg"), [(None, None), ("japan", (128, 30, 146, 46))], workers=2)
+            #one map per source and region, the missing file is reported rather than stopping the other maps
+            self.assertEqual([count for source, paths, count, seconds in results[:2]], [8, 8])
+            self.assertIsInstance(results[2][2], OSError)
+            for name in ("quakes.png", "quakes.svg", "quakes_japan.png", "quakes_japan.svg"):
+                self.assertTrue(os.path.getsize(os.path.join(directory, name)))
+
+    def test_output_name(self):
+        self.assertEqual(BatchRender.output_name("data/current_data.json"), "current_data")
+        self.assertEqual(BatchRender.output_name("current_data.json", "japan"), "current_data_japan")
+        #different queries to the same endpoint get different names
+        first = BatchRender.output_name("https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&limit=3")
+        second = BatchRender.output_name("https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&limit=5")
+        self.assertTrue(first.startswith("query_"))
+        self.assertNotEqual(first, second)
+        self.assertEqual(BatchRender.parse_region("japan=128,30,146,46"), ("japan", (128, 30, 146, 46)))
 
 class TestSettingsPage(unittest.TestCase):
     '''
@@ -482,44 +1557,111 @@ class TestSettingsPage(unittest.TestCase):
     '''
     
     def setUp(self):
-        self.settings_page = SettingsPage.SettingsPage(None, mock.Mock())
-        self.jsonpath = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))+r"\current_data.json"
+        self.cache_directory = tempfile.TemporaryDirectory() #every test starts with an empty response cache
+        with mock.patch("SettingsPage.RESPONSE_CACHE_FILE", os.path.join(self.cache_directory.name, "responses.sqlite")), \
+                mock.patch("SettingsPage.CATALOG_FILE", os.path.join(self.cache_directory.name, "catalog.sqlite")):
+            self.settings_page = SettingsPage.SettingsPage(None, mock.Mock())
+        self.jsonpath = "current_data.json"
+
+    def request(self, url):
+        #runs a request the way the fetch worker does, but on this thread
+        return self.settings_page.finish_request(url, self.settings_page.fetch_data(url))
 
     def tearDown(self):
-        pass
+        self.settings_page.response_cache.close()
+        self.settings_page.event_catalog.close()
+        self.cache_directory.cleanup()
 
     def test_request_get(self):
-        with mock.patch("SettingsPage.requests.get", side_effect=mocked_request_get) as mocked_get:
+        with mock.patch("HttpClient.get", side_effect=mocked_request_get) as mocked_get:
             long_url  = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=2019-05-05T15:55:03%2B00:00&endtime=2019-05-06T15:55:03%2B00:00&minlatitude=-90&maxlatitude=90&minlongitude=-180&maxlongitude=180&mindepth=-100&maxdepth=1000&minmagnitude=1&maxmagnitude=2&limit=1"
             short_url = "https://earthquake.usgs.gov/fdsnws/event/1/count?format=geojson"
 
-            real_call = self.settings_page.request_new_data(long_url)
+            real_call = self.request(long_url)
 
             #check a valid request and good response
             mocked_get.assert_called_once_with(long_url)
             self.assertTrue(real_call.ok)
             self.assertEqual(real_call.status_code, 200, "Should be 200")
             self.assertEqual(real_call.json_data, {"type":"FeatureCollection","metadata":{"generated":1557156255000,"url":"https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=2019-05-05T15:55:03%2B00:00&endtime=2019-05-06T15:55:03%2B00:00&minlatitude=-90&maxlatitude=90&minlongitude=-180&maxlongitude=180&mindepth=-100&maxdepth=1000&minmagnitude=1&maxmagnitude=2&limit=1","title":"USGS Earthquakes","status":200,"api":"1.8.1","limit":1,"offset":1,"count":1},"features":[{"type":"Feature","properties":{"mag":1.7,"place":"75km S of Kobuk, Alaska","time":1557153499064,"updated":1557153801598,"tz":-540,"url":"https://earthquake.usgs.gov/earthquakes/eventpage/ak0195sm9zcz","detail":"https://earthquake.usgs.gov/fdsnws/event/1/query?eventid=ak0195sm9zcz&format=geojson","felt":None,"cdi":None,"mmi":None,"alert":None,"status":"automatic","tsunami":0,"sig":44,"net":"ak","code":"0195sm9zcz","ids":",ak0195sm9zcz,","sources":",ak,","types":",geoserve,origin,","nst":None,"dmin":None,"rms":0.95,"gap":None,"magType":"ml","type":"earthquake","title":"M 1.7 - 75km S of Kobuk, Alaska"},"geometry":{"type":"Point","coordinates":[-157.2,66.2404,0.1]},"id":"ak0195sm9zcz"}]})
-            self.assertTrue(os.path.isfile(self.jsonpath), True)
+            #check that the parsed data is handed to the controller without writing it to the disk
+            self.settings_page.controller.modify_data.assert_called_once_with(long_url, real_call.json_data)
+            self.assertFalse(os.path.isfile(self.jsonpath))
+
+            #check that the same request is answered by the cache, and that the raw response is written
+            #to the disk when saving is switched on
+            self.settings_page.save_data_variable.set(True)
+            real_call = self.request(long_url)
+            self.assertEqual(real_call, "Cached Data", "Should be a return of 'Cached Data'")
+            mocked_get.assert_called_once_with(long_url)
+            with open(self.jsonpath, "rb") as in_file:
+                self.assertEqual(json.loads(in_file.read()), self.settings_page.controller.modify_data.call_args[0][1])
+            os.remove(self.jsonpath)
+            self.assertEqual(self.settings_page.response_cache.statistics()["hits"], 1)
             
             #check a valid request and bad response
-            real_call = self.settings_page.request_new_data(short_url)
+            real_call = self.request(short_url)
             mocked_get.assert_called_with(short_url)
             self.assertFalse(real_call.ok)
             self.assertEqual(real_call.status_code, 400, "Should be 400")
             self.assertIsNone(real_call.json_data, "Should be None")
-            os.remove(self.jsonpath)
 
             #check a valid request with connectivity issues
-            real_call = self.settings_page.request_new_data(short_url+"&limit=100")
+            real_call = self.request(short_url+"&limit=100")
             mocked_get.assert_called_with(short_url+"&limit=100")
             self.assertEqual(real_call, "Bad Connection", "Should be a return of 'Bad Connection'")
 
+    def test_filter_local_data(self):
+        #check that a narrower query is filtered from a complete query held in memory without a request
+        url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&starttime=2019-05-05&endtime=2019-05-07"
+        features = [{"type": "Feature", "id": "ak{}".format(index), "geometry": {"type": "Point", "coordinates": [-150+index, 60, 10]},
+            "properties": {"mag": index/2, "time": UsgsQuery.to_milliseconds(UsgsQuery.datetime.datetime(2019, 5, 6, index))}}
+            for index in range(10)]
+        self.settings_page.remember_local_data(url, {"metadata": {"count": 10}, "features": features})
+        with mock.patch("HttpClient.get") as mocked_get:
+            outcome, data, content = self.settings_page.fetch_data(url+"&minmagnitude=2&minlongitude=-148&maxlongitude=-142&limit=3")
+            mocked_get.assert_not_called()
+        self.assertEqual(outcome, "Filtered Data")
+        self.assertEqual([quake["id"] for quake in data["features"]], ["ak8", "ak7", "ak6"])
+
+        #a query reaching outside the loaded window still goes to the server
+        with mock.patch("HttpClient.get", side_effect=mocked_request_get) as mocked_get:
+            self.assertNotEqual(self.settings_page.fetch_data(url.replace("05-07", "05-08"))[0], "Filtered Data")
+            mocked_get.assert_called()
+
+    def test_request_new_data(self):
+        #check that requests are made on the data lane of the fetch worker and the same url is not requested twice
+        long_url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&limit=1"
+        self.settings_page.request_new_data(long_url)
+        self.settings_page.request_new_data(long_url)
+        submit = self.settings_page.controller.fetch_worker.submit
+        submit.assert_called_once()
+        self.assertEqual(submit.call_args[0][:3], ("data", self.settings_page.fetch_data, long_url))
+        self.assertEqual(self.settings_page.status_label.cget("text"), "Fetching data...")
+
+        #a timeout hides the progress again
+        submit.call_args[1]["on_error"](SettingsPage.FetchTimeout())
+        self.assertIsNone(self.settings_page.pending_url)
+        self.assertEqual(self.settings_page.status_label.cget("text"), "")
+
+    def test_request_timings(self):
+        #check that a request is timed from request_new_data until its result is handled, while timings are recorded
+        url = "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson&limit=1"
+        self.settings_page.tracing_variable.set(True)
+        self.settings_page.toggle_tracing()
+        try:
+            self.settings_page.request_new_data(url)
+            self.settings_page.finish_request(url, ("Bad Connection", None, None))
+            self.assertEqual(Tracing.summary()["request_new_data"]["count"], 1)
+        finally:
+            Tracing.disable()
+            Tracing.shared_tracer.clear()
+        self.assertIsNone(self.settings_page.request_start)
+
     def test_data_validation(self):
         #check if validation works with default values
         real_call = self.settings_page.validate_data()
         self.assertIsNone(real_call, "Should be None")
-        os.remove(self.jsonpath)
 
         #check if any value for date or time is missing
         self.settings_page.startdate_counter.clear()
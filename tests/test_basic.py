@@ -1,4 +1,5 @@
 import os
+import subprocess
 import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../files")))
@@ -19,11 +20,82 @@ class TestMainMethodCalls(unittest.TestCase):
             mocked(_to)
             mocked.assert_called_with("SettingsPage")
 
+    def test_startup_imports(self):
+        '''
+        checks that importing the main window does not import the map and point info pages, or the numpy
+        and matplotlib they need, so the settings page is shown without waiting for them
+        '''
+        lazy_modules = ("MapPage", "PointInfoPage", "numpy", "matplotlib")
+        output = subprocess.check_output([sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv[1]); import GisMain; "
+            "print(' '.join(name for name in sys.argv[2:] if name in sys.modules))", os.path.dirname(sys.modules["GisMain"].__file__)]
+            + list(lazy_modules), universal_newlines=True)
+        self.assertEqual(output.split(), [])
+
+    def test_get_frame(self):
+        '''
+        checks that a page is imported and built the first time it is asked for, behind the current page, and reused after that
+        '''
+        controller = mock.Mock(frames={})
+        with mock.patch("GisMain.importlib.import_module") as mocked_import:
+            page = GISMain.get_frame(controller, "MapPage")
+            mocked_import.assert_called_once_with("MapPage")
+            page_class = mocked_import.return_value.MapPage
+            page_class.assert_called_once_with(parent=controller.container, controller=controller)
+            self.assertIs(page, page_class.return_value)
+            page.lower.assert_called_once_with()
+
+            self.assertIs(GISMain.get_frame(controller, "MapPage"), page)
+            mocked_import.assert_called_once()
+
+    def test_warm_up(self):
+        '''
+        checks that the warm up thread imports the lazy pages and reports a failure through Tracing instead of raising
+        '''
+        with mock.patch("Tracing.note") as mocked_note, mock.patch("GisMain.importlib.import_module") as mocked_import:
+            mocked_import.side_effect = ImportError("No module named 'mpl_toolkits.basemap'")
+            GISMain.warm_up(mock.Mock())
+            mocked_import.assert_called_once_with("MapPage")
+            mocked_note.assert_called_once_with("warm_up", "Could not warm up the map: No module named 'mpl_toolkits.basemap'")
+
     def test_modify_url(self):
         with mock.patch.object(GISMain, "modify_url") as mocked:
             mocked()
             mocked.assert_called()
 
+    def test_modify_data(self):
+        '''
+        checks that fetched data is kept by the controller in memory along with its url
+        '''
+        controller, data = mock.Mock(), {"features": []}
+        GISMain.modify_data(controller, "https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson", data)
+        self.assertIs(controller.current_data, data)
+        controller.modify_url.assert_called_with("https://earthquake.usgs.gov/fdsnws/event/1/query?format=geojson")
+
+    def test_push_live_data(self):
+        '''
+        checks that live changes only reach a map page that is showing the synced url
+        '''
+        url = "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/1.0_hour.geojson"
+        controller, data = mock.Mock(current_url=url), {"features": []}
+        controller.frames = {"MapPage": mock.Mock(local_url=url)}
+        changed, removed = [{"id": "ci1"}], ["ci2"]
+        GISMain.push_live_data(controller, url, data, changed, removed)
+        self.assertIs(controller.current_data, data)
+        controller.frames["MapPage"].plot_changes.assert_called_once_with(changed, removed)
+        controller.frames["MapPage"].plot_points.assert_not_called()
+
+        GISMain.push_live_data(controller, "https://earthquake.usgs.gov/earthquakes/feed/v1.0/summary/1.0_day.geojson", {}, [], [])
+        self.assertIs(controller.current_data, data)
+
+    def test_call_prefetch_place_info(self):
+        '''
+        checks that the prefetcher of the point info page is started on the controller's fetch worker
+        '''
+        controller, features = mock.Mock(), [{"properties": {"place": "12km SW of Ridgecrest, CA"}}]
+        GISMain.call_prefetch_place_info(controller, features)
+        controller.get_frame.assert_called_once_with("PointInfoPage")
+        controller.get_frame.return_value.place_prefetcher.start.assert_called_once_with(controller.fetch_worker, features)
+
     def test_call_reconnect(self):
         with mock.patch.object(GISMain, "call_reconnect") as mocked:
             mocked()
@@ -36,15 +108,26 @@ class TestMainMethodCalls(unittest.TestCase):
     
     def test_on_close_window(self):
         '''
-        checks if both the 'current_data.json' and 'current_image.png' file are deleted after the window
-        is closed (through the 'WM_DELETE_WINDOW' protocol)
+        checks if the 'current_data.json' file is deleted after the window is closed (through the
+        'WM_DELETE_WINDOW' protocol) unless saving the data to the disk is switched on, images of places
+        are only kept in memory so there are none to delete
         '''
+        settings_page = mock.Mock()
+        controller = mock.Mock(frames={"SettingsPage": settings_page})
         open("current_data.json", "wb").close()
-        open("current_image.png", "wb").close()
-            
-        GISMain.on_close_window(mock.Mock())
-        self.assertFalse(os.path.isfile("current_data.json"))
-        self.assertFalse(os.path.isfile("current_image.png"))
+        try:
+            settings_page.save_data_variable.get.return_value = True
+            with self.assertRaises(SystemExit):
+                GISMain.on_close_window(controller)
+            self.assertTrue(os.path.isfile("current_data.json"))
+
+            settings_page.save_data_variable.get.return_value = False
+            with self.assertRaises(SystemExit):
+                GISMain.on_close_window(controller)
+            self.assertFalse(os.path.isfile("current_data.json"))
+        finally:
+            if os.path.isfile("current_data.json"):
+                os.remove("current_data.json")
 
 class TestSettingsPageMethodCalls(unittest.TestCase):
     '''